@@ -0,0 +1,303 @@
+import config
+import time
+import random
+import torch
+import shutil
+import tempfile
+import numpy as np
+from copy import deepcopy
+from dataprocess.data_loader import Dataset, pad_sequences, pad_nested
+from dataprocess.tensor_store import save_tensor_store, TensorStore
+from dataprocess.data_reader import load_dataset
+from dataprocess.triple_store import build_triples
+
+def preprocess_graph_scan(dataset, graphs):
+    """Dataset.preprocess_graph as it was before the inverted concept index: a vocabulary scan per graph."""
+    G_concept_ids, G_concept_label, G_distance, G_relation, G_head, G_tail, G_triple_label = [], [], [], [], [], [], []
+    vocab_maps = []
+    map_mask = [0 for i in range(dataset.vocab.n_words)]
+    for graph in graphs:
+        concepts = graph["concepts"]
+        vocab_map = []
+        for w, idx in dataset.vocab.word2index.items():
+            try:
+                pos = concepts.index(w)
+                vocab_map.append(pos)
+                map_mask[idx] = 1
+            except ValueError:
+                vocab_map.append(0)
+        G_relation.append(torch.LongTensor([r[0] for r in graph["relations"]]))
+        concepts = [dataset.vocab.word2index[word] if word in dataset.vocab.word2index else config.UNK_idx for word in
+                    concepts]
+        G_concept_ids.append(torch.LongTensor(concepts))
+        G_distance.append(torch.LongTensor(graph["distances"]))
+        G_head.append(torch.LongTensor(graph["head_ids"]))
+        G_tail.append(torch.LongTensor(graph["tail_ids"]))
+        G_triple_label.append(torch.LongTensor(graph["triple_labels"]))
+        G_concept_label.append(torch.LongTensor(graph["labels"]))
+        vocab_maps.append(torch.LongTensor(vocab_map))
+
+    return G_concept_ids, G_concept_label, G_distance, G_relation, G_head, G_tail, G_triple_label, vocab_maps, torch.LongTensor(map_mask)
+
+def json_graph(store, index):
+    """Graph `index` of a GraphStore in the JSON-lines form preprocess_graph_scan reads."""
+    graph = {name: column.tolist() for name, column in store[index].items()}
+    graph["concepts"] = [store.concepts[c] for c in graph["concepts"]]
+    graph["relations"] = [[r] for r in graph["relations"]]
+    return graph
+
+def bench_graph():
+    """Per-sample latency of building the concept-to-vocab pointer maps on the train split."""
+    data_tra, _, _, vocab = load_dataset()
+    dataset = Dataset(data_tra, vocab)
+    indices = np.random.choice(len(dataset), min(config.bench_samples, len(dataset)), replace=False)
+    samples = [[dataset.data["graphs"][id] for id in dataset.data["graphidx"][str(index)]] for index in indices]
+    json_samples = [[json_graph(dataset.data["graphs"], id) for id in dataset.data["graphidx"][str(index)]]
+                    for index in indices]
+
+    start = time.perf_counter()
+    for graphs in json_samples:
+        preprocess_graph_scan(dataset, graphs)
+    before = (time.perf_counter() - start) / len(samples)
+
+    start = time.perf_counter()
+    for graphs in samples:
+        dataset.preprocess_graph(graphs)
+    after = (time.perf_counter() - start) / len(samples)
+
+    print('preprocess_graph on {} train samples (vocab {})'.format(len(samples), vocab.n_words))
+    print('before: {:.3f} ms/sample  after: {:.3f} ms/sample  speedup: {:.1f}x'.format(
+        before * 1000, after * 1000, before / max(after, 1e-9)))
+
+def bfs(start, triple_dict, source):
+    """triple_store.bfs before shortest_path_edges: enumerates every walk of up to 3 incoming triples."""
+    paths = [[[start]]]
+    shortest_paths = []
+    count = 0
+    while True:
+        last_paths = paths[-1]
+        new_paths = []
+        for path in last_paths:
+            if triple_dict.get(path[-1], False):
+                triples = triple_dict[path[-1]]
+                for triple in triples:
+                    new_paths.append(path + [triple[0]])
+
+        for path in new_paths:
+            if path[-1] in source:
+                shortest_paths.append(path)
+
+        if count == 2:
+            break
+        paths.append(new_paths)
+        count += 1
+
+    return shortest_paths
+
+def build_triples_scan(e, max_concepts=400, max_triple=1000, max_neighbors=5):
+    """The per-example loop of triple_store.directed_triple before it was hash-indexed."""
+    triple_dict = {}
+    triples = e['triples']
+    concepts = e['concepts']
+    labels = e['labels']
+    distances = e['distances']
+    for t in triples:
+        head, tail = t[0], t[-1]
+        head_id = concepts.index(head)
+        tail_id = concepts.index(tail)
+        if distances[head_id] <= distances[tail_id]:
+            if t[-1] not in triple_dict:
+                triple_dict[t[-1]] = [t]
+            else:
+                if len(triple_dict[t[-1]]) < max_neighbors:
+                    triple_dict[t[-1]].append(t)
+
+    results = [c for l, c in zip(labels, concepts) if l == 1]
+    causes = [c for d, c in zip(distances, concepts) if d == 0]
+
+    shortest_paths = []
+    for result in results:
+        shortest_paths.extend(bfs(result, triple_dict, causes))
+
+    ground_truth_concepts = []
+    ground_truth_triples = []
+    for path in shortest_paths:
+        for i, n in enumerate(path[:-1]):
+            ground_truth_triples.append((n, path[i + 1]))
+            ground_truth_concepts.append(n)
+            ground_truth_concepts.append(path[i + 1])
+    ground_truth_concepts = list(set(ground_truth_concepts))
+    ground_truth_triples_set = set(ground_truth_triples)
+
+    _triples, triple_labels = [], []
+    for e1, e2 in ground_truth_triples_set:
+        for t in triple_dict[e1]:
+            if e2 in t:
+                _triples.append(t)
+                triple_labels.append(1)
+
+    for k, v in triple_dict.items():
+        for t in v:
+            if t in _triples:
+                continue
+            _triples.append(t)
+            triple_labels.append(0)
+
+    heads = []
+    tails = []
+    relations = []
+    for triple in _triples:
+        try:
+            h = concepts.index(triple[0])
+            t = concepts.index(triple[-1])
+            heads.append(h)
+            tails.append(t)
+            relations.append(triple[1])
+            if len(heads) == max_triple:
+                break
+        except ValueError:
+            continue
+
+    e['relations'] = relations
+    e['head_ids'] = heads
+    e['tail_ids'] = tails
+    e['triple_labels'] = triple_labels[:max_triple]
+    e.pop('triples')
+    return e
+
+def synthetic_graph(triple_num=1000, concept_num=400, relation_num=47, seed=0):
+    """A path-finding example shaped like find_path output: 3 distance levels, targets among the farthest."""
+    rng = random.Random(seed)
+    concepts = ['concept{}'.format(i) for i in range(concept_num)]
+    distances = [0 if i < concept_num // 8 else 1 if i < concept_num // 2 else 2 for i in range(concept_num)]
+    labels = [1 if d == 2 and rng.random() < 0.1 else 0 for d in distances]
+    triples, seen = [], set()
+    while len(triples) < triple_num:
+        h, t = rng.randrange(concept_num), rng.randrange(concept_num)
+        if h == t or (h, t) in seen:
+            continue
+        seen.add((h, t))
+        triples.append([concepts[h], [rng.randrange(relation_num)], concepts[t]])
+    return {'concepts': concepts, 'labels': labels, 'distances': distances, 'triples': triples}
+
+def labelled_triples(e):
+    """The (head, tail, relation, label) multiset of a built graph; ground-truth order used to follow set order."""
+    return sorted(zip(e['head_ids'], e['tail_ids'], map(tuple, e['relations']), e['triple_labels']))
+
+def bench_triple():
+    """Latency of building the triple store of one 1000-triple graph, before and after indexing and frontier search."""
+    e = synthetic_graph()
+    runs = max(config.bench_samples // 100, 1)
+    # >>>>>>>>>> both builders work in place, so every run gets its own copy, made outside the timer >>>>>>>>>> #
+    before_inputs = [deepcopy(e) for _ in range(runs)]
+    after_inputs = [deepcopy(e) for _ in range(runs)]
+
+    start = time.perf_counter()
+    for example in before_inputs:
+        before_out = build_triples_scan(example)
+    before = (time.perf_counter() - start) / runs
+
+    start = time.perf_counter()
+    for example in after_inputs:
+        after_out = build_triples(example)
+    after = (time.perf_counter() - start) / runs
+
+    assert before_out['concepts'] == after_out['concepts'], 'triple store concepts differ from the list scan'
+    assert labelled_triples(before_out) == labelled_triples(after_out), 'triple store differs from the list scan'
+    print('directed_triple on a {}-triple graph, {} runs'.format(len(e['triples']), runs))
+    print('before: {:.3f} ms/graph  after: {:.3f} ms/graph  speedup: {:.1f}x'.format(
+        before * 1000, after * 1000, before / max(after, 1e-9)))
+
+def bench_dataset():
+    """Data time of Dataset.__getitem__ over the train split, building every item versus reading a TensorStore."""
+    data_tra, _, _, vocab = load_dataset()
+    dataset = Dataset(data_tra, vocab)
+    n = min(config.bench_samples, len(dataset))
+    save_path = tempfile.mkdtemp()
+    try:
+        start = time.perf_counter()
+        save_tensor_store((dataset.example_tensors(index) for index in range(n)), save_path, total=n)
+        build = (time.perf_counter() - start) / n
+        cached = Dataset(data_tra, vocab, TensorStore(save_path))
+
+        start = time.perf_counter()
+        for index in range(n):
+            dataset[index]
+        before = (time.perf_counter() - start) / n
+
+        start = time.perf_counter()
+        for index in range(n):
+            cached[index]
+        after = (time.perf_counter() - start) / n
+    finally:
+        shutil.rmtree(save_path)
+
+    print('Dataset.__getitem__ on {} train samples, {:.1f}s per epoch of {} to materialise'.format(
+        n, build * len(dataset), len(dataset)))
+    print('before: {:.1f}s/epoch  after: {:.1f}s/epoch  speedup: {:.1f}x'.format(
+        before * len(dataset), after * len(dataset), before / max(after, 1e-9)))
+
+def merge_loop(sequences, single=True, pad=1):
+    """collate_fn's merge before pad_sequences and pad_nested: a row copy per sequence."""
+    if single:
+        lengths = [len(seq) for seq in sequences]
+        padded_seqs = torch.ones(len(sequences), max(lengths)).long()
+        padded_seqs *= pad
+        for i, seq in enumerate(sequences):
+            end = lengths[i]
+            padded_seqs[i, :end] = seq[:end]
+        return padded_seqs, lengths
+    else:
+        doc_lengths = [len(doc) for doc in sequences]
+        seq_lengths = [max([len(seq) for seq in doc]) if len(doc) else 0 for doc in sequences]
+        padded_seqs = torch.ones(len(sequences), max(doc_lengths), max(seq_lengths)).long()
+        padded_seqs *= pad
+        for i, doc in enumerate(sequences):
+            for j, seq in enumerate(doc):
+                end = len(seq)
+                padded_seqs[i, j, :end] = seq[:end]
+        lengths = [[len(seq) for seq in doc]+[0 for i in range(max(doc_lengths)-len(doc))] for doc in sequences]
+        return padded_seqs, lengths
+
+def synthetic_fields(bsz, rng):
+    """The merged fields of one batch, shaped like train items: (single, fields) per collate_fn merge group."""
+    def sequences(n, low, high):
+        return [torch.randint(0, 1000, (rng.randint(low, high),)) for _ in range(n)]
+    context = [sequences(1, 30, 200)[0] for _ in range(bsz)]
+    clauses = [sequences(rng.randint(3, 16), 3, 25) for _ in range(bsz)]
+    causes = [sequences(rng.randint(0, 4), 3, 20) for _ in range(bsz)]
+    targets = [sequences(5, 5, 40) for _ in range(bsz)]
+    graph_nums = [rng.randint(1, 5) for _ in range(bsz)]
+    concepts = [sequences(n, 20, config.max_mem_size) for n in graph_nums]
+    triples = [sequences(n, 20, config.max_triple_size) for n in graph_nums]
+    return [(True, [context, context, context, [t[0] for t in targets]]),
+            (False, [clauses, causes, targets] + [concepts] * 5 + [triples] * 4)]
+
+def bench_collate():
+    """Latency of padding the 14 merged fields of a batch of bz, per-row copies versus one scatter per field."""
+    rng = random.Random(0)
+    batches = [synthetic_fields(config.bz, rng) for _ in range(max(config.bench_samples // 100, 1))]
+
+    def run(single_fn, nested_fn):
+        outputs = []
+        start = time.perf_counter()
+        for batch in batches:
+            for single, fields in batch:
+                outputs += [single_fn(field) if single else nested_fn(field) for field in fields]
+        return outputs, (time.perf_counter() - start) / len(batches)
+
+    before_out, before = run(lambda f: merge_loop(f), lambda f: merge_loop(f, single=False))
+    after_out, after = run(pad_sequences, pad_nested)
+    for (x, x_lengths), (y, y_lengths) in zip(before_out, after_out):
+        assert torch.equal(x, y) and x_lengths == y_lengths, 'padded batch differs from the row loop'
+    print('padding {} batches of {} with up to {} graphs of {} triples'.format(
+        len(batches), config.bz, 5, config.max_triple_size))
+    print('before: {:.3f} ms/batch  after: {:.3f} ms/batch  speedup: {:.1f}x'.format(
+        before * 1000, after * 1000, before / max(after, 1e-9)))
+
+if __name__ == '__main__':
+    np.random.seed(0)
+    benchmarks = {'graph': bench_graph, 'triple': bench_triple, 'dataset': bench_dataset, 'collate': bench_collate}
+    if config.bench not in benchmarks:
+        raise ValueError('`bench` must be one of {}'.format(list(benchmarks.keys())))
+    benchmarks[config.bench]()
@@ -13,11 +13,12 @@ import argparse, os, torch
 parser = argparse.ArgumentParser()
 parser.add_argument('--dataset', type=str, default='empathetic_dialogues', help='`empathetic_dialogues`, `cornell_movie` or `dailydialog`')
 parser.add_argument("--model", type=str, default="cause-effect", help='model can be one of `cause-effect`, `act`, `s2s `, `trs`, `w.o/refer`, `w.o/encoder`, `w.o/graph`,`multiexpert`, `mime`, and `multihop`')
-dataset = parser.parse_args().dataset
+dataset = parser.parse_known_args()[0].dataset
 if dataset not in ['empathetic_dialogues', 'cornell_movie', 'dailydialog']:
     raise ValueError('dataste not be one of `empathetic_dialogues`, `cornell_movie` or `dailydialog`')
 parser.add_argument('--data_dict', type=str, default='../data/{}/'.format(dataset), help='name of data dictionary')
 parser.add_argument('--data_path', type=str, default='../data/{}/dataset_preproc.p'.format(dataset), help='name of data file')
+parser.add_argument('--data_compiled', type=str, default='../data/{}/compiled/'.format(dataset), help='directory of the memory-mapped token-id dataset')
 parser.add_argument('--data_vocab', type=str, default='../data/{}/vocab.txt'.format(dataset), help='name of data vocabulary file')
 parser.add_argument('--glove_path', type=str, default='../glove.6B/glove.6B.300d.txt'.format(dataset), help='name of vocab embedding file')
 parser.add_argument("--emb_path", type=str, default="utils/embedding.txt")
@@ -28,6 +29,7 @@ parser.add_argument('--concept_vocab', type=str, default='', help='name of conce
 parser.add_argument('--concept_rel', type=str, default='', help='name of concept relation file')
 parser.add_argument('--conceptnet', type=str, default='', help='name of conceptnet file')
 parser.add_argument('--conceptnet_graph', type=str, default='', help='name of conceptnet graph file')
+parser.add_argument('--conceptnet_csr', type=str, default='', help='name of conceptnet CSR adjacency directory, built from --conceptnet when missing or stale')
 parser.add_argument('--triple_dict', type=str, default='', help='name of conceptnet graph file')
 parser.add_argument("--emo_combine", type=str, default="gate", help="can be `gate` or `attn`")
 parser.add_argument("--emo_input", type=str, default="self_att", help="can be `cross_att` or `self_att`") # cross_att; self_att
@@ -68,6 +70,38 @@ parser.add_argument("--max_graph", type=int, default=5)
 parser.add_argument("--max_mem_size", type=int, default=400)
 parser.add_argument("--max_triple_size", type=int, default=1000)
 
+## batching
+parser.add_argument("--num_workers", type=int, default=0, help="DataLoader worker processes building batches")
+parser.add_argument("--pin_memory", action="store_true", help="collate batches into pinned memory for asynchronous device copies")
+parser.add_argument("--prefetch_factor", type=int, default=2, help="batches prefetched by each DataLoader worker")
+parser.add_argument("--persistent_workers", action="store_true", help="keep DataLoader workers alive between epochs")
+parser.add_argument("--prefetch_batches", type=int, default=0, help="train batches kept ready by a background thread, 0 to load them in the training loop")
+parser.add_argument("--presample_negatives", action="store_true", help="draw the fake targets of all examples at once every epoch instead of per item")
+parser.add_argument("--tensor_cache", action="store_true", help="materialise the deterministic item tensors of every split once and read them from disk")
+parser.add_argument("--max_tokens", type=int, default=0, help="token budget per train/valid batch (context + padded graph triples), 0 for fixed --bz batches")
+parser.add_argument("--bucket", action="store_true", help="batch train/valid examples by context length and graph size")
+parser.add_argument("--bucket_context", type=str, default="48,64,96,128,192", help="context length bucket boundaries")
+parser.add_argument("--bucket_graph", type=str, default="250,500,1000,2000,4000", help="padded graph triples bucket boundaries")
+
+## preprocessing
+parser.add_argument("--stage_workers", type=int, default=1, help="number of preprocessing stages run at once")
+parser.add_argument("--path_hops", type=int, default=2, help="hops T between cause and result concepts when finding paths")
+parser.add_argument("--path_max_B", type=int, default=25, help="neighbours kept per hop when finding paths")
+parser.add_argument("--path_max_search", type=int, default=12, help="neighbours searched per concept when finding paths")
+parser.add_argument("--vocab_min_count", type=int, default=0, help="train-split count below which words map to UNK")
+parser.add_argument("--vocab_max_size", type=int, default=0, help="largest vocabulary kept, 0 for no limit")
+parser.add_argument("--ground_batch_size", type=int, default=1000, help="batch size of nlp.pipe when grounding concepts")
+parser.add_argument("--ground_process", type=int, default=1, help="number of processes of nlp.pipe when grounding concepts")
+parser.add_argument("--path_workers", type=int, default=1, help="number of worker processes finding concept paths")
+parser.add_argument("--path_shard_size", type=int, default=500, help="number of concept pairs per path-finding task")
+parser.add_argument("--tokenize_workers", type=int, default=1, help="number of worker processes tokenizing utterances")
+parser.add_argument("--triple_workers", type=int, default=1, help="number of worker processes building triple stores")
+parser.add_argument("--triple_shard_bytes", type=int, default=1 << 25, help="bytes of path file per triple-store shard")
+
+## benchmark
+parser.add_argument("--bench", type=str, default="graph", help="benchmark run by benchmark.py")
+parser.add_argument("--bench_samples", type=int, default=1000, help="number of samples timed by benchmark.py")
+
 def print_opts(opts):
     """Prints the values of all command-line arguments.
     """
@@ -95,6 +129,8 @@ heads = arg.heads
 depth = arg.depth
 filter = arg.filter
 hop_num = arg.hop_num
+max_mem_size = arg.max_mem_size
+max_triple_size = arg.max_triple_size
 pretrain_emb = arg.pretrain_emb
 label_smoothing = arg.label_smoothing
 weight_sharing = arg.weight_sharing
@@ -117,6 +153,7 @@ data_concept_dict = arg.data_dict + 'concept/'
 if not os.path.exists(data_npy_dict):
     os.mkdir(data_npy_dict)
 data_path = arg.data_path
+data_compiled = arg.data_compiled
 data_vocab = arg.data_vocab
 embed_path = arg.glove_path
 emb_path = arg.emb_path
@@ -127,6 +164,7 @@ concept_vocab = arg.concept_vocab if arg.concept_vocab else '../conceptnet/conce
 concept_rel = arg.concept_rel if arg.concept_rel else '../conceptnet/relation.txt'
 conceptnet = arg.conceptnet if arg.conceptnet else '../conceptnet/concept.en.csv'
 conceptnet_graph = arg.conceptnet_graph if arg.conceptnet_graph else '../conceptnet/concept.graph'
+conceptnet_csr = arg.conceptnet_csr if arg.conceptnet_csr else '../conceptnet/concept_csr/'
 
 # >>>>>>>>>> training parameters >>>>>>>>>> #
 bz = arg.bz
@@ -135,4 +173,35 @@ schedule = arg.schedule
 weight_decay = lr * 0.01
 test = arg.test
 beam_size = arg.beam_size
-device = 'cuda' if torch.cuda.is_available() else 'cpu'
\ No newline at end of file
+device = 'cuda' if torch.cuda.is_available() else 'cpu'
+# >>>>>>>>>> batching parameters >>>>>>>>>> #
+num_workers = arg.num_workers
+pin_memory = arg.pin_memory
+prefetch_factor = arg.prefetch_factor
+persistent_workers = arg.persistent_workers
+prefetch_batches = arg.prefetch_batches
+presample_negatives = arg.presample_negatives
+tensor_cache = arg.tensor_cache
+max_tokens = arg.max_tokens
+bucket = arg.bucket
+bucket_context = [int(b) for b in arg.bucket_context.split(',') if b]
+bucket_graph = [int(b) for b in arg.bucket_graph.split(',') if b]
+
+# >>>>>>>>>> preprocessing parameters >>>>>>>>>> #
+stage_workers = arg.stage_workers
+path_hops = arg.path_hops
+path_max_B = arg.path_max_B
+path_max_search = arg.path_max_search
+vocab_min_count = arg.vocab_min_count
+vocab_max_size = arg.vocab_max_size
+ground_batch_size = arg.ground_batch_size
+ground_process = arg.ground_process
+path_workers = arg.path_workers
+path_shard_size = arg.path_shard_size
+tokenize_workers = arg.tokenize_workers
+triple_workers = arg.triple_workers
+triple_shard_bytes = arg.triple_shard_bytes
+
+# >>>>>>>>>> benchmark parameters >>>>>>>>>> #
+bench = arg.bench
+bench_samples = arg.bench_samples
@@ -1,3 +1,6 @@
+import os
+import json
+import numpy as np
 import pandas as pd
 from tqdm import tqdm
 
@@ -47,3 +50,179 @@ def save_net():
         graph.add_edge(end, start, rel=rel+len(relation2id), weight=weight)
 
     write_gpickle(graph, config.conceptnet_graph)
+
+def source_stamp(paths):
+    """Size and mtime of every file a store is built from, saved with the store to tell when it is stale."""
+    return [[path, os.path.getsize(path), os.path.getmtime(path)] if os.path.exists(path) else [path, None]
+            for path in paths]
+
+class CSRGraph:
+    """
+    Read-only ConceptNet adjacency in CSR form. The out-edges of concept u are
+    neighbors[offsets[u]:offsets[u+1]], in the order save_net adds them to the networkx
+    MultiDiGraph, with the relation and weight of each edge in rels and weights at the same
+    positions. nodes lists the concepts in the order the MultiDiGraph first sees them.
+    """
+    fields = ['offsets', 'neighbors', 'rels', 'weights', 'nodes']
+
+    def __init__(self, offsets, neighbors, rels, weights, nodes):
+        self.offsets = offsets
+        self.neighbors = neighbors
+        self.rels = rels
+        self.weights = weights
+        self.nodes = nodes
+
+    @classmethod
+    def load(cls, path, mmap_mode=None):
+        """
+        With mmap_mode='r' the arrays are memory-mapped read-only instead of read into memory, so
+        every preprocessing process that loads the same store shares one copy through the page cache.
+        """
+        return cls(*[np.load(os.path.join(path, '{}.npy'.format(name)), mmap_mode=mmap_mode) for name in cls.fields])
+
+    def save(self, path, sources=()):
+        if not os.path.exists(path):
+            os.makedirs(path)
+        for name in self.fields:
+            np.save(os.path.join(path, '{}.npy'.format(name)), getattr(self, name))
+        # >>>>>>>>>> written last, so a store cut off while saving never looks current >>>>>>>>>> #
+        with open(os.path.join(path, 'sources.json'), 'w') as f:
+            json.dump(source_stamp(sources), f)
+
+    @classmethod
+    def is_current(cls, path, sources):
+        """Whether the store at `path` has all its arrays and was built from `sources` as they are now."""
+        stamp_path = os.path.join(path, 'sources.json')
+        if not os.path.exists(stamp_path) or \
+                not all(os.path.exists(os.path.join(path, '{}.npy'.format(name))) for name in cls.fields):
+            return False
+        with open(stamp_path, 'r') as f:
+            return json.load(f) == source_stamp(sources)
+
+    def __contains__(self, node):
+        return 0 <= node < len(self.offsets) - 1 and self.offsets[node] < self.offsets[node + 1]
+
+    def __getitem__(self, node):
+        """Distinct neighbours of `node`, in first-edge order."""
+        return list(dict.fromkeys(self.neighbors[self.offsets[node]:self.offsets[node + 1]].tolist()))
+
+    def edge_relations(self, src, tgt):
+        """Distinct relation ids on the edges from `src` to `tgt`, empty if there is none."""
+        start, end = self.offsets[src], self.offsets[src + 1]
+        return list(set(self.rels[start:end][self.neighbors[start:end] == tgt].tolist()))
+
+class SimpleCSRGraph(CSRGraph):
+    """
+    Undirected view of a CSRGraph, as the networkx Graph cpnet_simple in find_path: one edge per
+    concept pair, weighted by the summed weight of all edges between the pair in either direction.
+    neighbors is sorted by id within every concept for lookups; the distinct relations of the
+    directed edges src -> tgt of edge e are kept in rel_ids[rel_offsets[e]:rel_offsets[e+1]].
+    adjacency holds the same neighbours in the order cpnet_simple lists them, which decides how
+    find_neighbours_frequency breaks ties between equally similar concepts.
+    """
+    fields = ['offsets', 'neighbors', 'weights', 'rel_offsets', 'rel_ids', 'adjacency']
+
+    def __init__(self, offsets, neighbors, weights, rel_offsets, rel_ids, adjacency):
+        self.offsets = offsets
+        self.neighbors = neighbors
+        self.weights = weights
+        self.rel_offsets = rel_offsets
+        self.rel_ids = rel_ids
+        self.adjacency = adjacency
+
+    @classmethod
+    def from_csr(cls, graph):
+        node_num = len(graph.offsets) - 1
+        src = np.repeat(np.arange(node_num, dtype=np.int64), np.diff(graph.offsets))
+        dst = np.asarray(graph.neighbors, dtype=np.int64)
+
+        # >>>>>>>>>> merge the edges of both directions into one weighted edge per pair >>>>>>>>>> #
+        keys = np.concatenate([src * node_num + dst, dst * node_num + src])
+        pairs, inverse = np.unique(keys, return_inverse=True)
+        weights = np.bincount(inverse, weights=np.concatenate([graph.weights, graph.weights])).astype(np.float32)
+        offsets = np.zeros(node_num + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum(np.bincount(pairs // node_num, minlength=node_num))
+
+        # >>>>>>>>>> distinct relations of every directed edge, grouped in the order of pairs >>>>>>>>>> #
+        rel_num = int(graph.rels.max()) + 1 if len(graph.rels) else 1
+        edge_rels = np.unique((src * node_num + dst) * rel_num + np.asarray(graph.rels, dtype=np.int64))
+        rel_offsets = np.append(np.searchsorted(edge_rels // rel_num, pairs), len(edge_rels))
+
+        # >>>>>>>>>> cpnet_simple adds the pairs as cpnet.edges() yields them: nodes in insertion order, >>>>>>>>>> #
+        # >>>>>>>>>> then each node's distinct successors in first-edge order >>>>>>>>>> #
+        edges, first = np.unique(src * node_num + dst, return_index=True)
+        node_rank = np.zeros(node_num, dtype=np.int64)
+        node_rank[np.asarray(graph.nodes, dtype=np.int64)] = np.arange(len(graph.nodes))
+        step = np.empty(len(edges), dtype=np.int64)
+        step[np.lexsort((first, node_rank[edges // node_num]))] = np.arange(len(edges))
+        # >>>>>>>>>> a pair is listed under both of its concepts at the first step that adds it >>>>>>>>>> #
+        pair_keys = np.concatenate([edges, (edges % node_num) * node_num + edges // node_num])
+        order = np.lexsort((np.concatenate([step, step]), pair_keys))
+        is_first = np.append(True, pair_keys[order][1:] != pair_keys[order][:-1])
+        pair_step = np.concatenate([step, step])[order][is_first]
+        adjacency = (pairs % node_num)[np.lexsort((pair_step, pairs // node_num))]
+
+        return cls(offsets, (pairs % node_num).astype(np.int32), weights, rel_offsets,
+                   (edge_rels % rel_num).astype(np.int16), adjacency.astype(np.int32))
+
+    def __getitem__(self, node):
+        return self.adjacency[self.offsets[node]:self.offsets[node + 1]].tolist()
+
+    def edge_range(self, src, tgt):
+        start, end = self.offsets[src], self.offsets[src + 1]
+        neighbors = self.neighbors[start:end]
+        return start + np.searchsorted(neighbors, tgt, 'left'), start + np.searchsorted(neighbors, tgt, 'right')
+
+    def edge_index(self, src, tgt):
+        """Position of the edge src - tgt in neighbors, or -1 if the concepts are not adjacent."""
+        lo, hi = self.edge_range(src, tgt)
+        return lo if lo < hi else -1
+
+    def weight(self, src, tgt):
+        e = self.edge_index(src, tgt)
+        return float(self.weights[e]) if e != -1 else 0.0
+
+    def edge_relations(self, src, tgt):
+        e = self.edge_index(src, tgt)
+        if e == -1:
+            return []
+        return self.rel_ids[self.rel_offsets[e]:self.rel_offsets[e + 1]].tolist()
+
+def csr_sources():
+    """The files save_csr reads, whose stamp is kept with the CSR store."""
+    return [config.conceptnet, config.concept_vocab, config.concept_rel]
+
+def save_csr():
+    """
+    Vectorized counterpart of save_net: filters and maps the ConceptNet CSV in bulk and stores a CSRGraph
+    at config.conceptnet_csr. find_path.load_cpnet calls it whenever the store is missing or older
+    than the CSV and vocabularies it is built from.
+    """
+    concept2id, relation2id, id2relation, id2concept = load_resources()
+    conceptnet = pd.read_csv(config.conceptnet, sep='\t', encoding='UTF8')
+    start, end, rel, weight = [conceptnet.iloc[:, i] for i in range(4)]
+    start, end, rel = start.astype(str), end.astype(str), rel.astype(str)
+
+    stopwords = set(nltk_stopwords)
+    keep = (start != end) & ~start.isin(stopwords) & ~end.isin(stopwords) & (rel != 'HasContext')
+    start = start[keep].map(concept2id).to_numpy(dtype=np.int64)
+    end = end[keep].map(concept2id).to_numpy(dtype=np.int64)
+    rel = rel[keep].map(relation2id).to_numpy(dtype=np.int64)
+    weight = weight[keep].to_numpy(dtype=np.float32)
+    print('kept {} of {} edges'.format(len(start), len(conceptnet)))
+
+    # >>>>>>>>>> every edge is stored in both directions, the reverse one with an offset relation id, >>>>>>>>>> #
+    # >>>>>>>>>> interleaved as save_net adds them and grouped by source with a stable sort >>>>>>>>>> #
+    src = np.stack([start, end], axis=1).reshape(-1)
+    dst = np.stack([end, start], axis=1).reshape(-1)
+    rels = np.stack([rel, rel + len(relation2id)], axis=1).reshape(-1)
+    weights = np.stack([weight, weight], axis=1).reshape(-1)
+    order = np.argsort(src, kind='stable')
+    _, first = np.unique(src, return_index=True)
+
+    offsets = np.zeros(len(concept2id) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum(np.bincount(src, minlength=len(concept2id)))
+    graph = CSRGraph(offsets, dst[order].astype(np.int32), rels[order].astype(np.int16), weights[order],
+                     src[np.sort(first)].astype(np.int32))
+    graph.save(config.conceptnet_csr, csr_sources())
+    return graph
@@ -173,8 +173,9 @@ def sample_fake(ty="train"):
     np.save(config.data_npy_dict + 'sys_fake_same_act.{}.npy'.format(ty), fake_same_act)
     np.save(config.data_npy_dict + 'sys_fake_same_emo.{}.npy'.format(ty), fake_same_emo)
 
-# add_act()
-sample_fake("train")
-# sample_fake("valid")
-# sample_fake("test")
+if __name__ == '__main__':
+    # add_act()
+    sample_fake("train")
+    # sample_fake("valid")
+    # sample_fake("test")
 
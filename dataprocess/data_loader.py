@@ -1,12 +1,15 @@
 import torch
 import torch.utils.data as data
 import logging
+import contextlib
 import config
 import pprint
 import numpy as np
 pp = pprint.PrettyPrinter(indent=1)
 from models.common_layer import write_config
-from dataprocess.data_reader import load_dataset
+from dataprocess.data_reader import load_dataset, FrozenLang
+from dataprocess.token_store import TokenStore
+from dataprocess.tensor_store import save_tensor_store, TensorStore
 # from vaderSentiment.vaderSentiment import SentimentIntensityAnalyzer
 
 torch.manual_seed(0)
@@ -16,10 +19,27 @@ torch.backends.cudnn.benchmark = False
 class Dataset(data.Dataset):
     """Custom data.Dataset compatible with data.DataLoader."""
 
-    def __init__(self, data, vocab):
+    def __init__(self, data, vocab, tensors=None, presample=False):
         """Reads source and target sequences from txt files."""
         self.vocab = vocab
         self.data = data
+        # >>>>>>>>>> TensorStore of the deterministic item tensors, built on the fly when None >>>>>>>>>> #
+        self.tensors = tensors
+        # >>>>>>>>>> every target followed by EOS, so real and fake targets are slices of one tensor >>>>>>>>>> #
+        self.target_ids, self.target_offsets = self.encode_targets()
+        # >>>>>>>>>> fake_same_act negatives drawn for all examples at once per epoch, or per item when None >>>>>>>>>> #
+        self.negatives = None
+        if presample:
+            fakes = self.data["fake_same_act"]
+            self.fake_counts = np.array([len(fake) for fake in fakes], dtype=np.int64)
+            if not self.fake_counts.all():
+                # >>>>>>>>>> an empty list would draw from the next example's candidates, np.random.choice refuses it too >>>>>>>>>> #
+                raise ValueError("examples {} have no fake_same_act candidates".format(
+                    np.flatnonzero(self.fake_counts == 0).tolist()))
+            self.fake_offsets = np.cumsum(self.fake_counts) - self.fake_counts
+            self.fake_candidates = np.concatenate([np.asarray(fake, dtype=np.int64) for fake in fakes])
+            self.negatives = torch.zeros(len(self), 4, dtype=torch.long).share_memory_()
+            self.start_epoch()
         self.emo_map = {
             'surprised': 0, 'excited': 1, 'annoyed': 2, 'proud': 3, 'angry': 4, 'sad': 5, 'grateful': 6, 'lonely': 7,
             'impressed': 8, 'afraid': 9, 'disgusted': 10, 'confident': 11, 'terrified': 12, 'hopeful': 13,
@@ -30,6 +50,7 @@ class Dataset(data.Dataset):
             'apprehensive': 30, 'faithful': 31}
         self.act_map = {'questioning': 0, 'acknowledging': 1, 'consoling': 2, 'agreeing': 3,
                         'encouraging': 4, 'sympathizing': 5, 'suggesting': 6, 'wishing': 7}
+        self.concept2vocab = self.build_concept_index()
         # self.analyzer = SentimentIntensityAnalyzer()
 
     def __len__(self):
@@ -46,75 +67,97 @@ class Dataset(data.Dataset):
         acts = self.data["act_label"][index]
         item["cause_text"] = self.data["usercause"][index]
         item["cause_label"] = self.data["usercause_label"][index]
-        graphIdx = self.data["graphidx"][str(index)]
-        fake_index = np.random.choice(self.data["fake_same_act"][index], 4)
-
+        item["context_text"] = item["situation_text"] + [ele for lst in item["dialog_text"] for ele in lst]
+        if self.negatives is not None:
+            fake_index = self.negatives[index].numpy()
+        else:
+            fake_index = np.random.choice(self.data["fake_same_act"][index], 4)
 
-        graphs = self.preprocess_graph([self.data["graphs"][id] for id in graphIdx])
-        item["graph_num"] = len(graphIdx)
-        item["graph_concept_ids"], item["graph_concept_label"], item["graph_distances"], item["graph_relation"], \
-        item["graph_head"], item["graph_tail"], item["graph_triple_label"], item["vocab_map"], item["map_mask"] = graphs
+        item.update(self.tensors[index] if self.tensors is not None else self.example_tensors(index))
+        item["graph_num"] = len(item["graph_concept_ids"])
 
         # item["context_emotion_scores"] = self.analyzer.polarity_scores(' '.join(self.data["dialog"][index][0]))
 
-        item["context"], item["context_mask"] = self.preprocess((item["situation_text"], item["dialog_text"]))
-        item["cause_batch"] = [self.preprocess(["CLS"]+cause, clause=True) for cause in item["cause_text"] if cause]
-        item["context_text"] = item["situation_text"] + [ele for lst in item["dialog_text"] for ele in lst]
+        # item["target_act"] = []
+        # for idx, t in enumerate(item["target_text"]):
+        #     item["target_act"] += [self.act_map[acts[idx]]] * len(t)
+        # item["target_act"] = torch.LongTensor(item["target_act"] + [-1])
+        item["target_list"] = [item["target"]] + [self.target_tensor(fake) for fake in fake_index]
+        item["emotion"], item["emotion_label"] = self.preprocess_label(item["emotion_text"], self.emo_map)
+
+        return item
+
+    def example_tensors(self, index):
+        """The tensors of item `index` that do not depend on sampling: context, clauses, causes, target and graphs."""
+        item = {}
+        situation, dialog = self.data["situation"][index], self.data["dialog"][index]
+        cause_label = self.data["usercause_label"][index]
+        graphIdx = self.data["graphidx"][str(index)]
+
+        item["graph_concept_ids"], item["graph_concept_label"], item["graph_distances"], item["graph_relation"], \
+        item["graph_head"], item["graph_tail"], item["graph_triple_label"], item["vocab_map"], item["vocab_ids"] = \
+            self.preprocess_graph([self.data["graphs"][id] for id in graphIdx])
+
+        item["context"], item["context_mask"] = self.preprocess((situation, dialog))
+        item["cause_batch"] = [self.preprocess(np.concatenate(([config.CLS_idx], cause)), clause=True)
+                               for cause in self.data["usercause"][index] if len(cause)]
         item["clause"] = []
-        item["causepos"] = [0]
-        for num, text in enumerate(item["context_text"]):
+        causepos = [0]
+        for num, text in enumerate(situation + [ele for lst in dialog for ele in lst]):
             clause = self.preprocess(text, clause=True)
             item["clause"].append(clause)
             score = 0
-            for i, label in enumerate(item["cause_label"]):
+            for i, label in enumerate(cause_label):
                 try:
                     score += label[num]
                 except IndexError:
                     continue
             for i in range(len(clause)):
-                item["causepos"].append(score)
-        max_score = max(item["causepos"])
-        item["causepos"] = torch.LongTensor([max_score-score if score else 0 for score in item["causepos"]])
-        # item["target_act"] = []
-        # for idx, t in enumerate(item["target_text"]):
-        #     item["target_act"] += [self.act_map[acts[idx]]] * len(t)
-        # item["target_act"] = torch.LongTensor(item["target_act"] + [-1])
-        item["target"] = self.preprocess([w for lis in item["target_text"] for w in lis]+["EOS"], clause=True)
-        item["target_list"] = [self.preprocess([w for lis in item["target_text"] for w in lis]+["EOS"], clause=True)]
-        for index in fake_index:
-            fake = self.preprocess([w for lis in self.data["target"][index] for w in lis]+["EOS"], clause=True)
-            item["target_list"].append(fake)
-        item["emotion"], item["emotion_label"] = self.preprocess_label(item["emotion_text"], self.emo_map)
-
+                causepos.append(score)
+        max_score = max(causepos)
+        item["causepos"] = torch.LongTensor([max_score-score if score else 0 for score in causepos])
+        item["target"] = self.target_tensor(index)
         return item
 
+    def encode_targets(self):
+        """All targets with EOS appended as one LongTensor, and the offsets of every target in it."""
+        bounds = self.data["target"].span_bounds()
+        tokens = np.asarray(self.data["target"].tokens[bounds[0]:bounds[-1]], dtype=np.int64)
+        target_ids = np.insert(tokens, bounds[1:] - bounds[0], config.EOS_idx)
+        return torch.from_numpy(target_ids), bounds - bounds[0] + np.arange(len(bounds))
+
+    def target_tensor(self, index):
+        return self.target_ids[self.target_offsets[index]:self.target_offsets[index + 1]]
+
+    def start_epoch(self):
+        """
+        Redraws the four fake_same_act negatives of every example with one vectorised draw when they
+        are pre-sampled. negatives lives in shared memory, so DataLoader workers see the new draw.
+        """
+        if self.negatives is None:
+            return
+        draws = (np.random.rand(len(self), 4) * self.fake_counts[:, None]).astype(np.int64)
+        self.negatives.copy_(torch.from_numpy(self.fake_candidates[self.fake_offsets[:, None] + draws]))
+
     def preprocess(self, arr, clause=False):
-        """Converts words to ids."""
+        """Turns token-id slices of the token store into LongTensors."""
         if clause:
-            sequence = [self.vocab.word2index[word] if word in self.vocab.word2index else config.UNK_idx for word in
-                        arr]
-            return torch.LongTensor(sequence)
+            return torch.from_numpy(np.array(arr, dtype=np.int64))
 
         else:
             situation, context = arr
-            X_dial = [config.CLS_idx]
-            X_mask = [config.CLS_idx]
-            for i, sentence in enumerate(situation):
-                X_dial += [self.vocab.word2index[word] if word in self.vocab.word2index else config.UNK_idx for word in
-                           sentence]
-                X_mask += [self.vocab.word2index["SIT"] for _ in range(len(sentence))]
-
-            for i, sentences in enumerate(context):
-                for j, sentence in enumerate(sentences):
-                    X_dial += [self.vocab.word2index[word] if word in self.vocab.word2index else config.UNK_idx for word in
-                               sentence]
-                    # >>>>>>>>>> spk: whether this sen is from a user or bot >>>>>>>>>> #
-                    spk = self.vocab.word2index["USR"] if i % 2 == 0 else self.vocab.word2index["SYS"]
-                    X_mask += [spk for _ in range(len(sentence))]
+            sentences = [[config.CLS_idx]] + situation
+            # >>>>>>>>>> spk: whether this sen is from a user or bot >>>>>>>>>> #
+            speakers = [config.CLS_idx] + [config.SIT_idx for _ in situation]
+            for i, sentences_i in enumerate(context):
+                sentences += sentences_i
+                speakers += [config.USR_idx if i % 2 == 0 else config.SYS_idx for _ in sentences_i]
+            X_dial = np.concatenate(sentences).astype(np.int64)
+            X_mask = np.repeat(np.array(speakers, dtype=np.int64), [len(sentence) for sentence in sentences])
 
             assert len(X_dial) == len(X_mask)
 
-            return torch.LongTensor(X_dial), torch.LongTensor(X_mask)
+            return torch.from_numpy(X_dial), torch.from_numpy(X_mask)
             # >>>>>>>>>> context, context mask >>>>>>>>>> #
 
     def preprocess_label(self, text, map):
@@ -123,35 +166,232 @@ class Dataset(data.Dataset):
         # >>>>>>>>>> one hot mode and label mode >>>>>>>>>> #
         return program, map[text]
 
+    def build_concept_index(self):
+        """Vocab id of every concept in the graph store's concept table, -1 for concepts outside the vocabulary."""
+        return self.vocab.lookup(self.data["graphs"].concepts, default=-1)
+
     def preprocess_graph(self, graphs):
         G_concept_ids, G_concept_label, G_distance, G_relation, G_head, G_tail, G_triple_label = [], [], [], [], [], [], []
-        vocab_maps = []
-        map_mask = [0 for i in range(self.vocab.n_words)]
-        for idx, graph in enumerate(graphs):
-            concepts = graph["concepts"]
-            vocab_map = []
-            for w, idx in self.vocab.word2index.items():
-                try:
-                    pos = concepts.index(w)
-                    vocab_map.append(pos)
-                    map_mask[idx] = 1
-                except ValueError:
-                    vocab_map.append(0)
-            relations = graph["relations"]
-            G_relation.append(torch.LongTensor([r[0] for r in relations]))
-
-            concepts = [self.vocab.word2index[word] if word in self.vocab.word2index else config.UNK_idx for word in
-                    concepts]
-            G_concept_ids.append(torch.LongTensor(concepts))
-            G_distance.append(torch.LongTensor(graph["distances"]))
-            G_head.append(torch.LongTensor(graph["head_ids"]))
-            G_tail.append(torch.LongTensor(graph["tail_ids"]))
-            G_triple_label.append(torch.LongTensor(graph["triple_labels"]))
-            G_concept_label.append(torch.LongTensor(graph["labels"]))
-
-            vocab_maps.append(torch.LongTensor(vocab_map))
-
-        return G_concept_ids, G_concept_label, G_distance, G_relation, G_head, G_tail, G_triple_label, vocab_maps, torch.LongTensor(map_mask)
+        vocab_maps, vocab_ids = [], []
+        for graph in graphs:
+            concepts = self.concept2vocab[graph["concepts"]]
+            # >>>>>>>>>> sparse (concept position, vocab id) pairs, first occurrence wins as with concepts.index >>>>>>>>>> #
+            mapped = np.flatnonzero(concepts != -1)
+            vocab_id, first = np.unique(concepts[mapped], return_index=True)
+            vocab_maps.append(torch.from_numpy(mapped[first]))
+            vocab_ids.append(torch.from_numpy(vocab_id))
+
+            concepts[concepts == -1] = config.UNK_idx
+            G_concept_ids.append(torch.from_numpy(concepts))
+            G_relation.append(torch.from_numpy(graph["relations"].astype(np.int64)))
+            G_distance.append(torch.from_numpy(graph["distances"].astype(np.int64)))
+            G_head.append(torch.from_numpy(graph["head_ids"].astype(np.int64)))
+            G_tail.append(torch.from_numpy(graph["tail_ids"].astype(np.int64)))
+            G_triple_label.append(torch.from_numpy(graph["triple_labels"].astype(np.int64)))
+            G_concept_label.append(torch.from_numpy(graph["labels"].astype(np.int64)))
+
+        return G_concept_ids, G_concept_label, G_distance, G_relation, G_head, G_tail, G_triple_label, vocab_maps, vocab_ids
+
+    def example_sizes(self):
+        """
+        Per-example context length (as built by preprocess), graph count, largest graph in triples
+        and total triples, read from the offsets tables without building any item.
+        """
+        context_lengths = 1 + self.data["situation"].span_lengths() + self.data["dialog"].span_lengths()
+        triple_counts = np.diff(self.data["graphs"].columns["triple_offsets"])
+        graph_nums, max_triples, total_triples = np.zeros((3, len(self)), dtype=np.int64)
+        for index in range(len(self)):
+            counts = triple_counts[self.data["graphidx"][str(index)]]
+            graph_nums[index] = len(counts)
+            max_triples[index] = counts.max() if len(counts) else 0
+            total_triples[index] = counts.sum()
+        return context_lengths, graph_nums, max_triples, total_triples
+
+def materialize_split(split, save_path):
+    """Preprocessing stage writing Dataset.example_tensors of every example of a compiled split to a TensorStore."""
+    dataset = Dataset(TokenStore(config.data_compiled + split + '/'), FrozenLang(config.data_compiled + 'vocab/'))
+    save_tensor_store((dataset.example_tensors(index) for index in range(len(dataset))), save_path, total=len(dataset))
+
+def padding_waste(batches, context_lengths, graph_nums, max_triples, total_triples):
+    """Fraction of padded context positions and of padded graph-triple slots over a list of batches."""
+    context_real = context_padded = triple_real = triple_padded = 0
+    for batch in batches:
+        context_real += context_lengths[batch].sum()
+        context_padded += len(batch) * context_lengths[batch].max()
+        triple_real += total_triples[batch].sum()
+        triple_padded += len(batch) * graph_nums[batch].max() * max_triples[batch].max()
+    return 1 - context_real / max(context_padded, 1), 1 - triple_real / max(triple_padded, 1)
+
+class BucketBatchSampler(data.Sampler):
+    """
+    Batches drawn from one bucket of context length x padded graph size (graphs x largest graph in
+    triples), shuffled within buckets and in batch order every epoch. report() gives the padding
+    waste, measured once on construction, next to that of plain shuffled batches of the same size.
+    """
+
+    def __init__(self, dataset, batch_size, context_boundaries, graph_boundaries, shuffle=True, name='train'):
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.name = name
+        self.sizes = dataset.example_sizes()
+        context_lengths, graph_nums, max_triples, _ = self.sizes
+        keys = np.digitize(context_lengths, context_boundaries) * (len(graph_boundaries) + 1) + \
+               np.digitize(graph_nums * max_triples, graph_boundaries)
+        self.buckets = [np.flatnonzero(keys == key) for key in np.unique(keys)]
+        order = np.random.permutation(len(dataset))
+        self.shuffled_waste = padding_waste([order[i:i + batch_size] for i in range(0, len(order), batch_size)],
+                                            *self.sizes)
+        self.waste = padding_waste(self.epoch_batches(), *self.sizes)
+
+    def __len__(self):
+        return sum((len(bucket) + self.batch_size - 1) // self.batch_size for bucket in self.buckets)
+
+    def epoch_batches(self):
+        batches = []
+        for bucket in self.buckets:
+            if self.shuffle:
+                bucket = np.random.permutation(bucket)
+            batches += [bucket[i:i + self.batch_size] for i in range(0, len(bucket), self.batch_size)]
+        if self.shuffle:
+            batches = [batches[i] for i in np.random.permutation(len(batches))]
+        return batches
+
+    def __iter__(self):
+        for batch in self.epoch_batches():
+            yield batch.tolist()
+
+    def report(self):
+        return '{} padding waste: context {:.1%} (shuffled {:.1%}), graph triples {:.1%} (shuffled {:.1%})'.format(
+            self.name, *[w for pair in zip(self.waste, self.shuffled_waste) for w in pair])
+
+class TokenBudgetBatchSampler(data.Sampler):
+    """
+    Variable-size batches packed up to max_tokens, where a batch costs its size times (longest context
+    + graph count x largest graph in triples), i.e. the context and graph slots collate_fn pads to.
+    Examples are shuffled, sorted by cost within pools of pool_size so that neighbours pack tightly,
+    and the packed batches are shuffled, and repacked every epoch. An example over budget on its own
+    gets a batch of one. report() describes the first packing.
+    """
+
+    def __init__(self, dataset, max_tokens, shuffle=True, pool_size=1000, name='train'):
+        self.max_tokens = max_tokens
+        self.shuffle = shuffle
+        self.pool_size = pool_size
+        self.name = name
+        self.sizes = dataset.example_sizes()
+        self.batches = self.pack()
+        self.waste = padding_waste(self.batches, *self.sizes)
+        self.batch_count = len(self.batches)
+        self.mean_size = float(np.mean([len(batch) for batch in self.batches])) if self.batches else 0.0
+
+    def pack(self):
+        context_lengths, graph_nums, max_triples, _ = self.sizes
+        order = np.random.permutation(len(context_lengths)) if self.shuffle else np.arange(len(context_lengths))
+        batches = []
+        for begin in range(0, len(order), self.pool_size):
+            pool = order[begin:begin + self.pool_size]
+            pool = pool[np.argsort(context_lengths[pool] + graph_nums[pool] * max_triples[pool], kind='stable')]
+            batch, max_context, max_graphs, max_size = [], 0, 0, 0
+            for index in pool:
+                context = max(max_context, context_lengths[index])
+                graphs, size = max(max_graphs, graph_nums[index]), max(max_size, max_triples[index])
+                if batch and (len(batch) + 1) * (context + graphs * size) > self.max_tokens:
+                    batches.append(np.array(batch))
+                    batch, context, graphs, size = [], context_lengths[index], graph_nums[index], max_triples[index]
+                batch.append(index)
+                max_context, max_graphs, max_size = context, graphs, size
+            if batch:
+                batches.append(np.array(batch))
+        if self.shuffle:
+            batches = [batches[i] for i in np.random.permutation(len(batches))]
+        return batches
+
+    def __len__(self):
+        return len(self.batches)
+
+    def __iter__(self):
+        batches = self.batches
+        for batch in batches:
+            yield batch.tolist()
+        self.batches = self.pack()
+
+    def report(self):
+        return '{} token budget {}: {} batches of {:.1f} examples on average, padding waste: context {:.1%}, ' \
+               'graph triples {:.1%}'.format(self.name, self.max_tokens, self.batch_count, self.mean_size, *self.waste)
+
+# >>>>>>>>>> batch tensors the models expect on config.device, collate_fn leaves them on the CPU >>>>>>>>>> #
+device_keys = ["input_batch", "causepos", "mask_input", "cause_batch", "target_batch", "target_lengths",
+               "targets_batch", "targets_lengths", "concept_ids", "distances", "relations", "heads", "tails",
+               "concept_label", "triple_label"]
+
+class DeviceLoader:
+    """
+    Iterates a DataLoader of CPU batches and moves their device_keys tensors to `device`. The copy of
+    the next batch is issued before the current one is handed out, on a side stream with non-blocking
+    copies from pinned memory under CUDA, so it overlaps with the step run on the current batch.
+    Each pass starts a new epoch of the Dataset, redrawing pre-sampled negatives.
+    """
+
+    def __init__(self, loader, device):
+        self.loader = loader
+        self.device = torch.device(device)
+
+    def __len__(self):
+        return len(self.loader)
+
+    def transfer(self, batch, stream):
+        if batch is None:
+            return None
+        with torch.cuda.stream(stream) if stream is not None else contextlib.nullcontext():
+            for key in device_keys:
+                batch[key] = batch[key].to(self.device, non_blocking=True)
+        return batch
+
+    def __iter__(self):
+        self.loader.dataset.start_epoch()
+        stream = torch.cuda.Stream(self.device) if self.device.type == 'cuda' else None
+        batches = iter(self.loader)
+        upcoming = self.transfer(next(batches, None), stream)
+        while upcoming is not None:
+            batch = upcoming
+            if stream is not None:
+                torch.cuda.current_stream(self.device).wait_stream(stream)
+                for key in device_keys:
+                    batch[key].record_stream(torch.cuda.current_stream(self.device))
+            upcoming = self.transfer(next(batches, None), stream)
+            yield batch
+
+def scatter_rows(sequences, lengths, rows, shape, pad):
+    """
+    A pad-filled LongTensor of `shape` with sequences[k] written to the start of row rows[k], counting
+    rows over all but the last dimension. The concatenated values are put through one flat index
+    computed from the row starts and the sequence lengths, instead of a copy per sequence.
+    """
+    padded = torch.full((int(np.prod(shape)),), pad, dtype=torch.long)
+    if len(sequences):
+        lengths = torch.LongTensor(lengths)
+        ends = torch.cumsum(lengths, 0)
+        positions = torch.repeat_interleave(rows * shape[-1] - ends + lengths, lengths) + torch.arange(int(ends[-1]))
+        padded[positions] = torch.cat(sequences)
+    return padded.view(*shape)
+
+def pad_sequences(sequences, pad=1):
+    """Pads 1-d LongTensors into a len(sequences) x longest tensor; returns it with the lengths."""
+    lengths = [seq.size(0) for seq in sequences]
+    return scatter_rows(sequences, lengths, torch.arange(len(sequences)), (len(sequences), max(lengths)), pad), lengths
+
+def pad_nested(docs, pad=1):
+    """
+    Pads lists of 1-d LongTensors into a len(docs) x longest doc x longest sequence tensor; returns it
+    with the sequence lengths of every doc followed by zeros up to the longest doc.
+    """
+    max_docs = max(len(doc) for doc in docs)
+    lengths = [[seq.size(0) for seq in doc] + [0] * (max_docs - len(doc)) for doc in docs]
+    sequences = [seq for doc in docs for seq in doc]
+    rows = [i * max_docs + j for i, doc in enumerate(docs) for j in range(len(doc))]
+    padded = scatter_rows(sequences, [length for doc, doc_lengths in zip(docs, lengths) for length in doc_lengths[:len(doc)]],
+                          torch.LongTensor(rows), (len(docs), max_docs, max(map(max, lengths)) if max_docs else 0), pad)
+    return padded, lengths
 
 def collate_fn(data):
     def merge(sequences, single=True, pad=1):
@@ -160,24 +400,9 @@ def collate_fn(data):
         lengths: the lengths of seq in sequences
         """
         if single:
-            lengths = [len(seq) for seq in sequences]
-            padded_seqs = torch.ones(len(sequences), max(lengths)).long()  ## padding index 1
-            padded_seqs *= pad
-            for i, seq in enumerate(sequences):
-                end = lengths[i]
-                padded_seqs[i, :end] = seq[:end]
-            return padded_seqs, lengths
+            return pad_sequences(sequences, pad)
         else:
-            doc_lengths = [len(doc) for doc in sequences]
-            seq_lengths = [max([len(seq) for seq in doc]) if len(doc) else 0 for doc in sequences]
-            padded_seqs = torch.ones(len(sequences), max(doc_lengths), max(seq_lengths)).long()
-            padded_seqs *= pad
-            for i, doc in enumerate(sequences):
-                for j, seq in enumerate(doc):
-                    end = len(seq)
-                    padded_seqs[i, j, :end] = seq[:end]
-            lengths = [[len(seq) for seq in doc]+[0 for i in range(max(doc_lengths)-len(doc))] for doc in sequences]
-            return padded_seqs, lengths
+            return pad_nested(sequences, pad)
 
     data.sort(key=lambda x: len(x["context"]), reverse=True)  ## sort by source seq
     item_info = {}
@@ -193,7 +418,7 @@ def collate_fn(data):
     triple_label, _ = merge(item_info["graph_triple_label"], single=False, pad=-1)
     concept_label, _ = merge(item_info["graph_concept_label"], single=False, pad=-1)
     vocab_map, _ = merge(item_info["vocab_map"], single=False, pad=0)
-    map_mask, _ = merge(item_info["map_mask"], pad=0)
+    vocab_ids, _ = merge(item_info["vocab_ids"], single=False, pad=-1)
 
     ## input
     input_batch, input_lengths = merge(item_info['context'])
@@ -210,36 +435,36 @@ def collate_fn(data):
     # target_act, _ = merge(item_info["target_act"], pad=-1)
 
     d = {}
-    d["input_batch"] = input_batch.to(config.device)
+    d["input_batch"] = input_batch
     d["input_lengths"] = torch.LongTensor(input_lengths)  # mask_input_lengths equals input_lengths
-    d["causepos"] = causepos.to(config.device)
-    d["mask_input"] = mask_input.to(config.device)
+    d["causepos"] = causepos
+    d["mask_input"] = mask_input
     ##cause
-    d["cause_batch"] = cause_batch.to(config.device)
+    d["cause_batch"] = cause_batch
     # d["botcause_clause"] = clause_batch.to(config.device)
     # d["botcause_label"] = item_info['botcause_label']
     ##target
-    d["target_batch"] = target_batch.to(config.device)
-    d["target_lengths"] = torch.LongTensor(target_lengths).to(config.device)
-    d["targets_batch"] = targets_batch.to(config.device)
-    d["targets_lengths"] = torch.LongTensor(targets_lengths).to(config.device)
+    d["target_batch"] = target_batch
+    d["target_lengths"] = torch.LongTensor(target_lengths)
+    d["targets_batch"] = targets_batch
+    d["targets_lengths"] = torch.LongTensor(targets_lengths)
     ##program
     d["target_program"] = item_info['emotion']  # one hot format
     d["program_label"] = item_info['emotion_label']
     # d["target_act"] = target_act
     ##graph
-    d["concept_ids"] = concept_ids.to(config.device)
+    d["concept_ids"] = concept_ids
     d["concept_num"] = concept_num
-    d["distances"] = distances.to(config.device)
-    d["relations"] = relations.to(config.device)
+    d["distances"] = distances
+    d["relations"] = relations
     d["triple_num"] = triple_num
-    d["heads"] = heads.to(config.device)
-    d["tails"] = tails.to(config.device)
-    d["concept_label"] = concept_label.to(config.device)
-    d["triple_label"] = triple_label.to(config.device)
+    d["heads"] = heads
+    d["tails"] = tails
+    d["concept_label"] = concept_label
+    d["triple_label"] = triple_label
     d["graph_num"] = item_info["graph_num"]
     d["vocab_map"] = vocab_map
-    d["map_mask"] = map_mask
+    d["vocab_ids"] = vocab_ids
     ##emotion_scores
     # d["context_emotion_scores"] = item_info["context_emotion_scores"]
     ##text
@@ -249,29 +474,62 @@ def collate_fn(data):
 
     return d
 
-def prepare_data_seq(batch_size=32):
+def prepare_data_seq(batch_size=32, num_workers=0, pin_memory=False, prefetch_factor=2, persistent_workers=False):
     """
     :return:
     vocab: vocabulary including index2word, and word2index
     len(dataset_train.emo_map)
+    The loaders build batches on the CPU, in num_workers processes when set, and are wrapped in
+    DeviceLoaders that move them to config.device.
     """
     pairs_tra, pairs_val, pairs_tst, vocab = load_dataset()
 
     logging.info("Vocab  {} ".format(vocab.n_words))
 
-    dataset_train = Dataset(pairs_tra, vocab)
-    data_loader_tra = torch.utils.data.DataLoader(dataset=dataset_train, batch_size=batch_size,
-                                                  shuffle=True, collate_fn=collate_fn)
+    if config.tensor_cache:
+        tensors_tra, tensors_val, tensors_tst = [TensorStore(config.data_compiled + 'tensors/{}/'.format(split))
+                                                 for split in ['train', 'valid', 'test']]
+    else:
+        tensors_tra = tensors_val = tensors_tst = None
+    dataset_train = Dataset(pairs_tra, vocab, tensors_tra, config.presample_negatives)
+    dataset_valid = Dataset(pairs_val, vocab, tensors_val, config.presample_negatives)
+    options = {'num_workers': num_workers, 'pin_memory': pin_memory}
+    if num_workers > 0:
+        options.update(prefetch_factor=prefetch_factor, persistent_workers=persistent_workers)
+    if config.max_tokens:
+        # >>>>>>>>>> batches packed up to a token budget instead of a fixed size >>>>>>>>>> #
+        data_loader_tra = torch.utils.data.DataLoader(dataset=dataset_train, collate_fn=collate_fn,
+                                                      batch_sampler=TokenBudgetBatchSampler(dataset_train, config.max_tokens,
+                                                                                            name='train'), **options)
+        data_loader_val = torch.utils.data.DataLoader(dataset=dataset_valid, collate_fn=collate_fn,
+                                                      batch_sampler=TokenBudgetBatchSampler(dataset_valid, config.max_tokens,
+                                                                                            name='valid'), **options)
+    elif config.bucket:
+        # >>>>>>>>>> length-bucketed batches cut padding in the context and graph tensors >>>>>>>>>> #
+        data_loader_tra = torch.utils.data.DataLoader(dataset=dataset_train, collate_fn=collate_fn,
+                                                      batch_sampler=BucketBatchSampler(dataset_train, batch_size,
+                                                                                       config.bucket_context,
+                                                                                       config.bucket_graph, name='train'), **options)
+        data_loader_val = torch.utils.data.DataLoader(dataset=dataset_valid, collate_fn=collate_fn,
+                                                      batch_sampler=BucketBatchSampler(dataset_valid, batch_size,
+                                                                                       config.bucket_context,
+                                                                                       config.bucket_graph, name='valid'), **options)
+    else:
+        data_loader_tra = torch.utils.data.DataLoader(dataset=dataset_train, batch_size=batch_size,
+                                                      shuffle=True, collate_fn=collate_fn, **options)
+        data_loader_val = torch.utils.data.DataLoader(dataset=dataset_valid,
+                                                      batch_size=batch_size,
+                                                      shuffle=True, collate_fn=collate_fn, **options)
+    if config.max_tokens or config.bucket:
+        for loader in [data_loader_tra, data_loader_val]:
+            print(loader.batch_sampler.report())
     # return data_loader_tra, None, None, vocab, len(dataset_train.emo_map)
 
-    dataset_valid = Dataset(pairs_val, vocab)
-    data_loader_val = torch.utils.data.DataLoader(dataset=dataset_valid,
-                                                  batch_size=batch_size,
-                                                  shuffle=True, collate_fn=collate_fn)
-
-    dataset_test = Dataset(pairs_tst, vocab)
+    dataset_test = Dataset(pairs_tst, vocab, tensors_tst, config.presample_negatives)
     data_loader_tst = torch.utils.data.DataLoader(dataset=dataset_test,
                               batch_size=1,
-                              shuffle=False, collate_fn=collate_fn)
+                              shuffle=False, collate_fn=collate_fn, **options)
+    data_loader_tra, data_loader_val, data_loader_tst = [DeviceLoader(loader, config.device) for loader in
+                                                         [data_loader_tra, data_loader_val, data_loader_tst]]
     write_config(config)
     return data_loader_tra, data_loader_val, data_loader_tst, vocab, len(dataset_train.emo_map)
\ No newline at end of file
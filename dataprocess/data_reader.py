@@ -1,10 +1,13 @@
 import config
 import numpy as np
 import nltk
-import os, pickle, json
-from models.cause_extraction import predict
-from dataprocess.find_path import process
-from dataprocess.triple_store import directed_triple, read_json
+import os, json
+import multiprocessing
+from tqdm import tqdm
+from dataprocess.triple_store import directed_triple, GraphStore
+from dataprocess.token_store import save_token_store, TokenStore
+from dataprocess.json_lines import read_json_lines, sentence_hash
+from dataprocess.stages import Stage, run_stages, code_version
 
 blacklist = {'-PRON-', 'whither', 'iq', 'al', 'xk', 'et-al', 'resulting', 'mg', 'specified', 'more', 'rf', 'c3', 'else', 'whence', 'usefulness', 'rr', 'est', 'made', 'edu', 'somehow', 'below', 'besides', 'thereby', 'thousand', 'ag', 'it', 'tp', 'lately', 'J', 'described', 'id', 'if', 'dp', 'want', 'e', 'L', 'arent', 'yl', 'sd', 'secondly', 'my', 'a3', 'already', 'f2', 'mostly', 'hardly', 'whenever', 'vs', 'qv', 'ra', 'we', 'bl', 'our', 'doing', 'added', 'hadn', 'hi', 'how', 'r', 'indicates', 'slightly', 'shed', 'always', 'anyways', 'right', 'ui', 'aside', 'page', 'considering', 'won', 'move', 'forty', 'ms', 'ey', 'whom', 'th', 'cv', 'its', 'both', 'probably', 'tc', 'hed', 'everything', 'pf', 'fi', 'keep', 'some', 'e3', 'with', 'entirely', 'somethan', 'td', 'av', '3a', 'is', 'comes', 'di', 'fu', 'la', 'might', 'cannot', 'up', 'follows', 'showed', 'trying', 'who', 'amount', 'usually', 'giving', 'cf', 'thereof', 'bottom', 'inasmuch', 'given', 'r2', 'insofar', 'ba', 'rather', 'hj', 'from', 'cr', 'latter', 'rd', 'respectively', 'though', 'anyway', 'kept', 'ho', 'til', 'P', 'wherever', 'vo', 'does', 'fify', 'quickly', 'ar', 'b1', 'W', 'cm', '6b', 'almost', 'e2', 'ip', 'theres', 'million', 'y', 'vols', 'ns', '6o', 'before', 'lr', 'they', 'why', 'dx', 'gj', 'research-articl', 'little', 'run', 'fa', 'ur', 'using', 'whomever', 'ih', 'which', 'whereafter', 'outside', 'xj', 'concerning', 'mainly', 'therere', 'yours', 'looking', 'thoroughly', 'cq', 'bt', 'for', 'gave', 'could_be', 'affected', 'six', 'obtain', 'somewhat', 'mn', 'eight', 'hereby', 'me', 'ran', 'b', 'ru', 'thickv', 'throughout', 'four', 'please', 'U', 'soon', 'tb', 'sixty', 'ob', 'successfully', 'km', 'necessarily', 'neither', 'show', 'shown', 'Z', 'about', 'H', 'a1', 'nn', 'dj', 'se', 'que', 'strongly', 'indeed', 'took', 'appreciate', 'i8', 'rn', 'us', 'ge', 'http', 'ou', 'sc', 'taken', 'og', 'hes', 'front', 'p2', 'top', 'want_to', 'pagecount', 'or', 'several', 'third', 'lb', 'specify', 'two', 'op', 'each', 'sincere', 'os', 'alone', 'yr', 'side', 'let', 'nr', 'anyone', 'ep', 'gets', 'mug', 'pas', 'presumably', 'y2', 'sometimes', 'able', 'oz', 'useful', 'when', 'old', 'dl', 'ri', 'got', 'someone', 'oo', 'obviously', 'pe', 'cc', 'latterly', 'theirs', 'beyond', 'B', 'own', 'as', 'welcome', 'oq', 'suggest', 'xi', 'while', 'va', 'bs', 'whether', 'following', 'non', 'second', 'eq', 'zero', 'ev', 's2', 'ph', 'fs', 'pc', 'no', 'wed', 'hereupon', 'ord', 'most', 'par', 'viz', 'xs', '0o', 'rh', 'themselves', 'ci', 'still', 'ts', 't3', 'toward', 'shes', 'E', 'regardless', 'give', 'just', 'zi', 'on', 'but', 'sn', 'mo', 'another', 'way', 'done', 'goes', 'ain', 'ec', 'couldn', 'forth', 'po', 'uk', 'none', 'bill', 'exactly', 'io', 'proud', 'cn', 'eleven', 'between', 'part', 'rj', 'once', 's', 'D', 'although', 'ln', 'vol', 'volumtype', 'now', 'tl', 'unlike', 'mustn', 'm', 'name', 'nos', 'l2', 'ca', 'itd', 'hs', 'three', 'o', 'that', 'seeming', 'afterwards', 'ft', 'ic', 'shows', 'through', 'anymore', 'don', 'thanks', 'gs', 'oc', 'among', 'pt', 'yes', 'didn', 'w', 'towards', 'whatever', 'whos', 'substantially', 'next', 'recent', 'sent', 'thorough', 'ma', 'any', 'eg', 'according', 'howbeit', 'beginnings', 'and', 'by', 'vt', 'thereupon', 'shall', 'ny', 'far', 'fo', 'hence', 'fn', 'ac', 'whose', 'may', 'fl', 'sec', 'says', 'www', 'near', 'cg', 'herein', 'cd', 'recently', 'tends', 'da', 'heres', 'clearly', 'ib', 'over', 'wheres', 'xn', 'js', 'those', 'many', 'widely', 'used', 'went', 'br', 'regarding', 'nevertheless', 'until', 'ao', 'particular', 'ref', 'ue', 'hello', 'ad', 'found', 'qj', 'relatively', 'l', 'per', 'p3', 'came', 'es', 'moreover', 'away', 'affecting', 'nt', 'sufficiently', 'various', 'ir', 'bk', '0s', 'regards', 'sometime', 'truly', 'hy', 'xo', 'i6', 'ten', 'ti', 'ask', 'related', 'thanx', 'apart', 'com', 'jr', 'xl', 'gone', 'dy', 'iy', 'tr', 'pp', 'section', 'aw', 'said', 'sure', 'tell', 'unfortunately', 'best', 'information', 'pi', 'sz', 'under', 'this', 'hasnt', 'whoever', 'fire', 'less', 'whod', 'ch', 'n', 'tx', 'tv', 'index', 'lj', 'nonetheless', 'sl', 'your', 'did', 'had', 'whole', 'hu', 'ought', 'owing', 'going', 'keeps', 'nd', 'so', 'few', 'ah', 'gotten', 'not', 'thou', 'anybody', 'lest', 'lf', 'tried', 'consequently', 'wouldnt', 'refs', 'yt', 'be', 'well', 'v', 'n2', 'rq', 'in', 'get', 'ga', 'you', 'something', 'every', 'became', 'ay', 'sy', 'au', 'az', 'co', 'st', 'i4', 'thereto', 'df', 'then', 'thoughh', 'ibid', 'pq', 'rc', 'm2', 'actually', 'meantime', 'help', 'bc', 'bu', 'consider', 'seems', 'saying', 'cry', 'fy', 'ninety', 'too', 'can', 'getting', 'otherwise', 'et', 'tip', 'fifth', 'ox', 'ei', 't2', 'haven', 'make', 'aren', 'has', 'indicated', 'interest', 'very', 'previously', 'tries', 'mrs', 'hid', 'course', 'followed', 'except', 'oa', 'ej', 'primarily', 'los', 'thence', 'S', 'sa', 'downwards', 'amoungst', 'doesn', 'twice', 'z', 'xv', 'detail', 'full', 'hh', 'above', '3b', 'ed', 'oj', 'af', 'date', 'usefully', 'youd', 'sf', 'bi', 'must', 'whim', 'ok', 'ef', 'ps', 'anyhow', 'nor', 'former', 'bn', 'ce', 'sj', 'j', 'er', 'sup', 'novel', 'off', 'du', 'anywhere', 'bd', 'predominantly', 'ss', '3d', 'fc', 'liked', 'rm', 'upon', 'resulted', 'take', 'oi', 'cj', 'c', 'largely', 'p', 'ending', 'put', 'b2', 'dt', 'even', 'mu', 'unless', 'really', 'thus', 'X', 'after', 'gl', 'k', 'nl', 'therein', 'again', 'are', 'ex', 'nj', 'lets', 'ones', 'sm', 'iv', 'C', 'end', 'via', 'omitted', 'cl', 'inner', 'h3', 'looks', 'around', 'M', 'seemed', 'couldnt', 'together', 'od', 'somewhere', 'cu', 'despite', 'would', 'hopefully', 'thered', 'eu', 'om', 'cp', 'un', 'been', 'nine', 'showns', 'ia', 'five', 'im', 'cant', 'apparently', 'well-b', 'ko', 'isn', 'the', 'specifying', 'especially', 'certainly', 'd', 'ea', 'particularly', 'R', 'taking', 'ff', 'furthermore', 've', 'twelve', 'yj', 'where', 'beforehand', 'results', 'seven', 'their', 'eo', 'adj', 'i2', 'amongst', 'than', 'pd', 'sp', 'ae', 'lt', 'noted', 'out', 'readily', 'makes', 'okay', 'weren', 'h2', 'wouldn', 'cx', 'rs', 'con', 'call', 'a4', 'K', 'somebody', 'am', 'approximately', 'pages', 'mr', 'mt', 'nobody', 'lc', 'wi', 'shan', 'ix', 'tf', 'sorry', 'les', 'en', 'qu', 'd2', 'dd', 'past', 'em', 'thank', 'u201d', 'what', 'sub', 'um', 'dc', 'ee', 'jj', 'perhaps', 'tq', 'wasn', 'x1', 'stop', 'fix', 'etc', 'sometimes_people', 'could', 'O', 'ro', 'ups', 'xf', 'h', 'i7', 'fifteen', 'meanwhile', 'seem', 'reasonably', 'either', 'c1', 'thereafter', 'vj', 'tt', 'behind', 'sr', 'de', 'hasn', 'last', 'nearly', 'try', 'ut', 'were', 'wherein', 'gives', 'bx', 'everyone', 'mine', 'jt', 'x', 'si', 'p1', 'across', 'ls', 'beside', 'like', 'gi', 'zz', 'a2', 'mill', 'cs', 'since', 'whats', 'pr', 't', 'G', 'kj', 'only', 'fj', 'therefore', 'was', 'certain', 'll', 'look', 'eighty', 'during', 'b3', 'have', 'wont', 'back', 'bp', 'later', 'elsewhere', 'hither', 'ke', 'maybe', 'ry', 'namely', 'biol', 'dr', 'inward', 'provides', 'dk', 'promptly', 'ignored', 'specifically', 'pk', 'ow', 'thats', 'there', 'tn', 'further', 'cit', 'fr', 'announce', 'everywhere', 'accordingly', 'these', 'el', 'into', 'i3', 'u', 'wonder', 'ne', 'enough', 'along', 'unlikely', 'wo', 'of', 'werent', 'awfully', 'f', 'i', 'a', 'line', 'ii', 'vd', 'he', 'whereby', 'xt', 'ys', 'twenty', 'theyd', 'much', 'say', 'abst', 'fill', 'placed', 'ij', 'merely', 'pn', 'find', 'ng', 'possibly', 'pu', 'within', 'at', 'available', 'ltd', 'aj', 'bj', 'na', 're', 'ol', 'theyre', 'instead', 'pj', 'overall', 'cy', 'py', 'likely', 'also', 'ab', 'kg', 'ot', 'them', 'here', 'tj', 'mightn', 'A', 'vu', 'Q', 'rt', 'nc', 'yet', 'often', 'ct', 'x2', 'happens', 'pl', 'quite', 'come', 'rv', 'auth', 'allow', 'miss', 'N', 'ju', 'youre', 'throug', 'to', 'nowhere', 'uj', 'whereas', 'xx', 'such', 'down', 'gr', 'te', 'go', 'rl', 'hr', 'all', 't1', 'whereupon', 'act', 'wa', 'ds', 'everybody', 'F', 'x3', 'nay', 'onto', 'however', 'normally', 'il', 'indicate', 'without', 'noone', 'V', 'inc', 'sq', 'oh', 'thin', 'tm', 'describe', 'iz', 'ever', 'le', 'lo', 'ml', 'wasnt', 'greetings', 'obtained', 'allows', 'against', 'think', 'pm', 'brief', 'g', 'ni', 'vq', 'having', 'immediately', 'Y', 'saw', 'unto', 'ig', 'accordance', 'example', 'ap', 'briefly', 'one', 'cz', 'asking', 'new', 'c2', 'hundred', 'do', 'T', 'least', 'ie', 'arise', 'definitely', 'seen', 'uo', 'poorly', 'hereafter', 'thru', 'formerly', 'q', 'due', 'an', 'ax', 'gy', 'plus'}
 class Lang:
@@ -38,7 +41,98 @@ class Lang:
         else:
             self.word2count[word] += 1
 
-def read_langs(vocab):
+def save_vocab(vocab, path):
+    """Writes a built Lang as words.npy (id -> word) and counts.npy, the format FrozenLang loads."""
+    if not os.path.exists(path):
+        os.makedirs(path)
+    words = [vocab.index2word[i] for i in range(vocab.n_words)]
+    np.save(os.path.join(path, 'words.npy'), np.array(words, dtype=str))
+    np.save(os.path.join(path, 'counts.npy'), np.array([vocab.word2count[w] for w in words], dtype=np.int64))
+
+class FrozenLang:
+    """
+    Read-only vocabulary saved by save_vocab: index2word is a numpy string table searched in its sorted
+    order, so whole batches of words are looked up and decoded in a few numpy calls. Loading is two np.load calls with no pickle involved.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.index2word = np.load(os.path.join(path, 'words.npy'), allow_pickle=False)
+        self.counts = np.load(os.path.join(path, 'counts.npy'), allow_pickle=False)
+        self.order = np.argsort(self.index2word, kind='stable')
+        self.sorted_words = self.index2word[self.order]
+        self._word2index = None
+
+    @property
+    def n_words(self):
+        return len(self.index2word)
+
+    @property
+    def word2index(self):
+        # >>>>>>>>>> dict view for code that still looks words up one at a time >>>>>>>>>> #
+        if self._word2index is None:
+            self._word2index = {w: i for i, w in enumerate(self.index2word.tolist())}
+        return self._word2index
+
+    def lookup(self, words, default=config.UNK_idx):
+        """Ids of a flat sequence of words, `default` for words outside the vocabulary."""
+        words = np.asarray(words, dtype=str)
+        if not len(words) or not self.n_words:
+            return np.full(len(words), default, dtype=np.int64)
+        pos = np.minimum(np.searchsorted(self.sorted_words, words), self.n_words - 1)
+        return np.where(self.sorted_words[pos] == words, self.order[pos], default).astype(np.int64)
+
+    def decode(self, sequences, stop_idx=config.EOS_idx):
+        """Id rows (a 2-D array or a list of id lists) to word lists, each cut before its first stop_idx."""
+        lengths = np.array([len(seq) for seq in sequences], dtype=np.int64)
+        if not lengths.sum():
+            return [[] for _ in sequences]
+        ids = np.concatenate([np.asarray(seq, dtype=np.int64).reshape(-1) for seq in sequences])
+        bounds = np.cumsum(lengths)[:-1]
+        words = np.split(self.index2word[ids], bounds)
+        if stop_idx is None:
+            return [row.tolist() for row in words]
+        stops = np.split(ids == stop_idx, bounds)
+        return [row[:stop.argmax() if stop.any() else len(row)].tolist() for row, stop in zip(words, stops)]
+
+tokenize_batch_size = 1000
+
+def tokenize_sentences(sents, workers=1):
+    """
+    Tokenizes every distinct sentence once, over a pool of worker processes. Results are cached by
+    sentence hash in a tokenize cache named after the tokenizer version, so dialogue prefixes and
+    reruns do not tokenize again.
+    """
+    version = code_version([nltk.word_tokenize], nltk.__version__)
+    cache_path = config.data_npy_dict + 'tokenize_cache.{}.json'.format(version[:12])
+    cache = dict(read_json_lines(cache_path))
+
+    keys = {sent: sentence_hash(sent) for sent in sents}
+    todo = [sent for sent, key in keys.items() if key not in cache]
+    print('tokenizing {} new of {} distinct sentences ({} total)'.format(len(todo), len(keys), len(sents)))
+    if workers > 1:
+        pool = multiprocessing.get_context('fork').Pool(workers)
+        outputs = pool.imap(nltk.word_tokenize, todo, chunksize=tokenize_batch_size)
+    else:
+        pool = None
+        outputs = map(nltk.word_tokenize, todo)
+    try:
+        with open(cache_path, 'a') as f:
+            for i, (sent, tokens) in enumerate(tqdm(zip(todo, outputs), total=len(todo))):
+                cache[keys[sent]] = tokens
+                json.dump([keys[sent], tokens], f)
+                f.write('\n')
+                # >>>>>>>>>> every finished batch of the pool is made durable >>>>>>>>>> #
+                if (i + 1) % tokenize_batch_size == 0:
+                    f.flush()
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    return {sent: cache[key] for sent, key in keys.items()}
+
+def read_langs(vocab, T):
     # >>>>>>>>>> word pairs: replace some sentences in the paragraph >>>>>>>>>> #
     # >>>>>>>>>> historical utterances >>>>>>>>>> #
     train_dialog = np.load(config.data_npy_dict+'sys_dialog_texts.train.npy', allow_pickle=True)
@@ -48,12 +142,6 @@ def read_langs(vocab):
     train_emotion = np.load(config.data_npy_dict+'sys_emotion_texts.train.npy', allow_pickle=True)
     # >>>>>>>>>> prompts of the conversation >>>>>>>>>> #
     train_situation = np.load(config.data_npy_dict+'sys_situation_texts.train.npy', allow_pickle=True)
-    necessary_file = ['usercause_texts', 'botcause_texts', 'usercause_labels', 'botcause_labels']
-    for file in necessary_file:
-        if not os.path.exists(config.data_npy_dict + 'sys_{}.train.npy'.format(file)):
-            print('Generating cause clauses...')
-            predict(train_situation, train_dialog, train_target, 'train', config.data_npy_dict)
-            break
     # >>>>>>>>>> usercause of the conversation >>>>>>>>>> #
     train_usercause = np.load(config.data_npy_dict + 'sys_usercause_texts.train.npy', allow_pickle=True)
     # >>>>>>>>>> botcause of the conversation >>>>>>>>>> #
@@ -72,10 +160,6 @@ def read_langs(vocab):
     dev_emotion = np.load(config.data_npy_dict+'sys_emotion_texts.valid.npy', allow_pickle=True)
     dev_situation = np.load(config.data_npy_dict+'sys_situation_texts.valid.npy', allow_pickle=True)
 
-    for file in necessary_file:
-        if not os.path.exists(config.data_npy_dict + 'sys_{}.valid.npy'.format(file)):
-            print('Generating cause clauses...')
-            predict(dev_situation, dev_dialog, dev_target, 'valid', config.data_npy_dict)
     dev_usercause = np.load(config.data_npy_dict + 'sys_usercause_texts.valid.npy', allow_pickle=True)
     # dev_botcause = np.load(config.data_npy_dict + 'sys_botcause_texts.valid.npy', allow_pickle=True)
     dev_usercause_label = np.load(config.data_npy_dict + 'sys_usercause_labels.valid.npy', allow_pickle=True)
@@ -88,10 +172,6 @@ def read_langs(vocab):
     test_target = np.load(config.data_npy_dict+'sys_target_texts.test.npy', allow_pickle=True)
     test_emotion = np.load(config.data_npy_dict+'sys_emotion_texts.test.npy', allow_pickle=True)
     test_situation = np.load(config.data_npy_dict+'sys_situation_texts.test.npy', allow_pickle=True)
-    for file in necessary_file:
-        if not os.path.exists(config.data_npy_dict + 'sys_{}.test.npy'.format(file)):
-            print('Generating cause clauses...')
-            predict(test_situation, test_dialog, test_target, 'test', config.data_npy_dict)
     test_usercause = np.load(config.data_npy_dict + 'sys_usercause_texts.test.npy', allow_pickle=True)
     # test_botcause = np.load(config.data_npy_dict + 'sys_botcause_texts.test.npy', allow_pickle=True)
     test_usercause_label = np.load(config.data_npy_dict + 'sys_usercause_labels.test.npy', allow_pickle=True)
@@ -100,6 +180,18 @@ def read_langs(vocab):
     test_fake_same_act = np.load(config.data_npy_dict + 'sys_fake_same_act.test.npy', allow_pickle=True)
     test_fake_same_emo = np.load(config.data_npy_dict + 'sys_fake_same_emo.test.npy', allow_pickle=True)
 
+    # >>>>>>>>>> tokenize each distinct sentence of all splits once >>>>>>>>>> #
+    sents = []
+    for dialogs in [train_dialog, dev_dialog, test_dialog]:
+        for dialog in dialogs:
+            for utts in dialog:
+                sents.extend(utts)
+    for texts in [train_target, train_situation, train_usercause, dev_target, dev_situation, dev_usercause,
+                  test_target, test_situation, test_usercause]:
+        for text in texts:
+            sents.extend(text)
+    tokens = tokenize_sentences(sents, config.tokenize_workers)
+
     data_train = {'dialog': [], 'target': [], 'emotion': train_emotion, 'situation': [], 'usercause_label': train_usercause_label, 'usercause':[], 'graphs':[], 'graphidx': [], 'act_label': train_act_label, 'fake_same_act': train_fake_same_act, 'fake_same_emo': train_fake_same_emo}
     data_dev = {'dialog': [], 'target': [], 'emotion': [], 'situation': [], 'usercause_label': dev_usercause_label, 'usercause': [], 'graphs': [], 'graphidx': [], 'act_label': dev_act_label, 'fake_same_act': dev_fake_same_act, 'fake_same_emo': dev_fake_same_emo}
     data_test = {'dialog': [], 'target': [], 'emotion': [], 'situation': [], 'usercause_label': test_usercause_label, 'usercause': [], 'graphs': [], 'graphidx': [], 'act_label': test_act_label, 'fake_same_act': test_fake_same_act, 'fake_same_emo': test_fake_same_emo}
@@ -109,7 +201,7 @@ def read_langs(vocab):
         for utts in dialog:
             u_list = []
             for u in utts:
-                u = nltk.word_tokenize(u)
+                u = list(tokens[u])
                 u_list.append(u)
                 vocab.index_words(u)
             u_lists.append(u_list)
@@ -118,7 +210,7 @@ def read_langs(vocab):
     for target in train_target:
         u_list = []
         for u in target:
-            u = nltk.word_tokenize(u)
+            u = list(tokens[u])
 
             u_list.append(u)
             vocab.index_words(u)
@@ -128,7 +220,7 @@ def read_langs(vocab):
     for situation in train_situation:
         u_list = []
         for u in situation:
-            u = nltk.word_tokenize(u)
+            u = list(tokens[u])
             u_list.append(u)
             vocab.index_words(u)
         data_train['situation'].append(u_list)
@@ -136,7 +228,7 @@ def read_langs(vocab):
     for cause in train_usercause:
         u_lists = []
         for utts in cause:
-            u_list =  nltk.word_tokenize(utts)
+            u_list =  list(tokens[utts])
             u_lists.append(u_list)
         data_train['usercause'].append(u_lists)
 
@@ -156,7 +248,7 @@ def read_langs(vocab):
         for utts in dialog:
             u_list = []
             for u in utts:
-                u = nltk.word_tokenize(u)
+                u = list(tokens[u])
                 u_list.append(u)
                 vocab.index_words(u)
             u_lists.append(u_list)
@@ -165,7 +257,7 @@ def read_langs(vocab):
     for target in dev_target:
         u_list = []
         for u in target:
-            u = nltk.word_tokenize(u)
+            u = list(tokens[u])
             u_list.append(u)
             vocab.index_words(u)
         data_dev['target'].append(u_list)
@@ -173,7 +265,7 @@ def read_langs(vocab):
     for situation in dev_situation:
         u_list = []
         for u in situation:
-            u = nltk.word_tokenize(u)
+            u = list(tokens[u])
             u_list.append(u)
             vocab.index_words(u)
         data_dev['situation'].append(u_list)
@@ -184,7 +276,7 @@ def read_langs(vocab):
     for cause in dev_usercause:
         u_lists = []
         for utts in cause:
-            u_list = nltk.word_tokenize(utts)
+            u_list = list(tokens[utts])
             u_lists.append(u_list)
         data_dev['usercause'].append(u_lists)
 
@@ -204,7 +296,7 @@ def read_langs(vocab):
         for utts in dialog:
             u_list = []
             for u in utts:
-                u = nltk.word_tokenize(u)
+                u = list(tokens[u])
                 u_list.append(u)
                 vocab.index_words(u)
             u_lists.append(u_list)
@@ -213,7 +305,7 @@ def read_langs(vocab):
     for target in test_target:
         u_list = []
         for u in target:
-            u = nltk.word_tokenize(u)
+            u = list(tokens[u])
             u_list.append(u)
             vocab.index_words(u)
         data_test['target'].append(u_list)
@@ -221,7 +313,7 @@ def read_langs(vocab):
     for situation in test_situation:
         u_list = []
         for u in situation:
-            u = nltk.word_tokenize(u)
+            u = list(tokens[u])
             u_list.append(u)
             vocab.index_words(u)
         data_test['situation'].append(u_list)
@@ -232,7 +324,7 @@ def read_langs(vocab):
     for cause in test_usercause:
         u_lists = []
         for utts in cause:
-            u_list = nltk.word_tokenize(utts)
+            u_list = list(tokens[utts])
             u_lists.append(u_list)
         data_test['usercause'].append(u_lists)
 
@@ -252,109 +344,166 @@ def read_langs(vocab):
     assert len(data_test['dialog']) == len(data_test['target']) == len(data_test['emotion']) == len(
         data_test['situation']) == len(data_test['usercause']) == len(data_test['usercause_label'])
 
-    T = 2
-    # >>>>>>>>>> causes of the conversation train >>>>>>>>>> #
-    if not os.path.exists(config.data_npy_dict + 'sys_UserCause_{}_Path.train.json'.format(T)):
-        train_usercause = np.load(config.data_npy_dict + 'sys_usercause_texts.train.npy',
-                                  allow_pickle=True)
-        results, causes, idlist = [], [], []
-        for idx, dialog in enumerate(train_dialog):
-            for jdx, utts in enumerate(dialog[-1]):
-                idlist.append(idx)
-                results.append(utts)
-                causes.append(train_usercause[idx][jdx])
-
-        newIdlist = process(config.data_npy_dict + 'sys_UserCause_{}_Path.train.json'.format(T), causes, results, idlist, T)
-        with open(config.data_npy_dict + 'sys_UserCause_{}_PathId.train.json'.format(T), 'w') as f:
-            json.dump(newIdlist, f)
-
-    if not os.path.exists(config.data_npy_dict + 'sys_UserCause_{}_Path.valid.json'.format(T)):
-        dev_usercause = np.load(config.data_npy_dict + 'sys_usercause_texts.valid.npy',
-                                allow_pickle=True)
-        results, causes, idlist = [], [], []
-        for idx, dialog in enumerate(dev_dialog):
-            for jdx, utts in enumerate(dialog[-1]):
-                idlist.append(idx)
-                results.append(utts)
-                causes.append(dev_usercause[idx][jdx])
-
-        newIdlist = process(config.data_npy_dict + 'sys_UserCause_{}_Path.valid.json'.format(T), causes, results, idlist, T)
-        with open(config.data_npy_dict + 'sys_UserCause_{}_PathId.valid.json'.format(T), 'w') as f:
-            json.dump(newIdlist, f)
-
-    if not os.path.exists(config.data_npy_dict + 'sys_UserCause_{}_Path.test.json'.format(T)):
-        test_usercause = np.load(config.data_npy_dict + 'sys_usercause_texts.test.npy',
-                                 allow_pickle=True)
-        results, causes, idlist = [], [], []
-        for idx, dialog in enumerate(test_dialog):
-            for jdx, utts in enumerate(dialog[-1]):
-                idlist.append(idx)
-                results.append(utts)
-                causes.append(test_usercause[idx][jdx])
-
-        newIdlist = process(config.data_npy_dict + 'sys_UserCause_{}_Path.test.json'.format(T), causes, results, idlist, T)
-        with open(config.data_npy_dict + 'sys_UserCause_{}_PathId.test.json'.format(T), 'w') as f:
-            json.dump(newIdlist, f)
-
-    if not os.path.exists(config.data_concept_dict + 'sys_UserHops_{}_triple.train.json'.format(T)):
-        usergraph = directed_triple(config.data_npy_dict + 'sys_UserCause_{}_Path.train.json'.format(T),
-                        config.data_concept_dict + 'sys_UserHops_{}_triple.train.json'.format(T))
-    else:
-        usergraph = read_json(config.data_concept_dict + 'sys_UserHops_{}_triple.train.json'.format(T))
-    with open(config.data_npy_dict + 'sys_UserCause_{}_PathId.train.json'.format(T), 'r') as f:
-        data_train['graphidx'] = json.load(f)
-
-    data_train['graphs'] = usergraph
-
-    assert len(data_train['target']) == len(data_train['graphidx'])
-
-    if not os.path.exists(config.data_concept_dict + 'sys_UserHops_{}_triple.valid.json'.format(T)):
-        usergraph = directed_triple(config.data_npy_dict + 'sys_UserCause_{}_Path.valid.json'.format(T),
-                        config.data_concept_dict + 'sys_UserHops_{}_triple.valid.json'.format(T))
-    else:
-
-        usergraph = read_json(config.data_concept_dict + 'sys_UserHops_{}_triple.valid.json'.format(T))
-    with open(config.data_npy_dict + 'sys_UserCause_{}_PathId.valid.json'.format(T), 'r') as f:
-        data_dev['graphidx'] = json.load(f)
-
-    data_dev['graphs'] = usergraph
-
-    assert len(data_dev['target']) == len(data_dev['graphidx'])
-
-    if not os.path.exists(config.data_concept_dict + 'sys_UserHops_{}_triple.test.json'.format(T)):
-        usergraph = directed_triple(config.data_npy_dict + 'sys_UserCause_{}_Path.test.json'.format(T),
-                        config.data_concept_dict + 'sys_UserHops_{}_triple.test.json'.format(T))
-    else:
-        usergraph = read_json(config.data_concept_dict + 'sys_UserHops_{}_triple.test.json'.format(T))
-    with open(config.data_npy_dict + 'sys_UserCause_{}_PathId.test.json'.format(T), 'r') as f:
-        data_test['graphidx'] = json.load(f)
-
-    data_test['graphs'] = usergraph
-
-    assert len(data_test['target']) == len(data_test['graphidx'])
+    for split, data in zip(['train', 'valid', 'test'], [data_train, data_dev, data_test]):
+        data['graphs'] = GraphStore(config.data_concept_dict + 'sys_UserHops_{}_triple.{}/'.format(T, split))
+        with open(config.data_npy_dict + 'sys_UserCause_{}_PathId.{}.json'.format(T, split), 'r') as f:
+            data['graphidx'] = json.load(f)
+        assert len(data['target']) == len(data['graphidx'])
 
     return data_train, data_dev, data_test, vocab
 
+def extract_causes(split):
+    """Predicts the cause clauses of one split with cause_extraction."""
+    from models.cause_extraction import predict
+    situation = np.load(config.data_npy_dict + 'sys_situation_texts.{}.npy'.format(split), allow_pickle=True)
+    dialog = np.load(config.data_npy_dict + 'sys_dialog_texts.{}.npy'.format(split), allow_pickle=True)
+    target = np.load(config.data_npy_dict + 'sys_target_texts.{}.npy'.format(split), allow_pickle=True)
+    predict(situation, dialog, target, split, config.data_npy_dict)
+
+def find_split_paths(split, T, max_B, max_search, workers=1):
+    """Finds concept paths from every user cause to its utterance in the last turn of each dialog."""
+    from dataprocess.find_path import process
+    dialogs = np.load(config.data_npy_dict + 'sys_dialog_texts.{}.npy'.format(split), allow_pickle=True)
+    usercause = np.load(config.data_npy_dict + 'sys_usercause_texts.{}.npy'.format(split), allow_pickle=True)
+    results, causes, idlist = [], [], []
+    for idx, dialog in enumerate(dialogs):
+        for jdx, utts in enumerate(dialog[-1]):
+            idlist.append(idx)
+            results.append(utts)
+            causes.append(usercause[idx][jdx])
+
+    newIdlist = process(config.data_npy_dict + 'sys_UserCause_{}_Path.{}.json'.format(T, split), causes, results, idlist, T,
+                        max_B, max_search, workers=workers)
+    with open(config.data_npy_dict + 'sys_UserCause_{}_PathId.{}.json'.format(T, split), 'w') as f:
+        json.dump(newIdlist, f)
+
+def prune_vocab(vocab, counts, keep, min_count=0, max_size=0):
+    """
+    A new Lang with the special tokens, every word of `keep` and, of the other words, those counted at
+    least min_count times in `counts`, the most frequent first when max_size caps the total. Words
+    keep their relative order, so an unpruned vocabulary comes back unchanged.
+    """
+    n_special = config.SEP_idx + 1
+    words = [vocab.index2word[i] for i in range(vocab.n_words)]
+    kept = set(words[:n_special]) | (keep & set(words))
+    candidates = [w for w in words[n_special:] if w not in kept and counts.get(w, 0) >= min_count]
+    if max_size:
+        candidates = sorted(candidates, key=lambda w: counts.get(w, 0), reverse=True)[:max(max_size - len(kept), 0)]
+    kept.update(candidates)
+
+    pruned = Lang({i: w for i, w in enumerate([w for w in words if w in kept])})
+    pruned.word2count = {w: vocab.word2count[w] for w in pruned.word2index}
+    return pruned
+
+def vocab_report(full_size, vocab, counts, target_lengths):
+    """Output-layer cost per batch of config.bz targets before and after pruning, and the train UNK rate."""
+    tokens = config.bz * float(np.mean(target_lengths))
+    report = {'full_size': full_size, 'kept_size': vocab.n_words, 'tokens_per_batch': tokens,
+              'train_unk_rate': sum(c for w, c in counts.items() if w not in vocab.word2index) / max(sum(counts.values()), 1)}
+    for name, size in [('full', full_size), ('kept', vocab.n_words)]:
+        # >>>>>>>>>> generator projection and the fp32 logits + log-probs it materialises >>>>>>>>>> #
+        report[name + '_generator_gflops'] = 2 * tokens * config.hidden_dim * size / 1e9
+        report[name + '_logits_mb'] = 2 * tokens * size * 4 / 2 ** 20
+        report[name + '_embedding_mb'] = size * config.emb_dim * 4 / 2 ** 20
+    print('vocabulary: {full_size} -> {kept_size} words, train UNK rate {train_unk_rate:.4f}'.format(**report))
+    print('per batch of {:.0f} target tokens: generator {:.2f} -> {:.2f} GFLOPs, logits {:.1f} -> {:.1f} MB, '
+          'embedding {:.1f} -> {:.1f} MB'.format(tokens, report['full_generator_gflops'], report['kept_generator_gflops'],
+                                                 report['full_logits_mb'], report['kept_logits_mb'],
+                                                 report['full_embedding_mb'], report['kept_embedding_mb']))
+    return report
+
+def compile_dataset(T, min_count=0, max_size=0):
+    """
+    Tokenizes all splits and writes them as TokenStores plus the frozen vocabulary under
+    config.data_compiled. The vocabulary is pruned by train-split counts; graph concepts are never
+    pruned so that the concept pointer can still address them.
+    """
+    data_tra, data_val, data_tst, vocab = read_langs(Lang(
+        {config.UNK_idx: "UNK", config.PAD_idx: "PAD", config.EOS_idx: "EOS", config.SOS_idx: "SOS",
+         config.USR_idx: "USR", config.SYS_idx: "SYS", config.SIT_idx: "SIT", config.CLS_idx: "CLS",
+         config.SEP_idx: "SEP"}), T)
+    # >>>>>>>>>> train counts go through Lang.index_words, so they are keyed exactly like the vocabulary >>>>>>>>>> #
+    train_vocab = Lang({})
+    for sent in [sent for field in ['situation', 'target'] for sents in data_tra[field] for sent in sents] + \
+                [sent for dialog in data_tra['dialog'] for utts in dialog for sent in utts]:
+        train_vocab.index_words(sent)
+    counts = train_vocab.word2count
+    concepts = set().union(*[data['graphs'].concepts for data in [data_tra, data_val, data_tst]])
+    full_size = vocab.n_words
+    vocab = prune_vocab(vocab, counts, concepts, min_count, max_size)
+    report = vocab_report(full_size, vocab, counts, [sum(len(s) for s in sents) + 1 for sents in data_tra['target']])
+
+    save_vocab(vocab, config.data_compiled + 'vocab/')
+    with open(config.data_compiled + 'vocab/pruning.json', 'w') as f:
+        json.dump(dict(report, min_count=min_count, max_size=max_size), f, indent=1)
+    vocab = FrozenLang(config.data_compiled + 'vocab/')
+    for split, data in zip(['train', 'valid', 'test'], [data_tra, data_val, data_tst]):
+        save_token_store(data, vocab, config.data_compiled + split + '/')
+
+def preprocess_stages():
+    """
+    The preprocessing DAG, in dependency order: clauses, dialogue acts and fake targets from the csv
+    files, then cause extraction, path finding and triple stores per split, then the compiled dataset
+    and, with --tensor_cache, the materialised item tensors of every split.
+    """
+    # >>>>>>>>>> stage code is named by module so that fingerprinting reads its source without importing >>>>>>>>>> #
+    # >>>>>>>>>> spaCy or transformers; the stages import them only when they run >>>>>>>>>> #
+    from dataprocess.data2clause import ToClause, add_act, sample_fake
+    npy, concept = config.data_npy_dict, config.data_concept_dict
+    T = config.path_hops
+    splits = ['train', 'valid', 'test']
+    texts = ['situation', 'dialog', 'target', 'emotion']
+    stages = []
+    for split in splits:
+        stages.append(Stage('clause.' + split, ToClause, (split,), inputs=[config.data_dict + '{}.csv'.format(split)],
+                            outputs=[npy + 'sys_{}_texts.{}.npy'.format(text, split) for text in texts],
+                            code=['dataprocess.data2clause']))
+    stages.append(Stage('act', add_act, deps=['clause.' + split for split in splits],
+                        inputs=[npy + 'sys_act_label.{}'.format(split) for split in splits],
+                        outputs=[npy + 'sys_act_texts.{}.npy'.format(split) for split in splits], code=['dataprocess.data2clause']))
+    for split in splits:
+        stages.append(Stage('fake.' + split, sample_fake, (split,), deps=['act'],
+                            outputs=[npy + 'sys_fake_same_{}.{}.npy'.format(kind, split) for kind in ['act', 'emo']],
+                            code=['dataprocess.data2clause']))
+        stages.append(Stage('cause.' + split, extract_causes, (split,), deps=['clause.' + split], group='gpu',
+                            outputs=[npy + 'sys_usercause_{}.{}.npy'.format(kind, split) for kind in ['texts', 'labels']],
+                            code=['models.cause_extraction']))
+        path = npy + 'sys_UserCause_{}_Path.{}.json'.format(T, split)
+        stages.append(Stage('path.' + split, find_split_paths, (split, T, config.path_max_B, config.path_max_search),
+                            {'workers': config.path_workers}, deps=['cause.' + split], group='path_cache',
+                            inputs=[config.conceptnet, config.concept_vocab, config.concept_rel, config.conceptnet_graph],
+                            outputs=[path, npy + 'sys_UserCause_{}_PathId.{}.json'.format(T, split)],
+                            scratch=[path + '.part', path + '.journal', concept + 'sys_concepts.{}.json'.format(split)],
+                            code=['dataprocess.find_path', 'dataprocess.build_graph']))
+        store = concept + 'sys_UserHops_{}_triple.{}/'.format(T, split)
+        stages.append(Stage('triple.' + split, directed_triple, (path, store, config.max_mem_size, config.max_triple_size),
+                            {'workers': config.triple_workers}, deps=['path.' + split], outputs=[store],
+                            scratch=[store.rstrip('/') + '.shards/', store.rstrip('/') + '.tmp/'], code=['dataprocess.triple_store']))
+    stages.append(Stage('compile', compile_dataset, (T, config.vocab_min_count, config.vocab_max_size),
+                        deps=['fake.' + split for split in splits] + ['triple.' + split for split in splits],
+                        outputs=[config.data_compiled + split + '/' for split in splits] + [config.data_compiled + 'vocab/'],
+                        code=[read_langs, tokenize_sentences, prune_vocab, Lang, save_vocab, FrozenLang, 'dataprocess.token_store']))
+    if config.tensor_cache:
+        from dataprocess.data_loader import materialize_split, Dataset
+        for split in splits:
+            tensors = config.data_compiled + 'tensors/{}/'.format(split)
+            stages.append(Stage('tensors.' + split, materialize_split, (split, tensors), deps=['compile'], outputs=[tensors],
+                                code=[Dataset, 'dataprocess.tensor_store']))
+    return stages
+
 def load_dataset():
-    if os.path.exists(config.data_path):
-        print("LOADING empathetic_dialogue")
-        with open(config.data_path, "rb") as f:
-            [data_tra, data_val, data_tst, vocab] = pickle.load(f)
-            # >>>>>>>>>> dictionaries >>>>>>>>>> #
-    else:
-        print("Building dataset...")
-        data_tra, data_val, data_tst, vocab = read_langs(vocab=Lang(
-            {config.UNK_idx: "UNK", config.PAD_idx: "PAD", config.EOS_idx: "EOS", config.SOS_idx: "SOS",
-             config.USR_idx: "USR", config.SYS_idx: "SYS", config.SIT_idx: "SIT", config.CLS_idx: "CLS",
-             config.SEP_idx: "SEP"}))
-        with open(config.data_path, "wb") as f:
-            pickle.dump([data_tra, data_val, data_tst, vocab], f)
-            print("Saved PICKLE")
+    """
+    Brings the preprocessing stages up to date, rerunning only those whose inputs or parameters
+    changed, and returns the train, valid and test TokenStores and the vocabulary.
+    """
+    run_stages(preprocess_stages(), config.data_dict + 'stages.json', config.stage_workers)
+    splits = ['train', 'valid', 'test']
+    data_tra, data_val, data_tst = [TokenStore(config.data_compiled + split + '/') for split in splits]
+    vocab = FrozenLang(config.data_compiled + 'vocab/')
     for i in range(3):
-        print('[situation]:', ' '.join([ele for lis in data_tra['situation'][i] for ele in lis]))
+        print('[situation]:', ' '.join(vocab.decode([data_tra['situation'].span(i)], stop_idx=None)[0]))
         print('[emotion]:', data_tra['emotion'][i])
-        print('[dialog]:', [' '.join(u) for u in [ele for lis in data_tra['dialog'][i] for ele in lis]])
-        print('[target]:', ' '.join([ele for lis in data_tra['target'][i] for ele in lis]))
+        print('[dialog]:', [' '.join(u) for u in vocab.decode([ele for lis in data_tra['dialog'][i] for ele in lis], stop_idx=None)])
+        print('[target]:', ' '.join(vocab.decode([data_tra['target'].span(i)], stop_idx=None)[0]))
         print(" ")
     return data_tra, data_val, data_tst, vocab
-
@@ -1,5 +1,8 @@
 
 import json
+import time
+import multiprocessing
+import numpy as np
 from tqdm import tqdm
 import networkx as nx
 import spacy
@@ -7,13 +10,15 @@ nlp = spacy.load('en_core_web_md', disable=['ner', 'parser', 'textcat'])
 import os
 
 import config
-from dataprocess.build_graph import load_resources
+from dataprocess.build_graph import load_resources, save_csr, csr_sources, source_stamp, CSRGraph, SimpleCSRGraph
+from dataprocess.json_lines import read_json_lines, sentence_hash
+from dataprocess.stages import code_version
 
 blacklist = {'-PRON-', 'whither', 'iq', 'al', 'xk', 'et-al', 'resulting', 'mg', 'specified', 'more', 'rf', 'c3', 'else', 'whence', 'usefulness', 'rr', 'est', 'made', 'edu', 'somehow', 'below', 'besides', 'thereby', 'thousand', 'ag', 'it', 'tp', 'lately', 'J', 'described', 'id', 'if', 'dp', 'want', 'e', 'L', 'arent', 'yl', 'sd', 'secondly', 'my', 'a3', 'already', 'f2', 'mostly', 'hardly', 'whenever', 'vs', 'qv', 'ra', 'we', 'bl', 'our', 'doing', 'added', 'hadn', 'hi', 'how', 'r', 'indicates', 'slightly', 'shed', 'always', 'anyways', 'right', 'ui', 'aside', 'page', 'considering', 'won', 'move', 'forty', 'ms', 'ey', 'whom', 'th', 'cv', 'its', 'both', 'probably', 'tc', 'hed', 'everything', 'pf', 'fi', 'keep', 'some', 'e3', 'with', 'entirely', 'somethan', 'td', 'av', '3a', 'is', 'comes', 'di', 'fu', 'la', 'might', 'cannot', 'up', 'follows', 'showed', 'trying', 'who', 'amount', 'usually', 'giving', 'cf', 'thereof', 'bottom', 'inasmuch', 'given', 'r2', 'insofar', 'ba', 'rather', 'hj', 'from', 'cr', 'latter', 'rd', 'respectively', 'though', 'anyway', 'kept', 'ho', 'til', 'P', 'wherever', 'vo', 'does', 'fify', 'quickly', 'ar', 'b1', 'W', 'cm', '6b', 'almost', 'e2', 'ip', 'theres', 'million', 'y', 'vols', 'ns', '6o', 'before', 'lr', 'they', 'why', 'dx', 'gj', 'research-articl', 'little', 'run', 'fa', 'ur', 'using', 'whomever', 'ih', 'which', 'whereafter', 'outside', 'xj', 'concerning', 'mainly', 'therere', 'yours', 'looking', 'thoroughly', 'cq', 'bt', 'for', 'gave', 'could_be', 'affected', 'six', 'obtain', 'somewhat', 'mn', 'eight', 'hereby', 'me', 'ran', 'b', 'ru', 'thickv', 'throughout', 'four', 'please', 'U', 'soon', 'tb', 'sixty', 'ob', 'successfully', 'km', 'necessarily', 'neither', 'show', 'shown', 'Z', 'about', 'H', 'a1', 'nn', 'dj', 'se', 'que', 'strongly', 'indeed', 'took', 'appreciate', 'i8', 'rn', 'us', 'ge', 'http', 'ou', 'sc', 'taken', 'og', 'hes', 'front', 'p2', 'top', 'want_to', 'pagecount', 'or', 'several', 'third', 'lb', 'specify', 'two', 'op', 'each', 'sincere', 'os', 'alone', 'yr', 'side', 'let', 'nr', 'anyone', 'ep', 'gets', 'mug', 'pas', 'presumably', 'y2', 'sometimes', 'able', 'oz', 'useful', 'when', 'old', 'dl', 'ri', 'got', 'someone', 'oo', 'obviously', 'pe', 'cc', 'latterly', 'theirs', 'beyond', 'B', 'own', 'as', 'welcome', 'oq', 'suggest', 'xi', 'while', 'va', 'bs', 'whether', 'following', 'non', 'second', 'eq', 'zero', 'ev', 's2', 'ph', 'fs', 'pc', 'no', 'wed', 'hereupon', 'ord', 'most', 'par', 'viz', 'xs', '0o', 'rh', 'themselves', 'ci', 'still', 'ts', 't3', 'toward', 'shes', 'E', 'regardless', 'give', 'just', 'zi', 'on', 'but', 'sn', 'mo', 'another', 'way', 'done', 'goes', 'ain', 'ec', 'couldn', 'forth', 'po', 'uk', 'none', 'bill', 'exactly', 'io', 'proud', 'cn', 'eleven', 'between', 'part', 'rj', 'once', 's', 'D', 'although', 'ln', 'vol', 'volumtype', 'now', 'tl', 'unlike', 'mustn', 'm', 'name', 'nos', 'l2', 'ca', 'itd', 'hs', 'three', 'o', 'that', 'seeming', 'afterwards', 'ft', 'ic', 'shows', 'through', 'anymore', 'don', 'thanks', 'gs', 'oc', 'among', 'pt', 'yes', 'didn', 'w', 'towards', 'whatever', 'whos', 'substantially', 'next', 'recent', 'sent', 'thorough', 'ma', 'any', 'eg', 'according', 'howbeit', 'beginnings', 'and', 'by', 'vt', 'thereupon', 'shall', 'ny', 'far', 'fo', 'hence', 'fn', 'ac', 'whose', 'may', 'fl', 'sec', 'says', 'www', 'near', 'cg', 'herein', 'cd', 'recently', 'tends', 'da', 'heres', 'clearly', 'ib', 'over', 'wheres', 'xn', 'js', 'those', 'many', 'widely', 'used', 'went', 'br', 'regarding', 'nevertheless', 'until', 'ao', 'particular', 'ref', 'ue', 'hello', 'ad', 'found', 'qj', 'relatively', 'l', 'per', 'p3', 'came', 'es', 'moreover', 'away', 'affecting', 'nt', 'sufficiently', 'various', 'ir', 'bk', '0s', 'regards', 'sometime', 'truly', 'hy', 'xo', 'i6', 'ten', 'ti', 'ask', 'related', 'thanx', 'apart', 'com', 'jr', 'xl', 'gone', 'dy', 'iy', 'tr', 'pp', 'section', 'aw', 'said', 'sure', 'tell', 'unfortunately', 'best', 'information', 'pi', 'sz', 'under', 'this', 'hasnt', 'whoever', 'fire', 'less', 'whod', 'ch', 'n', 'tx', 'tv', 'index', 'lj', 'nonetheless', 'sl', 'your', 'did', 'had', 'whole', 'hu', 'ought', 'owing', 'going', 'keeps', 'nd', 'so', 'few', 'ah', 'gotten', 'not', 'thou', 'anybody', 'lest', 'lf', 'tried', 'consequently', 'wouldnt', 'refs', 'yt', 'be', 'well', 'v', 'n2', 'rq', 'in', 'get', 'ga', 'you', 'something', 'every', 'became', 'ay', 'sy', 'au', 'az', 'co', 'st', 'i4', 'thereto', 'df', 'then', 'thoughh', 'ibid', 'pq', 'rc', 'm2', 'actually', 'meantime', 'help', 'bc', 'bu', 'consider', 'seems', 'saying', 'cry', 'fy', 'ninety', 'too', 'can', 'getting', 'otherwise', 'et', 'tip', 'fifth', 'ox', 'ei', 't2', 'haven', 'make', 'aren', 'has', 'indicated', 'interest', 'very', 'previously', 'tries', 'mrs', 'hid', 'course', 'followed', 'except', 'oa', 'ej', 'primarily', 'los', 'thence', 'S', 'sa', 'downwards', 'amoungst', 'doesn', 'twice', 'z', 'xv', 'detail', 'full', 'hh', 'above', '3b', 'ed', 'oj', 'af', 'date', 'usefully', 'youd', 'sf', 'bi', 'must', 'whim', 'ok', 'ef', 'ps', 'anyhow', 'nor', 'former', 'bn', 'ce', 'sj', 'j', 'er', 'sup', 'novel', 'off', 'du', 'anywhere', 'bd', 'predominantly', 'ss', '3d', 'fc', 'liked', 'rm', 'upon', 'resulted', 'take', 'oi', 'cj', 'c', 'largely', 'p', 'ending', 'put', 'b2', 'dt', 'even', 'mu', 'unless', 'really', 'thus', 'X', 'after', 'gl', 'k', 'nl', 'therein', 'again', 'are', 'ex', 'nj', 'lets', 'ones', 'sm', 'iv', 'C', 'end', 'via', 'omitted', 'cl', 'inner', 'h3', 'looks', 'around', 'M', 'seemed', 'couldnt', 'together', 'od', 'somewhere', 'cu', 'despite', 'would', 'hopefully', 'thered', 'eu', 'om', 'cp', 'un', 'been', 'nine', 'showns', 'ia', 'five', 'im', 'cant', 'apparently', 'well-b', 'ko', 'isn', 'the', 'specifying', 'especially', 'certainly', 'd', 'ea', 'particularly', 'R', 'taking', 'ff', 'furthermore', 've', 'twelve', 'yj', 'where', 'beforehand', 'results', 'seven', 'their', 'eo', 'adj', 'i2', 'amongst', 'than', 'pd', 'sp', 'ae', 'lt', 'noted', 'out', 'readily', 'makes', 'okay', 'weren', 'h2', 'wouldn', 'cx', 'rs', 'con', 'call', 'a4', 'K', 'somebody', 'am', 'approximately', 'pages', 'mr', 'mt', 'nobody', 'lc', 'wi', 'shan', 'ix', 'tf', 'sorry', 'les', 'en', 'qu', 'd2', 'dd', 'past', 'em', 'thank', 'u201d', 'what', 'sub', 'um', 'dc', 'ee', 'jj', 'perhaps', 'tq', 'wasn', 'x1', 'stop', 'fix', 'etc', 'sometimes_people', 'could', 'O', 'ro', 'ups', 'xf', 'h', 'i7', 'fifteen', 'meanwhile', 'seem', 'reasonably', 'either', 'c1', 'thereafter', 'vj', 'tt', 'behind', 'sr', 'de', 'hasn', 'last', 'nearly', 'try', 'ut', 'were', 'wherein', 'gives', 'bx', 'everyone', 'mine', 'jt', 'x', 'si', 'p1', 'across', 'ls', 'beside', 'like', 'gi', 'zz', 'a2', 'mill', 'cs', 'since', 'whats', 'pr', 't', 'G', 'kj', 'only', 'fj', 'therefore', 'was', 'certain', 'll', 'look', 'eighty', 'during', 'b3', 'have', 'wont', 'back', 'bp', 'later', 'elsewhere', 'hither', 'ke', 'maybe', 'ry', 'namely', 'biol', 'dr', 'inward', 'provides', 'dk', 'promptly', 'ignored', 'specifically', 'pk', 'ow', 'thats', 'there', 'tn', 'further', 'cit', 'fr', 'announce', 'everywhere', 'accordingly', 'these', 'el', 'into', 'i3', 'u', 'wonder', 'ne', 'enough', 'along', 'unlikely', 'wo', 'of', 'werent', 'awfully', 'f', 'i', 'a', 'line', 'ii', 'vd', 'he', 'whereby', 'xt', 'ys', 'twenty', 'theyd', 'much', 'say', 'abst', 'fill', 'placed', 'ij', 'merely', 'pn', 'find', 'ng', 'possibly', 'pu', 'within', 'at', 'available', 'ltd', 'aj', 'bj', 'na', 're', 'ol', 'theyre', 'instead', 'pj', 'overall', 'cy', 'py', 'likely', 'also', 'ab', 'kg', 'ot', 'them', 'here', 'tj', 'mightn', 'A', 'vu', 'Q', 'rt', 'nc', 'yet', 'often', 'ct', 'x2', 'happens', 'pl', 'quite', 'come', 'rv', 'auth', 'allow', 'miss', 'N', 'ju', 'youre', 'throug', 'to', 'nowhere', 'uj', 'whereas', 'xx', 'such', 'down', 'gr', 'te', 'go', 'rl', 'hr', 'all', 't1', 'whereupon', 'act', 'wa', 'ds', 'everybody', 'F', 'x3', 'nay', 'onto', 'however', 'normally', 'il', 'indicate', 'without', 'noone', 'V', 'inc', 'sq', 'oh', 'thin', 'tm', 'describe', 'iz', 'ever', 'le', 'lo', 'ml', 'wasnt', 'greetings', 'obtained', 'allows', 'against', 'think', 'pm', 'brief', 'g', 'ni', 'vq', 'having', 'immediately', 'Y', 'saw', 'unto', 'ig', 'accordance', 'example', 'ap', 'briefly', 'one', 'cz', 'asking', 'new', 'c2', 'hundred', 'do', 'T', 'least', 'ie', 'arise', 'definitely', 'seen', 'uo', 'poorly', 'hereafter', 'thru', 'formerly', 'q', 'due', 'an', 'ax', 'gy', 'plus'}
 
 def load_cpnet():
     global concept2id, relation2id, id2relation, id2concept, concept_vocab
-    global cpnet, cpnet_simple
+    global cpnet, cpnet_simple, graph_version
 
     def jsonKeys2int(x):
         if isinstance(x, dict):
@@ -41,7 +46,24 @@ def load_cpnet():
             f.write('\n')
 
     concept_vocab = concept2id.keys()
+    # >>>>>>>>>> the CSR store is built from the ConceptNet CSV on first use and whenever its sources change; >>>>>>>>>> #
+    # >>>>>>>>>> the networkx pickle is only read when there is neither a CSV nor a CSR store >>>>>>>>>> #
+    if os.path.exists(config.conceptnet) and not CSRGraph.is_current(config.conceptnet_csr, csr_sources()):
+        save_csr()
+    if os.path.exists(config.conceptnet_csr):
+        # >>>>>>>>>> memory-mapped, read-only graph shared by every preprocessing process, rebuilt with the CSR store >>>>>>>>>> #
+        simple_sources = [os.path.join(config.conceptnet_csr, '{}.npy'.format(name)) for name in CSRGraph.fields]
+        if not SimpleCSRGraph.is_current(config.data_concept_dict + 'simple_concept_csr/', simple_sources):
+            SimpleCSRGraph.from_csr(CSRGraph.load(config.conceptnet_csr, mmap_mode='r')).save(
+                config.data_concept_dict + 'simple_concept_csr/', simple_sources)
+        cpnet_simple = SimpleCSRGraph.load(config.data_concept_dict + 'simple_concept_csr/', mmap_mode='r')
+        graph_version = sentence_hash(json.dumps(source_stamp(simple_sources)))
+        # >>>>>>>>>> the simple graph keeps the relation set of every directed edge, which is all get_edge needs >>>>>>>>>> #
+        cpnet = cpnet_simple
+        return
+
     cpnet = nx.read_gpickle(config.conceptnet_graph)
+    graph_version = sentence_hash(json.dumps(source_stamp([config.conceptnet_graph])))
 
     if os.path.exists(config.data_concept_dict+'simple_concept.graph'):
         cpnet_simple = nx.read_gpickle(config.data_concept_dict+'simple_concept.graph')
@@ -56,8 +78,26 @@ def load_cpnet():
                 cpnet_simple.add_edge(u, v, weight=w)
         nx.write_gpickle(cpnet_simple, config.data_concept_dict+'simple_concept.graph')
 
-def hard_ground(sent):
-    doc = nlp(sent)
+def load_concept_vectors():
+    """
+    L2-normalised float32 spaCy vectors of every concept id, computed once and memory-mapped after,
+    so that a dot product between two rows equals Token.similarity of the two concepts.
+    """
+    global concept_vectors
+    vector_path = config.data_concept_dict + 'concept_vectors.npy'
+    if not os.path.exists(vector_path):
+        vectors = np.zeros((len(id2concept), nlp.vocab.vectors_length), dtype=np.float32)
+        texts = [id2concept[i] for i in range(len(id2concept))]
+        # >>>>>>>>>> static vectors only depend on the token text, so the tokenizer alone is enough >>>>>>>>>> #
+        for i, doc in tqdm(enumerate(nlp.tokenizer.pipe(texts, batch_size=10000)), total=len(texts), desc='concept vectors'):
+            if len(doc):
+                vectors[i] = doc[0].vector
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        vectors /= np.where(norms > 0, norms, 1)
+        np.save(vector_path, vectors)
+    concept_vectors = np.load(vector_path, mmap_mode='r')
+
+def ground_doc(doc):
     res = set()
     for t in doc:
         if t.lemma_ not in blacklist:
@@ -68,15 +108,45 @@ def hard_ground(sent):
                     res.add(t.text)
     return res
 
+def hard_ground(sent):
+    return ground_doc(nlp(sent))
+
+def ground_sentences(sents, batch_size=1000, n_process=1):
+    """
+    Grounds every distinct sentence once by streaming them through nlp.pipe. Results are cached
+    by sentence hash in a grounding cache named after the grounding rules, the spaCy model and the
+    concept vocabulary, so the train, valid and test splits share them.
+    """
+    version = code_version([ground_doc], sorted(blacklist), nlp.meta.get('name'), nlp.meta.get('version'),
+                           source_stamp([config.concept_vocab]))
+    cache_path = config.data_concept_dict + 'grounding_cache.{}.json'.format(version[:12])
+    cache = dict(read_json_lines(cache_path))
+
+    keys = {sent: sentence_hash(sent) for sent in sents}
+    todo = [sent for sent, key in keys.items() if key not in cache]
+    print('grounding {} new of {} distinct sentences ({} total)'.format(len(todo), len(keys), len(sents)))
+    with open(cache_path, 'a') as f:
+        docs = nlp.pipe(todo, batch_size=batch_size, n_process=n_process)
+        for i, (sent, doc) in enumerate(tqdm(zip(todo, docs), total=len(todo))):
+            cache[keys[sent]] = sorted(ground_doc(doc))
+            json.dump([keys[sent], cache[keys[sent]]], f)
+            f.write('\n')
+            # >>>>>>>>>> every finished nlp.pipe batch is made durable >>>>>>>>>> #
+            if (i + 1) % batch_size == 0:
+                f.flush()
+
+    return {sent: set(cache[key]) for sent, key in keys.items()}
+
 def match_concepts(start, end):
     res = []
     total_concepts = set()
     global total_concepts_id
     total_concepts_id = set(total_concepts_id)
-    for sid, s in tqdm(enumerate(start), total=len(start)):
+    grounded = ground_sentences(list(start) + list(end), config.ground_batch_size, config.ground_process)
+    for sid, s in enumerate(start):
         e = end[sid]
-        start_concepts = hard_ground(s)
-        end_concepts = hard_ground(e) - start_concepts
+        start_concepts = grounded[s]
+        end_concepts = grounded[e] - start_concepts
         total_concepts.update(start_concepts)
         total_concepts.update(end_concepts)
         res.append({'start': list(start_concepts), 'end': list(end_concepts)})
@@ -93,27 +163,32 @@ def find_neighbours_frequency(source_concepts, target_concepts, T, max_B=50, max
         return {"concepts": [], "labels": [], "distances": [], "triples": []}, -1, 0
 
     Ets = {} # nodes and their neighbor in last turn
-    target_concpet_nlp = [nlp(t_cpt)[0] for t_cpt in target_concepts]
     ts = [concept2id[t_cpt] for t_cpt in target_concepts]
+    target_vectors = concept_vectors[ts].T
     for t in range(T):
         V = {}
-        for s in start:
-            if s in cpnet_simple and s not in ts:
-                candidates = [c for c in cpnet_simple[s] if c not in Vts and c in total_concepts_id]
-                scores = {c: max([nlp(id2concept[c])[0].similarity(t_cpt) for t_cpt in target_concpet_nlp]) for c in candidates}
-                candidates = sorted(list(scores.items()), key=lambda x: x[1], reverse=True)[:max_search]
-                candidates = [x[0] for x in candidates]
-                for c in candidates:
-                    if c not in V:
-                        V[c] = scores[c]
+        sources = [s for s in start if s in cpnet_simple and s not in ts]
+        neighbours = [[c for c in cpnet_simple[s] if c not in Vts and c in total_concepts_set] for s in sources]
+        # >>>>>>>>>> score the candidates of every source against all targets in one product >>>>>>>>>> #
+        flat = [c for candidates in neighbours for c in candidates]
+        flat_scores = np.dot(concept_vectors[flat], target_vectors).max(axis=1).tolist() if flat else []
+        pos = 0
+        for s, candidates in zip(sources, neighbours):
+            scores = dict(zip(candidates, flat_scores[pos:pos + len(candidates)]))
+            pos += len(candidates)
+            candidates = sorted(list(scores.items()), key=lambda x: x[1], reverse=True)[:max_search]
+            candidates = [x[0] for x in candidates]
+            for c in candidates:
+                if c not in V:
+                    V[c] = scores[c]
+                else:
+                    V[c] += scores[c]
+                rels = get_edge(s, c)
+                if len(rels) > 0:
+                    if c not in Ets:
+                        Ets[c] = {s: rels}
                     else:
-                        V[c] += scores[c]
-                    rels = get_edge(s, c)
-                    if len(rels) > 0:
-                        if c not in Ets:
-                            Ets[c] = {s: rels}
-                        else:
-                            Ets[c].update({s: rels})
+                        Ets[c].update({s: rels})
 
         V = list(V.items())
         count_V = sorted(V, key=lambda x: x[1], reverse=True)[:max_B] # the top max_B nodes related to entities in start concepts
@@ -148,14 +223,94 @@ def find_neighbours_frequency(source_concepts, target_concepts, T, max_B=50, max
     return {"concepts": res, "labels": labels, "distances": distances, "triples": triples}, found_num, len(res)
 
 def get_edge(src_concept, tgt_concept):
+    if isinstance(cpnet, CSRGraph):
+        return cpnet.edge_relations(src_concept, tgt_concept)
     try:
         rel_list = cpnet[src_concept][tgt_concept]
         return list(set([rel_list[item]['rel'] for item in rel_list]))
     except:
         return []
 
-def process(save_path, start, end, idlist, T, max_B=25):
+class PathCache:
+    """
+    Append-only on-disk cache of find_neighbours_frequency results, keyed by a hash of the sorted
+    source set, the sorted target set, T, max_B and max_search, in one file per graph and search
+    setting. Only the byte offset of every entry is kept in memory; entries are read back from the
+    file on lookup. A torn last line left by a killed run is cut off on load.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.offsets = {}
+        self.hits, self.misses = 0, 0
+        self.file = open(path, 'a+b')
+        self.file.seek(0)
+        offset = 0
+        for line in self.file:
+            if not line.endswith(b'\n'):
+                break
+            # >>>>>>>>>> every line starts with ["<32 hex digits>", >>>>>>>>>> #
+            self.offsets[line[2:34].decode()] = offset
+            offset += len(line)
+        self.file.truncate(offset)
+
+    @staticmethod
+    def key(sources, targets, T, max_B, max_search):
+        return sentence_hash(json.dumps([sorted(sources), sorted(targets), T, max_B, max_search]))
+
+    def __contains__(self, key):
+        return key in self.offsets
+
+    def get(self, key):
+        self.file.seek(self.offsets[key])
+        return json.loads(self.file.readline())[1]
+
+    def put(self, key, result):
+        self.file.seek(0, os.SEEK_END)
+        self.offsets[key] = self.file.tell()
+        self.file.write((json.dumps([key, result]) + '\n').encode())
+
+    def flush(self):
+        """Makes the entries put so far durable, before anything that relies on them is journaled."""
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def close(self):
+        self.file.close()
+
+def find_paths_shard(task):
+    """Runs find_neighbours_frequency over one shard of uncached, distinct (key, pair) items."""
+    T, max_B, max_search, items = task
+    start_time = time.time()
+    results = [(key, find_neighbours_frequency(sorted(pair['start']), sorted(pair['end']), T, max_B, max_search))
+               for key, pair in items]
+    return os.getpid(), time.time() - start_time, results
+
+def read_journal(journal_path):
+    """
+    Reads the progress journal of an interrupted path-finding run: whether each finished example
+    was written, and the byte length of the output file after the last one. A torn last line is cut off.
+    """
+    kept, part_end, valid_end = [], 0, 0
+    if not os.path.exists(journal_path):
+        return kept, part_end
+    with open(journal_path, 'rb') as f:
+        for line in f:
+            try:
+                i, is_kept, end = json.loads(line)
+            except ValueError:
+                break
+            assert i == len(kept)
+            kept.append(is_kept)
+            part_end = end
+            valid_end += len(line)
+    with open(journal_path, 'ab') as f:
+        f.truncate(valid_end)
+    return kept, part_end
+
+def process(save_path, start, end, idlist, T, max_B=25, max_search=12, workers=1):
     load_cpnet()
+    load_concept_vectors()
     print('Generating concept version ...')
     global total_concepts_id
     total_concepts_id = []
@@ -183,35 +338,109 @@ def process(save_path, start, end, idlist, T, max_B=25):
                 f.write(str(line))
                 f.write('\n')
 
+    global total_concepts_set
+    total_concepts_set = set(total_concepts_id)
     print('Done')
-    examples = []
     avg_len = 0
     avg_found = 0
     total_vaild = 0
     print('Finding paths ...')
-    for pair in tqdm(conceptVer):
-        info, found, avg_nodes = find_neighbours_frequency(pair['start'], pair['end'], T, max_B)
-        avg_len += avg_nodes
-        if found != -1:
-            avg_found += found
-            total_vaild += 1
-        examples.append(info)
-    print('{} hops avg nodes: {} avg_path: {}'.format(T, avg_len / len(examples), avg_found/total_vaild))
+    # >>>>>>>>>> examples are streamed to <save_path>.part and every finished index is journaled >>>>>>>>>> #
+    part_path, journal_path = save_path + '.part', save_path + '.journal'
+    kept, part_end = read_journal(journal_path)
+    done = len(kept)
+    if done:
+        print('Resuming after {} of {} examples'.format(done, len(conceptVer)))
+    with open(part_path, 'ab') as f:
+        f.truncate(part_end)
+
+    # >>>>>>>>>> only the concept sets that no earlier run has expanded with the same search code, graph, concept >>>>>>>>>> #
+    # >>>>>>>>>> vectors and set of dataset concepts (which filters the neighbours) and search settings are searched >>>>>>>>>> #
+    version = code_version([find_neighbours_frequency, get_edge, CSRGraph, SimpleCSRGraph], graph_version,
+                           nlp.meta.get('name'), nlp.meta.get('version'), sorted(total_concepts_set))
+    cache = PathCache(config.data_concept_dict + 'path_cache.B{}.S{}.{}.{}.json'.format(
+        max_B, max_search, graph_version[:12], version[:12]))
+    keys = [PathCache.key(pair['start'], pair['end'], T, max_B, max_search) for pair in conceptVer]
+
+    # >>>>>>>>>> distinct uncached keys in order of first use, deduplicated before any task is handed out >>>>>>>>>> #
+    todo = {}
+    for key, pair in zip(keys[done:], conceptVer[done:]):
+        if key not in cache and key not in todo:
+            todo[key] = pair
+    todo = list(todo.items())
+    tasks = [(T, max_B, max_search, todo[begin:begin + config.path_shard_size])
+             for begin in range(0, len(todo), config.path_shard_size)]
 
+    # >>>>>>>>>> forked workers inherit the memory-mapped graph and concept vectors without copying them >>>>>>>>>> #
+    if workers > 1:
+        pool = multiprocessing.get_context('fork').Pool(workers)
+        outputs = pool.imap(find_paths_shard, tasks)
+    else:
+        pool = None
+        outputs = map(find_paths_shard, tasks)
+    throughput = {}
+    processed = 0
+    try:
+        with open(part_path, 'ab') as out, open(journal_path, 'a') as journal:
+
+            def write_ready():
+                # >>>>>>>>>> shards finish in first-use order, so every example up to the next missing key is ready >>>>>>>>>> #
+                nonlocal processed, avg_len, avg_found, total_vaild
+                while len(kept) < len(conceptVer) and keys[len(kept)] in cache:
+                    info, found, avg_nodes = cache.get(keys[len(kept)])
+                    processed += 1
+                    avg_len += avg_nodes
+                    if found != -1:
+                        avg_found += found
+                        total_vaild += 1
+                    if info["concepts"] != []:
+                        out.write((json.dumps(info) + '\n').encode())
+                        out.flush()
+                    kept.append(info["concepts"] != [])
+                    json.dump([len(kept) - 1, kept[-1], out.tell()], journal)
+                    journal.write('\n')
+                    journal.flush()
+
+            write_ready()
+            for pid, elapsed, results in tqdm(outputs, total=len(tasks)):
+                pairs, seconds = throughput.get(pid, (0, 0.0))
+                throughput[pid] = (pairs + len(results), seconds + elapsed)
+                cache.misses += len(results)
+                for key, result in results:
+                    cache.put(key, result)
+                cache.flush()
+                write_ready()
+    except BaseException:
+        if pool is not None:
+            pool.terminate()
+        raise
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+        cache.close()
+
+    if processed:
+        print('{} hops avg nodes: {} avg_path: {}'.format(T, avg_len / processed, avg_found / max(total_vaild, 1)))
+    cache.hits = processed - cache.misses
+    print('path cache: {} hits, {} misses'.format(cache.hits, cache.misses))
+    for pid, (pairs, seconds) in throughput.items():
+        print('worker {}: {} pairs in {:.1f}s, {:.2f} pairs/s'.format(pid, pairs, seconds, pairs / max(seconds, 1e-9)))
+
+    # >>>>>>>>>> newIdlist only depends on which examples were kept, so it is rebuilt from the journal >>>>>>>>>> #
     newIdlist, tmpidx = {}, []
     curId, count = 0, 0
-    with open(save_path, 'w') as f:
-        for i, line in enumerate(examples):
-            if idlist[i] != curId:
-                newIdlist[curId] = tmpidx
-                curId = idlist[i]
-                tmpidx = []
-            if line["concepts"] == []:
-                continue
-            tmpidx.append(count)
-            count += 1
-            json.dump(line, f)
-            f.write('\n')
-        newIdlist[curId] = tmpidx
+    for i, is_kept in enumerate(kept):
+        if idlist[i] != curId:
+            newIdlist[curId] = tmpidx
+            curId = idlist[i]
+            tmpidx = []
+        if not is_kept:
+            continue
+        tmpidx.append(count)
+        count += 1
+    newIdlist[curId] = tmpidx
 
-    return newIdlist
\ No newline at end of file
+    os.replace(part_path, save_path)
+    os.remove(journal_path)
+    return newIdlist
@@ -0,0 +1,23 @@
+import os
+import json
+import hashlib
+
+def sentence_hash(sent):
+    return hashlib.md5(sent.encode('utf-8')).hexdigest()
+
+def read_json_lines(path):
+    """
+    Records of an append-only JSON-lines file, one per complete line. A torn last line left by a
+    killed run is cut off, so that appending can carry on from a line boundary.
+    """
+    records, valid_end = [], 0
+    if not os.path.exists(path):
+        return records
+    with open(path, 'r+b') as f:
+        for line in f:
+            if not line.endswith(b'\n'):
+                break
+            records.append(json.loads(line))
+            valid_end += len(line)
+        f.truncate(valid_end)
+    return records
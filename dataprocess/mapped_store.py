@@ -0,0 +1,9 @@
+class MappedStore:
+    """
+    Base of the read-only stores memory-mapped from a directory at self.path. They pickle as that
+    location rather than the mapped arrays, so DataLoader workers map the files themselves and share
+    them through the page cache instead of receiving copies.
+    """
+
+    def __reduce__(self):
+        return type(self), (self.path,)
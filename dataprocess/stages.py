@@ -0,0 +1,153 @@
+import os
+import json
+import shutil
+import inspect
+import importlib.util
+import hashlib
+import multiprocessing
+from multiprocessing.connection import wait
+
+def code_sources(code):
+    """
+    Source of every function, class and module in `code`, or its name where there is none to read.
+    A module may be given by its dotted name, in which case its file is read without importing it.
+    """
+    sources = []
+    for obj in code:
+        if isinstance(obj, str):
+            with open(importlib.util.find_spec(obj).origin, 'r', encoding='utf-8') as f:
+                sources.append(f.read())
+            continue
+        try:
+            sources.append(inspect.getsource(obj))
+        except (OSError, TypeError):
+            sources.append(getattr(obj, '__qualname__', obj.__name__))
+    return sources
+
+def code_version(code, *values):
+    """
+    Hash of the source of `code` and of `values`, put into the name of a cache shared across stages
+    and runs so that a change to the code or data that fills it starts a new cache.
+    """
+    return hashlib.md5(json.dumps([code_sources(code), list(values)], default=repr).encode('utf-8')).hexdigest()
+
+class Stage:
+    """
+    One preprocessing step: fn(*args, **options) writing `outputs`. The fingerprint covers the source
+    of fn and of the functions, classes and modules (or module names) in `code` that do its work,
+    args, the size and mtime of the raw `inputs` and the fingerprints of the `deps` stages; options
+    (worker counts and the like) do not change the result and are left out. Stages sharing a `group` touch a common
+    cache or device and never run at the same time.
+    """
+
+    def __init__(self, name, fn, args=(), options=None, deps=(), inputs=(), outputs=(), scratch=(), group=None,
+                 code=()):
+        self.name = name
+        self.fn = fn
+        self.args = args
+        self.options = options or {}
+        self.deps = deps
+        self.inputs = inputs
+        self.outputs = outputs
+        self.scratch = scratch
+        self.group = group
+        self.code = code
+
+    def fingerprint(self, upstream):
+        sources = code_sources([self.fn] + list(self.code))
+        inputs = [[path, os.path.getsize(path), os.path.getmtime(path)] if os.path.exists(path) else [path, None]
+                  for path in self.inputs]
+        state = [self.fn.__module__, sources, list(self.args), inputs, [upstream[dep] for dep in self.deps]]
+        return hashlib.md5(json.dumps(state, default=repr).encode('utf-8')).hexdigest()
+
+    def clean(self, resume=False):
+        """Removes outputs of an older run, and its scratch files too unless it is being resumed."""
+        for path in list(self.outputs) + ([] if resume else list(self.scratch)):
+            if os.path.isdir(path):
+                shutil.rmtree(path)
+            elif os.path.exists(path):
+                os.remove(path)
+
+    def run(self):
+        self.fn(*self.args, **self.options)
+
+def run_stages(stages, manifest_path, workers=1):
+    """
+    Runs the stages, given in dependency order, whose fingerprint differs from the one recorded in
+    manifest_path, whose outputs are missing, or which depend on such a stage. A stage the manifest
+    has no record of, whose outputs all exist and whose deps are up to date, is adopted as complete
+    rather than rebuilt, so outputs made before the manifest existed are kept. Up to `workers`
+    independent stages run at once, each in a forked process. An interrupted stage is rerun with
+    its scratch files kept, so stages that journal their progress resume where they stopped.
+    """
+    manifest = {}
+    if os.path.exists(manifest_path):
+        with open(manifest_path, 'r') as f:
+            manifest = json.load(f)
+
+    def save_manifest():
+        with open(manifest_path + '.tmp', 'w') as f:
+            json.dump(manifest, f, indent=1)
+        os.replace(manifest_path + '.tmp', manifest_path)
+
+    fingerprints, stale, adopted = {}, set(), []
+    for stage in stages:
+        fingerprints[stage.name] = stage.fingerprint(fingerprints)
+        outputs_exist = all(os.path.exists(path) for path in stage.outputs)
+        if stage.name not in manifest and stage.outputs and outputs_exist and not stale.intersection(stage.deps):
+            manifest[stage.name] = {'fingerprint': fingerprints[stage.name], 'complete': True}
+            adopted.append(stage.name)
+            continue
+        record = manifest.get(stage.name, {})
+        if record.get('fingerprint') != fingerprints[stage.name] or not record.get('complete') or \
+                not outputs_exist or stale.intersection(stage.deps):
+            stale.add(stage.name)
+    if adopted:
+        save_manifest()
+        print('preprocessing: adopted existing outputs of {}'.format(adopted))
+    print('preprocessing: {} of {} stages to run: {}'.format(len(stale), len(stages),
+                                                             [s.name for s in stages if s.name in stale]))
+
+    def start(stage):
+        record = manifest.get(stage.name, {})
+        stage.clean(resume=record.get('fingerprint') == fingerprints[stage.name] and not record.get('complete'))
+        manifest[stage.name] = {'fingerprint': fingerprints[stage.name], 'complete': False}
+        save_manifest()
+        print('preprocessing: running {}'.format(stage.name))
+
+    def finish(stage):
+        manifest[stage.name]['complete'] = True
+        save_manifest()
+
+    pending = [stage for stage in stages if stage.name in stale]
+    if workers <= 1:
+        for stage in pending:
+            start(stage)
+            stage.run()
+            finish(stage)
+        return
+
+    running, running_process = {}, {}
+    while pending or running:
+        busy_groups = {stage.group for stage in running.values() if stage.group is not None}
+        for stage in list(pending):
+            if len(running) >= workers:
+                break
+            if any(dep in stale for dep in stage.deps) or (stage.group is not None and stage.group in busy_groups):
+                continue
+            start(stage)
+            process = multiprocessing.get_context('fork').Process(target=stage.run, name=stage.name)
+            process.start()
+            running[process.sentinel] = stage
+            running_process[process.sentinel] = process
+            busy_groups.add(stage.group)
+            pending.remove(stage)
+        for sentinel in wait(list(running)):
+            stage, process = running.pop(sentinel), running_process.pop(sentinel)
+            process.join()
+            if process.exitcode != 0:
+                for other in running_process.values():
+                    other.terminate()
+                raise RuntimeError('preprocessing stage {} failed with exit code {}'.format(stage.name, process.exitcode))
+            finish(stage)
+            stale.discard(stage.name)
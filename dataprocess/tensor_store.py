@@ -0,0 +1,77 @@
+import os
+import torch
+import numpy as np
+from tqdm import tqdm
+from dataprocess.token_store import RaggedColumn
+from dataprocess.mapped_store import MappedStore
+
+# >>>>>>>>>> item key -> nesting depth (example > [sequence >] value) >>>>>>>>>> #
+tensor_fields = {'context': 1, 'context_mask': 1, 'causepos': 1, 'target': 1, 'cause_batch': 2, 'clause': 2,
+                 'graph_concept_ids': 2, 'graph_concept_label': 2, 'graph_distances': 2, 'graph_relation': 2,
+                 'graph_head': 2, 'graph_tail': 2, 'graph_triple_label': 2, 'vocab_map': 2, 'vocab_ids': 2}
+
+def save_tensor_store(items, save_path, total=None):
+    """
+    Writes the deterministic tensors of every item as flat int32 columns with offsets tables, laid out
+    like a token store. Values are appended to raw files as items come in, so only the offsets are
+    kept in memory, and are turned into .npy files at the end.
+    """
+    if not os.path.exists(save_path):
+        os.makedirs(save_path)
+    files = {field: open(os.path.join(save_path, field + '.bin'), 'wb') for field in tensor_fields}
+    sizes = {field: 0 for field in tensor_fields}
+    offsets = {field: [[0] for _ in range(depth)] for field, depth in tensor_fields.items()}
+    try:
+        for item in tqdm(items, total=total):
+            for field, depth in tensor_fields.items():
+                sequences = [item[field]] if depth == 1 else item[field]
+                for seq in sequences:
+                    values = seq.numpy().astype(np.int32)
+                    files[field].write(values.tobytes())
+                    sizes[field] += len(values)
+                    offsets[field][depth - 1].append(sizes[field])
+                if depth == 2:
+                    offsets[field][0].append(len(offsets[field][1]) - 1)
+    finally:
+        for f in files.values():
+            f.close()
+
+    for field, depth in tensor_fields.items():
+        raw_path = os.path.join(save_path, field + '.bin')
+        column = np.lib.format.open_memmap(os.path.join(save_path, field + '.npy'), mode='w+', dtype=np.int32,
+                                           shape=(sizes[field],))
+        if sizes[field]:
+            column[:] = np.memmap(raw_path, dtype=np.int32, mode='r')
+        column.flush()
+        del column
+        os.remove(raw_path)
+        for level, values in enumerate(offsets[field]):
+            np.save(os.path.join(save_path, '{}_offsets_{}.npy'.format(field, level)), np.array(values, dtype=np.int64))
+
+class TensorStore(MappedStore):
+    """
+    Items materialised by save_tensor_store. store[i] returns the tensor fields of item i as fresh
+    LongTensors, in the nesting Dataset builds them with.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.columns = {}
+        for field, depth in tensor_fields.items():
+            values = np.load(os.path.join(path, field + '.npy'), mmap_mode='r')
+            offsets = [np.load(os.path.join(path, '{}_offsets_{}.npy'.format(field, level)), mmap_mode='r')
+                       for level in range(depth)]
+            self.columns[field] = RaggedColumn(values, offsets)
+
+    def __len__(self):
+        return len(self.columns['target'])
+
+    def __getitem__(self, index):
+        item = {}
+        for field, depth in tensor_fields.items():
+            value = self.columns[field][index]
+            if depth == 1:
+                item[field] = torch.from_numpy(value.astype(np.int64))
+            else:
+                item[field] = [torch.from_numpy(seq.astype(np.int64)) for seq in value]
+        return item
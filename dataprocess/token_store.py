@@ -0,0 +1,104 @@
+import os
+import json
+import numpy as np
+from dataprocess.triple_store import GraphStore
+from dataprocess.mapped_store import MappedStore
+
+# >>>>>>>>>> token field -> nesting depth (example > [turn >] sentence > token) >>>>>>>>>> #
+token_fields = {'situation': 2, 'dialog': 3, 'target': 2, 'usercause': 2}
+
+def save_token_store(data, vocab, save_path):
+    """
+    Writes one split as flat int32 token-id columns with one int64 offsets table per nesting level,
+    plus meta.json holding the small per-example fields and the location of the split's graph store.
+    Words are encoded with the FrozenLang `vocab`, unknown ones as UNK.
+    """
+    if not os.path.exists(save_path):
+        os.makedirs(save_path)
+    for field, depth in token_fields.items():
+        words, offsets = [], [[0] for _ in range(depth)]
+
+        def walk(node, level):
+            if level == depth - 1:
+                words.extend(node)
+                offsets[level].append(len(words))
+            else:
+                for child in node:
+                    walk(child, level + 1)
+                offsets[level].append(len(offsets[level + 1]) - 1)
+
+        for example in data[field]:
+            walk(example, 0)
+        np.save(os.path.join(save_path, field + '.npy'), vocab.lookup(words).astype(np.int32))
+        for level, values in enumerate(offsets):
+            np.save(os.path.join(save_path, '{}_offsets_{}.npy'.format(field, level)), np.array(values, dtype=np.int64))
+
+    meta = {key: value for key, value in data.items() if key not in token_fields and key != 'graphs'}
+    meta['graphs'] = data['graphs'].path
+    with open(os.path.join(save_path, 'meta.json'), 'w') as f:
+        json.dump(meta, f, default=lambda o: o.tolist())
+
+class RaggedColumn:
+    """
+    One memory-mapped token field. column[i] returns example i nested as in the JSON-era lists, with
+    int32 array slices for sentences; column.span(i) returns all of its tokens as one slice.
+    """
+
+    def __init__(self, tokens, offsets):
+        self.tokens = tokens
+        self.offsets = offsets
+
+    def __len__(self):
+        return len(self.offsets[0]) - 1
+
+    def __getitem__(self, index):
+        return self.children(0, index)
+
+    def children(self, level, index):
+        begin, end = self.offsets[level][index], self.offsets[level][index + 1]
+        if level == len(self.offsets) - 1:
+            return self.tokens[begin:end]
+        return [self.children(level + 1, i) for i in range(begin, end)]
+
+    def span_bounds(self):
+        """Token offsets of every example, span(i) being tokens[bounds[i]:bounds[i + 1]]."""
+        bounds = np.arange(len(self) + 1)
+        for offsets in self.offsets:
+            bounds = offsets[bounds]
+        return bounds
+
+    def span_lengths(self):
+        """Number of tokens of every example, the lengths of span(i) for all i at once."""
+        return np.diff(self.span_bounds())
+
+    def span(self, index):
+        begin, end = index, index + 1
+        for offsets in self.offsets:
+            begin, end = offsets[begin], offsets[end]
+        return self.tokens[begin:end]
+
+class TokenStore(MappedStore):
+    """
+    A split written by save_token_store. store[key] returns a RaggedColumn for token fields, the
+    GraphStore for 'graphs' and the loaded metadata for everything else.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.columns = {}
+        for field, depth in token_fields.items():
+            tokens = np.load(os.path.join(path, field + '.npy'), mmap_mode='r')
+            offsets = [np.load(os.path.join(path, '{}_offsets_{}.npy'.format(field, level)), mmap_mode='r')
+                       for level in range(depth)]
+            self.columns[field] = RaggedColumn(tokens, offsets)
+        with open(os.path.join(path, 'meta.json'), 'r') as f:
+            self.meta = json.load(f)
+        self.columns['graphs'] = GraphStore(self.meta.pop('graphs'))
+
+    def __len__(self):
+        return len(self.columns['target'])
+
+    def __getitem__(self, key):
+        if key in self.columns:
+            return self.columns[key]
+        return self.meta[key]
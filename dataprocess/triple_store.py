@@ -1,143 +1,280 @@
+import os
 import json
+import time
+import shutil
+import config
+import multiprocessing
+import numpy as np
 from tqdm import tqdm
+from dataprocess.mapped_store import MappedStore
 
-def read_json(filename):
-    data = []
-    with open(filename, 'r') as f:
-        for line in f.readlines():
-            data.append(json.loads(line))
-    return data
-
-def directed_triple(data_path, save_path, max_concepts=400, max_triple=1000):
-    # read data from data_path
-    data = read_json(data_path)
-
-    _data = []
-    max_len = 0
-    max_neighbors = 5
-    for e in tqdm(data):
-        triple_dict = {}
-        triples = e['triples']
-        concepts = e['concepts']
-        labels = e['labels']
-        distances = e['distances']
-        for t in triples:
-            head, tail = t[0], t[-1]
-            head_id = concepts.index(head)
-            tail_id = concepts.index(tail)
-            if distances[head_id] <= distances[tail_id]:
-                if t[-1] not in triple_dict:
-                    triple_dict[t[-1]] = [t]
-                else:
-                    if len(triple_dict[t[-1]]) < max_neighbors:
-                        triple_dict[t[-1]].append(t)
-
-        results = []
-        for l, c in zip(labels, concepts):
-            if l == 1:
-                results.append(c)
-        # print(results)
-
-        causes = []
-        for d, c in zip(distances, concepts):
-            if d == 0:
-                causes.append(c)
-
-        shortest_paths = []
-        for result in results:
-            shortest_paths.extend(bfs(result, triple_dict, causes))
-
-        ground_truth_concepts = []
-        ground_truth_triples = []
-        for path in shortest_paths:
-            for i, n in enumerate(path[:-1]):
-                ground_truth_triples.append((n, path[i + 1]))
-                ground_truth_concepts.append(n)
-                ground_truth_concepts.append(path[i + 1])
-        ground_truth_concepts = list(set(ground_truth_concepts))
-
-        ground_truth_triples_set = set(ground_truth_triples)
-
-        _triples, triple_labels = [], []
-        for e1, e2 in ground_truth_triples_set:
-            for t in triple_dict[e1]:
-                if e2 in t:
-                    _triples.append(t)
-                    triple_labels.append(1)
-
-        for k, v in triple_dict.items():
-            for t in v:
-                if t in _triples:
-                    continue
+# >>>>>>>>>> column name -> offsets that slice it per graph >>>>>>>>>> #
+graph_columns = {'concepts': 'concept_offsets', 'distances': 'concept_offsets', 'labels': 'concept_offsets',
+                 'relations': 'triple_offsets', 'head_ids': 'triple_offsets', 'tail_ids': 'triple_offsets',
+                 'triple_labels': 'label_offsets'}
+
+def directed_triple(data_path, save_path, max_concepts=400, max_triple=1000, workers=1):
+    """
+    Builds the graph store of one split. The path file is cut into byte ranges of about
+    config.triple_shard_bytes on line boundaries; every shard is turned into its own store by a worker
+    and the shard stores are then concatenated in order, so no process ever holds more than one
+    shard of examples.
+    """
+    shard_dir = save_path.rstrip('/') + '.shards/'
+    if not os.path.exists(shard_dir):
+        os.makedirs(shard_dir)
+    ranges = shard_ranges(data_path, config.triple_shard_bytes)
+    tasks = [(data_path, begin, end, shard_dir + '{}/'.format(i), max_concepts, max_triple)
+             for i, (begin, end) in enumerate(ranges)]
+
+    start = time.time()
+    if workers > 1:
+        pool = multiprocessing.get_context('fork').Pool(workers)
+        outputs = pool.imap(build_shard, tasks)
+    else:
+        pool = None
+        outputs = map(build_shard, tasks)
+    try:
+        shard_paths = list(tqdm(outputs, total=len(tasks)))
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    print('built {} shards of {} in {:.1f}s with {} workers'.format(len(tasks), data_path, time.time() - start, workers))
+
+    tmp_path = save_path.rstrip('/') + '.tmp/'
+    if os.path.exists(tmp_path):
+        shutil.rmtree(tmp_path)
+    merge_graph_stores(shard_paths, tmp_path)
+    # >>>>>>>>>> os.replace cannot overwrite a non-empty directory, so a store from an earlier run goes first >>>>>>>>>> #
+    if os.path.exists(save_path):
+        shutil.rmtree(save_path)
+    os.replace(tmp_path, save_path.rstrip('/'))
+    shutil.rmtree(shard_dir)
+    return GraphStore(save_path)
+
+def shard_ranges(data_path, shard_bytes):
+    """[begin, end) byte ranges of about shard_bytes each, moved forward to the next line start."""
+    size = os.path.getsize(data_path)
+    bounds = [0]
+    with open(data_path, 'rb') as f:
+        while bounds[-1] < size:
+            f.seek(bounds[-1] + shard_bytes)
+            f.readline()
+            bounds.append(min(f.tell(), size))
+    return list(zip(bounds[:-1], bounds[1:]))
+
+def build_shard(task):
+    """Runs build_triples over the examples in one byte range and saves them as a graph store."""
+    data_path, begin, end, shard_path, max_concepts, max_triple = task
+    with open(data_path, 'rb') as f:
+        f.seek(begin)
+        lines = f.read(end - begin).splitlines()
+    save_graph_store((build_triples(json.loads(line), max_concepts, max_triple) for line in lines if line.strip()),
+                     shard_path)
+    return shard_path
+
+def save_graph_store(graphs, save_path):
+    """
+    Writes graphs as flat int32 columns plus per-graph offsets, one .npy file each. Concepts are stored
+    as ids into concept_table.json and only the first relation of every triple is kept, which is
+    all the Dataset reads.
+    """
+    concept2id = {}
+    columns = {name: [] for name in graph_columns}
+    lengths = {'concept_offsets': [], 'triple_offsets': [], 'label_offsets': []}
+    for g in graphs:
+        columns['concepts'].extend([concept2id.setdefault(c, len(concept2id)) for c in g['concepts']])
+        columns['distances'].extend(g['distances'])
+        columns['labels'].extend(g['labels'])
+        columns['relations'].extend([r[0] for r in g['relations']])
+        columns['head_ids'].extend(g['head_ids'])
+        columns['tail_ids'].extend(g['tail_ids'])
+        columns['triple_labels'].extend(g['triple_labels'])
+        lengths['concept_offsets'].append(len(g['concepts']))
+        lengths['triple_offsets'].append(len(g['head_ids']))
+        lengths['label_offsets'].append(len(g['triple_labels']))
+
+    if not os.path.exists(save_path):
+        os.makedirs(save_path)
+    for name, values in columns.items():
+        np.save(os.path.join(save_path, name + '.npy'), np.array(values, dtype=np.int32))
+    for name, values in lengths.items():
+        offsets = np.zeros(len(values) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum(values)
+        np.save(os.path.join(save_path, name + '.npy'), offsets)
+    with open(os.path.join(save_path, 'concept_table.json'), 'w') as f:
+        json.dump(list(concept2id), f)
+
+def merge_graph_stores(shard_paths, save_path):
+    """
+    Concatenates graph stores in order into save_path. Concept ids are remapped onto one merged
+    concept table and the columns are copied shard by shard into preallocated .npy memmaps.
+    """
+    shards = [GraphStore(path) for path in shard_paths]
+    concept2id, remaps = {}, []
+    for shard in shards:
+        remaps.append(np.array([concept2id.setdefault(c, len(concept2id)) for c in shard.concepts], dtype=np.int32))
+
+    if not os.path.exists(save_path):
+        os.makedirs(save_path)
+    for name in set(graph_columns):
+        column = np.lib.format.open_memmap(os.path.join(save_path, name + '.npy'), mode='w+', dtype=np.int32,
+                                           shape=(sum(len(shard.columns[name]) for shard in shards),))
+        pos = 0
+        for shard, remap in zip(shards, remaps):
+            values = shard.columns[name]
+            column[pos:pos + len(values)] = remap[values] if name == 'concepts' else values
+            pos += len(values)
+        column.flush()
+        del column
+    for name in set(graph_columns.values()):
+        offsets, total = [np.zeros(1, dtype=np.int64)], 0
+        for shard in shards:
+            offsets.append(shard.columns[name][1:] + total)
+            total += shard.columns[name][-1]
+        np.save(os.path.join(save_path, name + '.npy'), np.concatenate(offsets))
+    with open(os.path.join(save_path, 'concept_table.json'), 'w') as f:
+        json.dump(list(concept2id), f)
+
+class GraphStore(MappedStore):
+    """
+    Memory-mapped graphs written by save_graph_store. store[i] returns graph i as a dict of array
+    slices with the keys of the JSON format, without copying or parsing anything.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        names = set(graph_columns) | set(graph_columns.values())
+        self.columns = {name: np.load(os.path.join(path, name + '.npy'), mmap_mode='r') for name in names}
+        with open(os.path.join(path, 'concept_table.json'), 'r') as f:
+            self.concepts = json.load(f)
+
+    def __len__(self):
+        return len(self.columns['concept_offsets']) - 1
+
+    def __getitem__(self, index):
+        graph = {}
+        for name, offset_name in graph_columns.items():
+            offsets = self.columns[offset_name]
+            graph[name] = self.columns[name][offsets[index]:offsets[index + 1]]
+        return graph
+
+def build_triples(e, max_concepts=400, max_triple=1000, max_neighbors=5):
+    """
+    Turns one path-finding example into head_ids/tail_ids/relations/triple_labels, in place.
+    Concepts, emitted triples and incoming triples per tail are all hash-indexed, so the cost
+    is linear in the number of triples.
+    """
+    triple_dict = {}  # tail -> incoming triples
+    triples = e['triples']
+    concepts = e['concepts']
+    labels = e['labels']
+    distances = e['distances']
+    concept2id = {}
+    for i, c in enumerate(concepts):
+        concept2id.setdefault(c, i)
+    for t in triples:
+        head, tail = t[0], t[-1]
+        head_id = concept2id[head]
+        tail_id = concept2id[tail]
+        if distances[head_id] <= distances[tail_id]:
+            if t[-1] not in triple_dict:
+                triple_dict[t[-1]] = [t]
+            else:
+                if len(triple_dict[t[-1]]) < max_neighbors:
+                    triple_dict[t[-1]].append(t)
+
+    results = []
+    for l, c in zip(labels, concepts):
+        if l == 1:
+            results.append(c)
+
+    causes = set()
+    for d, c in zip(distances, concepts):
+        if d == 0:
+            causes.add(c)
+
+    ground_truth_triples = shortest_path_edges(triple_dict, concept2id, results, causes)
+    ground_truth_concepts = list(dict.fromkeys(c for edge in ground_truth_triples for c in edge))
+
+    def triple_key(t):
+        return t[0], tuple(t[1]), t[-1]
+
+    _triples, triple_labels, emitted = [], [], set()
+    for e1, e2 in ground_truth_triples:
+        for t in triple_dict[e1]:
+            if e2 in t:
                 _triples.append(t)
-                # if (t[-1], t[0]) in ground_truth_triples_set:
-                #     triple_labels.append(1)
-                # else:
-                triple_labels.append(0)
-
-        if len(concepts) > max_concepts:
-            rest_concepts = list(set(concepts) - set(ground_truth_concepts))
-            rest_len = max_concepts-len(ground_truth_concepts)
-            _concepts = ground_truth_concepts + rest_concepts[:rest_len]
-            e['concepts'] = _concepts
-            e['distances'] = [distances[concepts.index(c)] for c in _concepts]
-            e['labels'] = [distances[labels.index(c)] for c in _concepts]
-            concepts = _concepts
-        # _triples = _triples[:max_triples]
-        # triple_labels = triple_labels[:max_triples]
-
-        heads = []
-        tails = []
-        relations = []
-        for triple in _triples:
-            try:
-                h = concepts.index(triple[0])
-                t = concepts.index(triple[-1])
-                heads.append(h)
-                tails.append(t)
-                relations.append(triple[1])
-                if len(heads) == max_triple:
-                    break
-            except ValueError:
+                triple_labels.append(1)
+                emitted.add(triple_key(t))
+
+    for k, v in triple_dict.items():
+        for t in v:
+            if triple_key(t) in emitted:
                 continue
+            _triples.append(t)
+            emitted.add(triple_key(t))
+            triple_labels.append(0)
+
+    if len(concepts) > max_concepts:
+        rest_concepts = list(set(concepts) - set(ground_truth_concepts))
+        rest_len = max_concepts-len(ground_truth_concepts)
+        _concepts = ground_truth_concepts + rest_concepts[:rest_len]
+        e['concepts'] = _concepts
+        e['distances'] = [distances[concept2id[c]] for c in _concepts]
+        e['labels'] = [labels[concept2id[c]] for c in _concepts]
+        concepts = _concepts
+        concept2id = {c: i for i, c in enumerate(concepts)}
 
-        max_len = max(max_len, len(_triples))
-        e['relations'] = relations
-        e['head_ids'] = heads
-        e['tail_ids'] = tails
-        e['triple_labels'] = triple_labels[:max_triple]
-        e.pop('triples')
-
-        _data.append(e)
-        # break
-
-    with open(save_path, 'w') as f:
-        for line in data:
-            json.dump(line, f)
-            f.write('\n')
-
-    return _data
-
-def bfs(start, triple_dict, source):
-    paths = [[[start]]]
-    shortest_paths = []
-    count = 0
-    while True:
-        last_paths = paths[-1]
-        new_paths = []
-        for path in last_paths:
-            if triple_dict.get(path[-1], False):
-                triples = triple_dict[path[-1]]
-                for triple in triples:
-                    new_paths.append(path + [triple[0]])
-
-        for path in new_paths:
-            if path[-1] in source:
-                shortest_paths.append(path)
-
-        if count == 2:
+    heads = []
+    tails = []
+    relations = []
+    for triple in _triples:
+        if triple[0] not in concept2id or triple[-1] not in concept2id:
+            continue
+        heads.append(concept2id[triple[0]])
+        tails.append(concept2id[triple[-1]])
+        relations.append(triple[1])
+        if len(heads) == max_triple:
             break
-        paths.append(new_paths)
-        count += 1
 
-    return shortest_paths
\ No newline at end of file
+    e['relations'] = relations
+    e['head_ids'] = heads
+    e['tail_ids'] = tails
+    e['triple_labels'] = triple_labels[:max_triple]
+    e.pop('triples')
+
+    return e
+
+def shortest_path_edges(triple_dict, concept2id, results, causes, max_hops=3):
+    """
+    (tail, head) pairs lying on some walk of at most max_hops incoming triples from a result concept
+    back to a cause, in triple_dict order. Instead of enumerating the walks, boolean frontiers are
+    propagated forward from the results and backward from the causes over the edge arrays, so the
+    cost is O(max_hops * triples) whatever max_neighbors is.
+    """
+    edges = [(tail, t[0]) for tail, incoming in triple_dict.items() for t in incoming]
+    if not edges:
+        return []
+    tails, heads = np.array([[concept2id[tail], concept2id[head]] for tail, head in edges]).T
+    n = max(concept2id.values()) + 1
+
+    # >>>>>>>>>> forward[i]: reached from a result in exactly i steps >>>>>>>>>> #
+    forward = [np.zeros(n, dtype=bool)]
+    forward[0][[concept2id[c] for c in results]] = True
+    # >>>>>>>>>> backward[j]: reaches a cause in at most j steps >>>>>>>>>> #
+    backward = [np.zeros(n, dtype=bool)]
+    backward[0][[concept2id[c] for c in causes]] = True
+    for _ in range(max_hops - 1):
+        step = np.zeros(n, dtype=bool)
+        step[heads[forward[-1][tails]]] = True
+        forward.append(step)
+        step = backward[-1].copy()
+        step[tails[backward[-1][heads]]] = True
+        backward.append(step)
+
+    on_path = np.zeros(len(edges), dtype=bool)
+    for i, reached in enumerate(forward):
+        on_path |= reached[tails] & backward[max_hops - 1 - i][heads]
+    return list(dict.fromkeys(edge for edge, keep in zip(edges, on_path) if keep))
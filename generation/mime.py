@@ -777,22 +777,13 @@ class MIME(nn.Module):
             filtered_logit = top_k_top_p_filtering(logit[:, -1], top_k=3, top_p=0, filter_value=-float('Inf'))
             # Sample from the filtered distribution
             next_word = torch.multinomial(F.softmax(filtered_logit, dim=-1), 1).squeeze()
-            decoded_words.append(['<EOS>' if ni.item() == config.EOS_idx else self.vocab.index2word[ni.item()] for ni in
-                                  next_word.view(-1)])
+            decoded_words.append(next_word.view(-1))
             next_word = next_word.data.item()
             ys = torch.cat([ys, torch.ones(1, 1).long().fill_(next_word).to(self.device)], dim=1).to(self.device)
             mask_trg = ys.data.eq(config.PAD_idx).unsqueeze(1)
 
-        sent = []
-        for _, row in enumerate(np.transpose(decoded_words)):
-            st = ''
-            for e in row:
-                if e == '<EOS>':
-                    break
-                else:
-                    st += e + ' '
-            sent.append(st)
-        return sent
+        decoded_words = self.vocab.decode(torch.stack(decoded_words, dim=1).cpu().numpy())
+        return [''.join(w + ' ' for w in words) for words in decoded_words]
 
 
     def decoder_topk(self, batch, max_dec_step=30, emotion_classifier='built_in'):
@@ -843,24 +834,15 @@ class MIME(nn.Module):
             filtered_logit = top_k_top_p_filtering(logit[:, -1], top_k=3, top_p=0, filter_value=-float('Inf'))
             # Sample from the filtered distribution
             next_word = torch.multinomial(F.softmax(filtered_logit, dim=-1), 1).squeeze()
-            decoded_words.append(['<EOS>' if ni.item() == config.EOS_idx else self.vocab.index2word[ni.item()] for ni in
-                                  next_word.view(-1)])
+            decoded_words.append(next_word.view(-1))
             next_word = next_word.data.item()
 
             ys = torch.cat([ys, torch.ones(1, 1).long().fill_(next_word).to(self.device)], dim=1).to(self.device)
 
             mask_trg = ys.data.eq(config.PAD_idx).unsqueeze(1)
 
-        sent = []
-        for _, row in enumerate(np.transpose(decoded_words)):
-            st = ''
-            for e in row:
-                if e == '<EOS>':
-                    break
-                else:
-                    st += e + ' '
-            sent.append(st)
-        return sent
+        decoded_words = self.vocab.decode(torch.stack(decoded_words, dim=1).cpu().numpy())
+        return [''.join(w + ' ' for w in words) for words in decoded_words]
 
 class ACT_basic(nn.Module):
     """
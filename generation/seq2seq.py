@@ -239,23 +239,14 @@ class S2S(nn.Module):
 
             prob = self.generator(out)
             _, next_word = torch.max(prob[:, -1], dim=1)
-            decoded_words.append(['<EOS>' if ni.item() == config.EOS_idx else self.vocab.index2word[ni.item()] for ni in
-                                  next_word.view(-1)])
+            decoded_words.append(next_word.view(-1))
             next_word = next_word.data[0]
 
             ys = torch.cat([ys, torch.ones(1, 1).long().fill_(next_word).to(config.device)], dim=1).to(config.device)
             mask_trg = ys.data.eq(config.PAD_idx).unsqueeze(1)
 
-        sent = []
-        for _, row in enumerate(np.transpose(decoded_words)):
-            st = ''
-            for e in row:
-                if e == '<EOS>':
-                    break
-                else:
-                    st += e + ' '
-            sent.append(st)
-        return sent
+        decoded_words = self.vocab.decode(torch.stack(decoded_words, dim=1).cpu().numpy())
+        return [''.join(w + ' ' for w in words) for words in decoded_words]
 
 
 
@@ -6,7 +6,7 @@ import numpy as np
 import math
 from models.common_layer import EncoderLayer, DecoderLayer, LayerNorm , \
     _gen_bias_mask ,_gen_timing_signal, share_embedding, LabelSmoothing, NoamOpt, \
-    _get_attn_subsequent_mask,  get_input_from_batch, get_graph_from_batch, get_output_from_batch
+    _get_attn_subsequent_mask,  get_input_from_batch, get_graph_from_batch, get_output_from_batch, scatter_concept_probs
 import config
 import pprint
 pp = pprint.PrettyPrinter(indent=1)
@@ -324,7 +324,7 @@ class GLSTM(nn.Module):
 
         return triple_repr, None
 
-    def comp_pointer(self, hidden_state, concept_label, distance, head, tail, triple_repr, triple_label, vocab_map, map_mask):
+    def comp_pointer(self, hidden_state, concept_label, distance, head, tail, triple_repr, triple_label, vocab_map, vocab_ids):
         batch_size = hidden_state.size(0)
         concept_label = concept_label.reshape(-1, concept_label.size(2))
         distance = distance.reshape(-1, distance.size(2))
@@ -340,11 +340,8 @@ class GLSTM(nn.Module):
         cpt_probs = cpt_probs.reshape(batch_size, self.graph_num, -1, cpt_probs.size(-1)) # bsz x graph_num x L x mem
         # cpt_probs = cpt_probs.transpose(2, 1).reshape(batch_size, -1, graph_num * cpt_probs.size(-1))
         cpt_probs = F.log_softmax(cpt_probs, dim=-1)
-        cpt_probs_vocab = cpt_probs.gather(-1, vocab_map.unsqueeze(2).expand(cpt_probs.size(0),
-                        cpt_probs.size(1), cpt_probs.size(2), -1))
-        cpt_probs_vocab = torch.sum(cpt_probs_vocab, dim=1)
-        cpt_probs_vocab.masked_fill_((map_mask == 0).unsqueeze(1), 0)
-        # bsz x graph_num x L x vocab
+        cpt_probs_vocab = scatter_concept_probs(cpt_probs, vocab_map, vocab_ids, self.embedding.lut.num_embeddings)
+        # bsz x L x vocab
 
         gate = F.log_softmax(self.gate_linear(hidden_state), dim=-1)
         # gate = self.gate_linear(hidden_state)
@@ -468,10 +465,10 @@ class Wo_Encoder(nn.Module):
         if torch.sum(graph_num):
             pre_logit, attn_dist = self.decoder(dec_input, encoder_outputs, (mask_src, mask_trg))
             logit = self.generator(pre_logit)
-            concept_ids, concept_label, distance, relation, head, tail, triple_label, vocab_map, map_mask = graphs
+            concept_ids, concept_label, distance, relation, head, tail, triple_label, vocab_map, vocab_ids = graphs
             triple_repr, _ = self.glstm.comp_cause(concept_ids, relation, head, tail, triple_label)
             gate, cpt_probs_vocab = self.glstm.comp_pointer(pre_logit, concept_label, distance, head, tail, triple_repr,
-                                triple_label, vocab_map, map_mask)
+                                triple_label, vocab_map, vocab_ids)
             logit = logit * (1 - gate) + gate * cpt_probs_vocab
 
         else:
@@ -520,7 +517,7 @@ class Wo_Encoder(nn.Module):
                                        mask_src)
 
         if torch.sum(graph_num):
-            concept_ids, concept_label, distance, relation, head, tail, triple_label, vocab_map, map_mask = graphs
+            concept_ids, concept_label, distance, relation, head, tail, triple_label, vocab_map, vocab_ids = graphs
             triple_repr, _ = self.glstm.comp_cause(concept_ids, relation, head, tail, triple_label)
 
         ys = torch.ones(1, 1).fill_(config.SOS_idx).long().to(self.device)
@@ -532,30 +529,21 @@ class Wo_Encoder(nn.Module):
                 out, attn_dist = self.decoder(dec_input, encoder_outputs, (mask_src, mask_trg))
                 prob = self.generator(out)
                 gate, cpt_probs_vocab = self.glstm.comp_pointer(out, concept_label, distance, head, tail, triple_repr,
-                                                            triple_label, vocab_map, map_mask)
+                                                            triple_label, vocab_map, vocab_ids)
                 prob = prob * (1 - gate) + gate * cpt_probs_vocab
             else:
                 out, attn_dist = self.decoder(dec_input, encoder_outputs, (mask_src, mask_trg))
                 prob = self.generator(out)
             _, next_word = torch.max(prob[:, -1], dim=1)
-            decoded_words.append(['<EOS>' if ni.item() == config.EOS_idx else self.vocab.index2word[ni.item()] for ni in
-                                  next_word.view(-1)])
+            decoded_words.append(next_word.view(-1))
             next_word = next_word.data[0]
 
             ys = torch.cat([ys, torch.ones(1, 1).long().fill_(next_word).to(self.device)], dim=1).to(self.device)
 
             mask_trg = ys.data.eq(config.PAD_idx).unsqueeze(1)
 
-        sent = []
-        for _, row in enumerate(np.transpose(decoded_words)):
-            st = ''
-            for e in row:
-                if e == '<EOS>':
-                    break
-                else:
-                    st += e + ' '
-            sent.append(st)
-        return sent
+        decoded_words = self.vocab.decode(torch.stack(decoded_words, dim=1).cpu().numpy())
+        return [''.join(w + ' ' for w in words) for words in decoded_words]
 
 class ACT_basic(nn.Module):
     """
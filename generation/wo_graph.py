@@ -6,7 +6,7 @@ import numpy as np
 import math
 from models.common_layer import EncoderLayer, DecoderLayer, LayerNorm , \
     _gen_bias_mask ,_gen_timing_signal, share_embedding, LabelSmoothing, NoamOpt, \
-    _get_attn_subsequent_mask,  get_input_from_batch, get_output_from_batch, get_graph_from_batch
+    _get_attn_subsequent_mask,  get_input_from_batch, get_output_from_batch, get_graph_from_batch, scatter_concept_probs
 import config
 import pprint
 pp = pprint.PrettyPrinter(indent=1)
@@ -218,7 +218,7 @@ class LinearRefer(nn.Module):
         self.linear_in = nn.Linear(emb_dim, hidden_dim)
         self.gate_linear = nn.Linear(emb_dim, 1)
 
-    def forward(self, hidden_state, concept_ids, concept_label, vocab_map, map_mask):
+    def forward(self, hidden_state, concept_ids, concept_label, vocab_map, vocab_ids):
         batch_size = hidden_state.size(0)
         graph_num = concept_ids.size(1)
         cpt_repr = self.embedding(concept_ids)  # batch_size * graph * mem * emb_size
@@ -232,9 +232,7 @@ class LinearRefer(nn.Module):
         cpt_probs = cpt_probs.masked_fill_((concept_label == -1).unsqueeze(1), 0)
         cpt_probs = cpt_probs.reshape(batch_size, graph_num, -1, cpt_probs.size(-1))
         cpt_probs = F.log_softmax(cpt_probs, dim=-1)
-        cpt_probs_vocab = cpt_probs.gather(-1, vocab_map.unsqueeze(2).expand(cpt_probs.size(0), cpt_probs.size(1), cpt_probs.size(2), -1))
-        cpt_probs_vocab = torch.sum(cpt_probs_vocab, dim=1)
-        cpt_probs_vocab.masked_fill_((map_mask == 0).unsqueeze(1), 0)
+        cpt_probs_vocab = scatter_concept_probs(cpt_probs, vocab_map, vocab_ids, self.embedding.lut.num_embeddings)
         gate = F.log_softmax(self.gate_linear(hidden_state), dim=-1)
         return gate, cpt_probs_vocab
 
@@ -357,8 +355,8 @@ class Wo_Graph(nn.Module):
         logit = self.generator(pre_logit)
 
         if torch.sum(graph_num):
-            concept_ids, concept_label, _, _, _, _, _, vocab_map, map_mask = graphs
-            gate, cpt_probs_vocab = self.refer(pre_logit, concept_ids, concept_label, vocab_map, map_mask)
+            concept_ids, concept_label, _, _, _, _, _, vocab_map, vocab_ids = graphs
+            gate, cpt_probs_vocab = self.refer(pre_logit, concept_ids, concept_label, vocab_map, vocab_ids)
             logit = logit * (1 - gate) + gate * cpt_probs_vocab
 
         loss = self.criterion(logit.contiguous().view(-1, logit.size(-1)), dec_batch.contiguous().view(-1))
@@ -422,29 +420,20 @@ class Wo_Graph(nn.Module):
             prob = self.generator(out)
 
             if torch.sum(graph_num):
-                concept_ids, concept_label, _, _, _, _, _, vocab_map, map_mask = graphs
-                gate, cpt_probs_vocab = self.refer(out, concept_ids, concept_label, vocab_map, map_mask)
+                concept_ids, concept_label, _, _, _, _, _, vocab_map, vocab_ids = graphs
+                gate, cpt_probs_vocab = self.refer(out, concept_ids, concept_label, vocab_map, vocab_ids)
                 prob = prob * (1 - gate) + gate * cpt_probs_vocab
 
             _, next_word = torch.max(prob[:, -1], dim=1)
-            decoded_words.append(['<EOS>' if ni.item() == config.EOS_idx else self.vocab.index2word[ni.item()] for ni in
-                                  next_word.view(-1)])
+            decoded_words.append(next_word.view(-1))
             next_word = next_word.data[0]
 
             ys = torch.cat([ys, torch.ones(1, 1).long().fill_(next_word).to(config.device)], dim=1).to(config.device)
 
             mask_trg = ys.data.eq(config.PAD_idx).unsqueeze(1)
 
-        sent = []
-        for _, row in enumerate(np.transpose(decoded_words)):
-            st = ''
-            for e in row:
-                if e == '<EOS>':
-                    break
-                else:
-                    st += e + ' '
-            sent.append(st)
-        return sent
+        decoded_words = self.vocab.decode(torch.stack(decoded_words, dim=1).cpu().numpy())
+        return [''.join(w + ' ' for w in words) for words in decoded_words]
 
 class ACT_basic(nn.Module):
     """
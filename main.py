@@ -5,7 +5,7 @@ from torch.nn.init import xavier_uniform_
 from tqdm import tqdm
 import numpy as np
 from copy import deepcopy
-from models.common_layer import evaluate, count_parameters, make_infinite
+from models.common_layer import evaluate, count_parameters, make_infinite, Prefetcher
 from generation.trs import Transformer
 from generation.trs_multihop import MultiHopCause
 from generation.trs_cause_effect import CauseEffect
@@ -32,7 +32,8 @@ def find_model_path(save_path):
 
 def train_eval():
     data_loader_tra, data_loader_val, data_loader_tst, vocab, program_number = prepare_data_seq(
-        batch_size=config.bz)
+        batch_size=config.bz, num_workers=config.num_workers, pin_memory=config.pin_memory,
+        prefetch_factor=config.prefetch_factor, persistent_workers=config.persistent_workers)
 
     torch.manual_seed(0)
     torch.backends.cudnn.deterministic = True
@@ -85,29 +86,31 @@ def train_eval():
         best_ppl = model.current_loss
         patient = 0
         weights_best = deepcopy(model.state_dict())
-        data_iter = make_infinite(data_loader_tra)
-        model = model.train()
-        for n_iter in tqdm(range(50000)):
-            loss, ppl, bce, acc = model.train_one_batch(next(data_iter), n_iter)
-
-            if (n_iter + 1) % check_iter == 0:
-                model = model.eval()
-                loss_val, ppl_val, bce_val, acc_val, bleu_score_g, bleu_score_b, rouge_score_g, rouge_score_b = evaluate(model, data_loader_val,
-                                                                                           config.dataset, config.save_path, ty="valid", max_dec_step=50)
-                model = model.train()
-
-                if n_iter + init_iter < 2600:
-                    continue
-
-                if ppl_val <= best_ppl:
-                    best_ppl = ppl_val
-                    patient = 0
-                    model.save_model(best_ppl, n_iter+init_iter, 0, 0, bleu_score_g, bleu_score_b)
-                    weights_best = deepcopy(model.state_dict())
-                else:
-                    patient += 1
-                if patient > 2:
-                    break
+        with Prefetcher(make_infinite(data_loader_tra), config.prefetch_batches) as data_iter:
+            model = model.train()
+            for n_iter in tqdm(range(50000)):
+                loss, ppl, bce, acc = model.train_one_batch(next(data_iter), n_iter)
+
+                if (n_iter + 1) % check_iter == 0:
+                    data_iter.report()
+                    model = model.eval()
+                    loss_val, ppl_val, bce_val, acc_val, bleu_score_g, bleu_score_b, rouge_score_g, rouge_score_b = evaluate(model, data_loader_val,
+                                                                                               config.dataset, config.save_path, ty="valid", max_dec_step=50)
+                    model = model.train()
+                    data_iter.reset()
+
+                    if n_iter + init_iter < 2600:
+                        continue
+
+                    if ppl_val <= best_ppl:
+                        best_ppl = ppl_val
+                        patient = 0
+                        model.save_model(best_ppl, n_iter+init_iter, 0, 0, bleu_score_g, bleu_score_b)
+                        weights_best = deepcopy(model.state_dict())
+                    else:
+                        patient += 1
+                    if patient > 2:
+                        break
 
     except KeyboardInterrupt:
         print('-' * 89)
@@ -4,7 +4,10 @@ import torch.nn as nn
 import torch.nn.functional as F
 import math
 import os
+import time
+import queue
 import pickle
+import threading
 from utils.metric import moses_multi_bleu, rouge
 import config
 if config.model == 'multiexpert':
@@ -893,11 +896,31 @@ def get_graph_from_batch(batch):
     tail = batch["tails"]
     triple_label = batch["triple_label"]
     vocab_map = batch["vocab_map"].to('cuda')
-    map_mask = batch["map_mask"].to('cuda')
+    vocab_ids = batch["vocab_ids"].to('cuda')
     graph_num = torch.LongTensor(batch["graph_num"]).to('cuda')
     if relation.size(-1) == 0:
         graph_num = torch.LongTensor([0]).to('cuda')
-    return (concept_ids, concept_label, distance, relation, head, tail, triple_label, vocab_map, map_mask), graph_num
+    return (concept_ids, concept_label, distance, relation, head, tail, triple_label, vocab_map, vocab_ids), graph_num
+
+
+def scatter_concept_probs(cpt_probs, vocab_map, vocab_ids, vocab_size):
+    '''
+    Write concept log-probs only into the vocab slots that graph concepts are mapped to.
+    With one graph this is the dense vocab_map/map_mask pointer. With several, a word sums the
+    log-probs of the graphs holding it only; the dense map also added the position-0 log-prob of
+    every graph without it, since 0 stood for both "position 0" and "absent".
+    cpt_probs: bsz x graph_num x L x mem
+    vocab_map: bsz x graph_num x map_size, concept position of each mapped pair
+    vocab_ids: bsz x graph_num x map_size, vocab id of each mapped pair, -1 for padding
+    return: bsz x L x vocab_size
+    '''
+    batch_size, graph_num, dec_len = cpt_probs.size(0), cpt_probs.size(1), cpt_probs.size(2)
+    map_probs = cpt_probs.gather(-1, vocab_map.unsqueeze(2).expand(batch_size, graph_num, dec_len, -1))
+    map_probs = map_probs.masked_fill((vocab_ids == -1).unsqueeze(2), 0)
+    map_probs = map_probs.transpose(1, 2).reshape(batch_size, dec_len, -1) # bsz x L x (graph_num * map_size)
+    index = vocab_ids.clamp(min=0).reshape(batch_size, 1, -1).expand(-1, dec_len, -1)
+    cpt_probs_vocab = torch.zeros(batch_size, dec_len, vocab_size, dtype=cpt_probs.dtype, device=cpt_probs.device)
+    return cpt_probs_vocab.scatter_add_(-1, index, map_probs)
 
 
 def get_input_from_batch(batch):
@@ -960,6 +983,10 @@ def print_custum(emotion, dial, ref, hyp_g, hyp_b):
     print("----------------------------------------------------------------------")
 
 
+def decode_sentences(vocab, sentences):
+    """Token-id slices of the token store back to lists of words."""
+    return vocab.decode(sentences, stop_idx=None)
+
 def evaluate(model, data, dataset, save_path, ty='valid', max_dec_step=30, save=False):
     emotion_lst, batch_lst, ref, hyp_g, hyp_b = [], [], [], [], []
     if ty == "test":
@@ -979,20 +1006,22 @@ def evaluate(model, data, dataset, save_path, ty='valid', max_dec_step=30, save=
         if ty == "test":
             sent_g = model.decoder_greedy(batch, max_dec_step=max_dec_step)
             sent_b = t.beam_search(batch, max_dec_step=max_dec_step)
+            input_txt = [decode_sentences(model.vocab, sents) for sents in batch['input_txt']]
+            target_txt = [decode_sentences(model.vocab, sents) for sents in batch['target_txt']]
             for i, (greedy_sent, beam_sent) in enumerate(zip(sent_g, sent_b)):
                 emotion_lst.append(batch["program_txt"][i])
 
                 batch_lst.append([" ".join(s) for s in
-                                batch['input_txt'][i]] if dataset == "empathetic_dialogues" else " ".join(
-                                batch['input_txt'][i]))
-                rf = " ".join([ele for lis in batch["target_txt"][i] for ele in lis])
+                                input_txt[i]] if dataset == "empathetic_dialogues" else " ".join(
+                                input_txt[i]))
+                rf = " ".join([ele for lis in target_txt[i] for ele in lis])
                 hyp_g.append(greedy_sent)
                 hyp_b.append(beam_sent)
                 ref.append(rf)
                 print_custum(emotion=batch["program_txt"][i],
                              dial=[" ".join(s) for s in
-                                batch['input_txt'][i]] if dataset == "empathetic_dialogues" else " ".join(
-                                batch['input_txt'][i]),
+                                input_txt[i]] if dataset == "empathetic_dialogues" else " ".join(
+                                input_txt[i]),
                              ref=rf,
                              hyp_g=greedy_sent,
                              hyp_b=beam_sent)
@@ -1035,6 +1064,85 @@ def make_infinite(dataloader):
         for x in dataloader:
             yield x
 
+class Prefetcher:
+    """
+    Pulls batches from `batches` in a background thread into a queue bounded at `size`, so up to size
+    collated batches are ready when the training step asks for the next one. size 0 pulls them in the
+    caller. report() prints how long the steps since the last reset() waited for data, which tells
+    whether training is input-bound. close() stops the thread; use it as a context manager so that a
+    KeyboardInterrupt does not leave it blocked on a full queue.
+    """
+
+    def __init__(self, batches, size=4):
+        self.batches = batches
+        self.size = size
+        self.reset()
+        self.stop = threading.Event()
+        self.queue = queue.Queue(maxsize=size)
+        self.thread = None
+        if size > 0:
+            self.thread = threading.Thread(target=self.fill, name='prefetcher', daemon=True)
+            self.thread.start()
+
+    def fill(self):
+        try:
+            for batch in self.batches:
+                if not self.put((batch, None)):
+                    return
+        except Exception as e:
+            self.put((None, e))
+            return
+        self.put((None, StopIteration()))
+
+    def put(self, entry):
+        while not self.stop.is_set():
+            try:
+                self.queue.put(entry, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        start = time.perf_counter()
+        if self.thread is None:
+            batch = next(self.batches)
+        else:
+            batch, error = self.queue.get()
+            if error is not None:
+                self.close()
+                raise error
+        self.waited += time.perf_counter() - start
+        self.count += 1
+        return batch
+
+    def reset(self):
+        self.count, self.waited, self.started = 0, 0., time.perf_counter()
+
+    def report(self):
+        elapsed = time.perf_counter() - self.started
+        print('data wait: {:.1f}s of {:.1f}s over {} batches ({:.1%}), queue {}/{}'.format(
+            self.waited, elapsed, self.count, self.waited / max(elapsed, 1e-9), self.queue.qsize(), self.size))
+
+    def close(self):
+        self.stop.set()
+        if self.thread is not None:
+            while self.thread.is_alive():
+                try:
+                    self.queue.get_nowait()
+                except queue.Empty:
+                    pass
+                self.thread.join(timeout=0.1)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
 def top_k_top_p_filtering(logits, top_k=0, top_p=0, filter_value=-float('Inf')):
     """ Filter a distribution of logits using top-k and/or nucleus (top-p) filtering
         Args:
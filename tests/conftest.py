@@ -0,0 +1,7 @@
+import os
+import sys
+import tempfile
+
+# >>>>>>>>>> config parses the command line at import, so it gets its own data_dict instead of pytest's argv >>>>>>>>>> #
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.argv = [sys.argv[0], '--data_dict', tempfile.mkdtemp() + '/']
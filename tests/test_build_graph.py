@@ -0,0 +1,64 @@
+import numpy as np
+import pytest
+
+import config
+
+try:
+    from dataprocess import build_graph
+except (ImportError, LookupError) as e:
+    # >>>>>>>>>> build_graph needs networkx 2 for write_gpickle and the nltk stopwords corpus >>>>>>>>>> #
+    pytest.skip('build_graph unavailable: {}'.format(e), allow_module_level=True)
+import networkx as nx
+
+concepts = ['dog', 'cat', 'bark', 'pet', 'animal', 'people', 'food', 'run', 'house', 'tree']
+relations = ['RelatedTo', 'IsA', 'HasContext', 'AtLocation', 'UsedFor']
+
+
+def conceptnet_files(tmp_path, monkeypatch, rows=300, seed=0):
+    """A small ConceptNet CSV with self-loops, a stopword concept, HasContext edges and repeated pairs."""
+    rng = np.random.RandomState(seed)
+    (tmp_path / 'concept.txt').write_text(''.join(c + '\n' for c in concepts))
+    (tmp_path / 'relation.txt').write_text(''.join(r + '\n' for r in relations))
+    lines = ['start\tend\trel\tweight'] + ['{}\t{}\t{}\t{:.2f}'.format(
+        concepts[rng.randint(len(concepts))], concepts[rng.randint(len(concepts))],
+        relations[rng.randint(len(relations))], rng.uniform(0.1, 3)) for _ in range(rows)]
+    (tmp_path / 'conceptnet.csv').write_text('\n'.join(lines) + '\n')
+    monkeypatch.setattr(config, 'conceptnet', str(tmp_path / 'conceptnet.csv'))
+    monkeypatch.setattr(config, 'concept_vocab', str(tmp_path / 'concept.txt'))
+    monkeypatch.setattr(config, 'concept_rel', str(tmp_path / 'relation.txt'))
+    monkeypatch.setattr(config, 'conceptnet_csr', str(tmp_path / 'conceptnet_csr') + '/')
+
+
+def test_csr_store_matches_the_networkx_graph(tmp_path, monkeypatch):
+    conceptnet_files(tmp_path, monkeypatch)
+    saved = []
+    monkeypatch.setattr(build_graph, 'write_gpickle', lambda graph, path: saved.append(graph))
+    build_graph.save_net()
+    build_graph.save_csr()
+    net, csr = saved[0], build_graph.CSRGraph.load(config.conceptnet_csr, mmap_mode='r')
+
+    assert build_graph.CSRGraph.is_current(config.conceptnet_csr, build_graph.csr_sources())
+    assert concepts.index('people') not in csr
+    assert list(net.nodes) == csr.nodes.tolist()
+    for u in net:
+        assert list(net[u]) == csr[u]
+        start, end = csr.offsets[u], csr.offsets[u + 1]
+        edges = zip(csr.neighbors[start:end].tolist(), csr.rels[start:end].tolist(), csr.weights[start:end].tolist())
+        assert sorted((v, r, round(w, 4)) for v, r, w in edges) == \
+               sorted((v, d['rel'], round(d['weight'], 4)) for v in net[u] for d in net[u][v].values())
+        for v in net[u]:
+            assert sorted(csr.edge_relations(u, v)) == sorted({d['rel'] for d in net[u][v].values()})
+
+    # >>>>>>>>>> cpnet_simple as find_path.load_cpnet builds it from the MultiDiGraph >>>>>>>>>> #
+    simple = nx.Graph()
+    for u, v, data in net.edges(data=True):
+        if simple.has_edge(u, v):
+            simple[u][v]['weight'] += data['weight']
+        else:
+            simple.add_edge(u, v, weight=data['weight'])
+    simple_csr = build_graph.SimpleCSRGraph.from_csr(csr)
+    for u in simple:
+        assert list(simple[u]) == simple_csr[u]
+        for v in simple[u]:
+            assert simple_csr.weight(u, v) == pytest.approx(simple[u][v]['weight'], rel=1e-5)
+            assert simple_csr.edge_relations(u, v) == sorted({d['rel'] for d in net[u][v].values()})
@@ -0,0 +1,45 @@
+import itertools
+import time
+
+import pytest
+
+from models.common_layer import Prefetcher
+
+
+@pytest.mark.parametrize('size', [0, 1, 4])
+def test_prefetcher_keeps_order(size):
+    with Prefetcher(iter(range(50)), size) as batches:
+        assert list(batches) == list(range(50))
+        assert batches.count == 50
+
+
+def test_prefetcher_raises_producer_errors_in_the_consumer():
+    def failing():
+        yield 0
+        yield 1
+        raise RuntimeError('broken batch')
+
+    batches = Prefetcher(failing(), 4)
+    assert [next(batches), next(batches)] == [0, 1]
+    with pytest.raises(RuntimeError, match='broken batch'):
+        next(batches)
+    assert not batches.thread.is_alive()
+
+
+def test_prefetcher_close_unblocks_a_full_queue():
+    batches = Prefetcher(itertools.count(), 2)
+    deadline = time.time() + 5
+    while not batches.queue.full() and time.time() < deadline:
+        time.sleep(0.01)
+    assert batches.queue.full()
+
+    batches.close()
+    assert not batches.thread.is_alive()
+
+
+def test_prefetcher_context_manager_stops_the_thread_on_interrupt():
+    with pytest.raises(KeyboardInterrupt):
+        with Prefetcher(itertools.count(), 2) as batches:
+            next(batches)
+            raise KeyboardInterrupt
+    assert not batches.thread.is_alive()
@@ -0,0 +1,245 @@
+import pickle
+
+import numpy as np
+import pytest
+import torch
+
+import config
+from dataprocess.data_loader import Dataset, DeviceLoader, scatter_rows, pad_sequences, pad_nested, collate_fn, \
+    device_keys, BucketBatchSampler, TokenBudgetBatchSampler
+from dataprocess.data_reader import Lang, FrozenLang, save_vocab
+from dataprocess.token_store import TokenStore, save_token_store
+from dataprocess.tensor_store import TensorStore, save_tensor_store
+from dataprocess.triple_store import GraphStore, save_graph_store
+from models.common_layer import scatter_concept_probs
+from benchmark import preprocess_graph_scan, json_graph
+
+
+class SizedDataset:
+    """Stands in for Dataset where a sampler only reads example_sizes."""
+
+    def __init__(self, n, seed=0):
+        rng = np.random.RandomState(seed)
+        graph_nums, max_triples = rng.randint(0, 5, n), rng.randint(0, 300, n)
+        self.sizes = rng.randint(5, 200, n), graph_nums, max_triples, graph_nums * max_triples
+
+    def __len__(self):
+        return len(self.sizes[0])
+
+    def example_sizes(self):
+        return self.sizes
+
+
+def compiled_split(path, fake_same_act, graph_num=2, seed=0):
+    """A small split laid out as compile_dataset writes it, one example per fake_same_act entry."""
+    rng = np.random.RandomState(seed)
+    words = ['i', 'am', 'so', 'sad', 'today', 'why', 'what', 'happened', 'my', 'dog', 'ran', 'away']
+    vocab = Lang({config.UNK_idx: "UNK", config.PAD_idx: "PAD", config.EOS_idx: "EOS", config.SOS_idx: "SOS",
+                  config.USR_idx: "USR", config.SYS_idx: "SYS", config.SIT_idx: "SIT", config.CLS_idx: "CLS",
+                  config.SEP_idx: "SEP"})
+    vocab.index_words(words)
+    save_vocab(vocab, path + 'vocab/')
+
+    n = len(fake_same_act)
+    graphs = []
+    for g in range(n + graph_num - 1):
+        concepts = ['dog', 'walk', 'sad', 'dog', 'away'][:2 + g % 4]
+        k = len(concepts)
+        graphs.append({'concepts': concepts, 'distances': list(range(k)), 'labels': [g % 2] * k,
+                       'relations': [[r] for r in range(k - 1)], 'head_ids': list(range(k - 1)),
+                       'tail_ids': list(range(1, k)), 'triple_labels': [1] * (k - 1)})
+    save_graph_store(graphs, path + 'graphs/')
+
+    def sentence():
+        return [str(w) for w in rng.choice(words + ['unseen'], rng.randint(1, 6))]
+
+    data = {'situation': [[sentence()] for _ in range(n)],
+            'dialog': [[[sentence()], [sentence(), sentence()]] for _ in range(n)],
+            'target': [[sentence()] for _ in range(n)],
+            'usercause': [[sentence(), []] for _ in range(n)],
+            'usercause_label': [[[1, 0, 2, 0], [0, 0, 0, 1]] for _ in range(n)],
+            'emotion': ['sad'] * n, 'act_label': [['questioning']] * n, 'fake_same_act': fake_same_act,
+            'graphidx': {str(i): list(range(i, i + graph_num)) for i in range(n)}, 'graphs': GraphStore(path + 'graphs/')}
+    save_token_store(data, FrozenLang(path + 'vocab/'), path + 'train/')
+    return TokenStore(path + 'train/'), FrozenLang(path + 'vocab/')
+
+
+def assert_same_item(a, b):
+    """Compares items down through nested lists of tensors and token-store slices."""
+    if isinstance(a, dict):
+        assert a.keys() == b.keys()
+        for key in a:
+            assert_same_item(a[key], b[key])
+    elif isinstance(a, list):
+        assert len(a) == len(b)
+        for x, y in zip(a, b):
+            assert_same_item(x, y)
+    elif torch.is_tensor(a):
+        assert torch.equal(a, b)
+    else:
+        assert np.array_equal(a, b)
+
+
+def random_sequences(generator, n, max_len):
+    return [torch.randint(2, 100, (int(torch.randint(1, max_len + 1, (1,), generator=generator)),),
+                          generator=generator) for _ in range(n)]
+
+
+def test_pad_sequences_matches_loop():
+    generator = torch.Generator().manual_seed(0)
+    sequences = random_sequences(generator, 17, 9)
+    padded, lengths = pad_sequences(sequences, pad=1)
+
+    expected = torch.ones(len(sequences), max(lengths), dtype=torch.long)
+    for i, seq in enumerate(sequences):
+        expected[i, :seq.size(0)] = seq
+    assert lengths == [seq.size(0) for seq in sequences]
+    assert torch.equal(padded, expected)
+
+
+def test_pad_nested_matches_loop():
+    generator = torch.Generator().manual_seed(1)
+    docs = [random_sequences(generator, n, 6) for n in [3, 1, 5, 2]]
+    padded, lengths = pad_nested(docs, pad=0)
+
+    max_docs, max_len = max(len(doc) for doc in docs), max(seq.size(0) for doc in docs for seq in doc)
+    expected = torch.zeros(len(docs), max_docs, max_len, dtype=torch.long)
+    for i, doc in enumerate(docs):
+        for j, seq in enumerate(doc):
+            expected[i, j, :seq.size(0)] = seq
+    assert lengths == [[seq.size(0) for seq in doc] + [0] * (max_docs - len(doc)) for doc in docs]
+    assert torch.equal(padded, expected)
+
+
+def test_scatter_rows_empty():
+    padded = scatter_rows([], [], torch.LongTensor([]), (2, 3), 1)
+    assert torch.equal(padded, torch.ones(2, 3, dtype=torch.long))
+
+
+@pytest.mark.parametrize('shuffle', [True, False])
+def test_bucket_sampler_covers_every_index_once(shuffle, capsys):
+    sampler = BucketBatchSampler(SizedDataset(503), 16, [48, 96], [500, 2000], shuffle=shuffle)
+    for _ in range(2):
+        batches = list(sampler)
+        assert capsys.readouterr().out == ''
+        assert len(batches) == len(sampler)
+        assert all(0 < len(batch) <= 16 for batch in batches)
+        assert sorted(index for batch in batches for index in batch) == list(range(503))
+
+
+@pytest.mark.parametrize('shuffle', [True, False])
+def test_token_budget_sampler_covers_every_index_once(shuffle, capsys):
+    dataset = SizedDataset(1203, seed=1)
+    context_lengths, graph_nums, max_triples, _ = dataset.example_sizes()
+    sampler = TokenBudgetBatchSampler(dataset, 4000, shuffle=shuffle, pool_size=100)
+    for _ in range(2):
+        batches = list(sampler)
+        assert capsys.readouterr().out == ''
+        assert sorted(index for batch in batches for index in batch) == list(range(1203))
+        for batch in batches:
+            cost = len(batch) * (context_lengths[batch].max() + graph_nums[batch].max() * max_triples[batch].max())
+            assert len(batch) == 1 or cost <= 4000
+
+
+def test_samplers_report_the_waste_measured_on_construction():
+    dataset = SizedDataset(300)
+    for sampler in [BucketBatchSampler(dataset, 16, [48, 96], [500, 2000], name='train'),
+                    TokenBudgetBatchSampler(dataset, 4000, name='train')]:
+        report = sampler.report()
+        list(sampler)
+        assert report.startswith('train ') and 'padding waste' in report
+        assert sampler.report() == report
+
+
+def test_presampled_negatives_come_from_each_examples_own_candidates(tmp_path):
+    fakes = [[1, 2], [0], [3, 4, 5, 0], [2], [1, 3], [4]]
+    dataset = Dataset(*compiled_split(str(tmp_path) + '/', fakes), presample=True)
+    for _ in range(20):
+        dataset.start_epoch()
+        for index, fake in enumerate(fakes):
+            assert set(dataset.negatives[index].tolist()) <= set(fake)
+    item = dataset[2]
+    assert all(torch.equal(fake, dataset.target_tensor(i)) for fake, i in
+               zip(item['target_list'][1:], dataset.negatives[2].tolist()))
+
+
+def test_presampling_rejects_examples_without_candidates(tmp_path):
+    with pytest.raises(ValueError, match=r'\[1\]'):
+        Dataset(*compiled_split(str(tmp_path) + '/', [[1], [], [0]]), presample=True)
+
+
+def test_tensor_store_items_match_the_on_the_fly_dataset(tmp_path):
+    path = str(tmp_path) + '/'
+    store, vocab = compiled_split(path, [[1, 2], [0], [3, 0], [2, 1]])
+    live = Dataset(store, vocab)
+    save_tensor_store((live.example_tensors(index) for index in range(len(live))), path + 'tensors/', total=len(live))
+    tensors = TensorStore(path + 'tensors/')
+    cached = Dataset(store, vocab, pickle.loads(pickle.dumps(tensors)))
+
+    assert len(tensors) == len(live)
+    for index in range(len(live)):
+        assert_same_item(tensors[index], live.example_tensors(index))
+        np.random.seed(index)
+        expected = live[index]
+        np.random.seed(index)
+        assert_same_item(cached[index], expected)
+
+
+def test_device_loader_passes_cpu_batches_through(tmp_path, monkeypatch):
+    dataset = Dataset(*compiled_split(str(tmp_path) + '/', [[1, 2], [0], [3, 0], [2, 1], [0, 3]]), presample=True)
+    loader = torch.utils.data.DataLoader(dataset, batch_size=2, shuffle=False, collate_fn=collate_fn)
+    device_loader = DeviceLoader(loader, 'cpu')
+    epochs, start_epoch = [], dataset.start_epoch
+    monkeypatch.setattr(dataset, 'start_epoch', lambda: epochs.append(start_epoch()))
+
+    assert len(device_loader) == len(loader) == 3
+    for epoch in range(2):
+        batches = list(device_loader)
+        assert len(epochs) == epoch + 1
+        # >>>>>>>>>> the plain loader does not start an epoch, so it sees the negatives drawn for this pass >>>>>>>>>> #
+        expected = list(loader)
+        assert len(batches) == len(expected)
+        for batch, reference in zip(batches, expected):
+            assert_same_item(batch, reference)
+            assert all(batch[key].device.type == 'cpu' for key in device_keys)
+
+
+def pointer_batch(tmp_path, graph_num):
+    """A collated batch of a compiled split, random concept log-probs and the dense pointer of every example."""
+    dataset = Dataset(*compiled_split(str(tmp_path) + '/', [[0]] * 5, graph_num=graph_num))
+    items = [dataset[index] for index in range(len(dataset))]
+    # >>>>>>>>>> collate_fn sorts the examples by context length >>>>>>>>>> #
+    order = sorted(range(len(items)), key=lambda index: len(items[index]['context']), reverse=True)
+    batch = collate_fn(items)
+    cpt_probs = torch.randn(*batch['concept_ids'].shape[:2], 3, batch['concept_ids'].size(-1)).log_softmax(-1)
+    graphs = [[json_graph(dataset.data['graphs'], g) for g in dataset.data['graphidx'][str(index)]] for index in order]
+    return dataset, batch, cpt_probs, graphs, [preprocess_graph_scan(dataset, g)[-2:] for g in graphs]
+
+
+def test_scatter_concept_probs_matches_the_dense_pointer_on_single_graphs(tmp_path):
+    dataset, batch, cpt_probs, _, dense = pointer_batch(tmp_path, 1)
+    sparse = scatter_concept_probs(cpt_probs, batch['vocab_map'], batch['vocab_ids'], dataset.vocab.n_words)
+    for index, (vocab_maps, map_mask) in enumerate(dense):
+        probs = cpt_probs[index, :len(vocab_maps)]
+        expected = probs.gather(-1, torch.stack(vocab_maps).unsqueeze(1).expand(-1, probs.size(1), -1)).sum(0)
+        assert map_mask.sum() > 0
+        assert torch.allclose(sparse[index], expected.masked_fill(map_mask == 0, 0))
+
+
+def test_scatter_concept_probs_skips_graphs_without_the_word(tmp_path):
+    dataset, batch, cpt_probs, graphs, dense = pointer_batch(tmp_path, 3)
+    sparse = scatter_concept_probs(cpt_probs, batch['vocab_map'], batch['vocab_ids'], dataset.vocab.n_words)
+    words = dataset.vocab.index2word.tolist()
+    missed = 0
+    for index, (vocab_maps, map_mask) in enumerate(dense):
+        probs = cpt_probs[index, :len(vocab_maps)]
+        dense_probs = probs.gather(-1, torch.stack(vocab_maps).unsqueeze(1).expand(-1, probs.size(1), -1))
+        present = torch.tensor([[w in graph['concepts'] for w in words] for graph in graphs[index]]).unsqueeze(1)
+        expected = (dense_probs * present).sum(0).masked_fill(map_mask == 0, 0)
+        assert torch.allclose(sparse[index], expected)
+        # >>>>>>>>>> the dense pointer also added the position-0 log-prob of each graph missing a mapped word >>>>>>>>>> #
+        absent = ~present & (map_mask == 1)
+        old = dense_probs.sum(0).masked_fill(map_mask == 0, 0)
+        assert torch.allclose(old - sparse[index], (probs[..., :1] * absent).sum(0))
+        missed += int(absent.any())
+    assert missed
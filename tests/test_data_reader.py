@@ -0,0 +1,56 @@
+import numpy as np
+
+import config
+from dataprocess.data_reader import Lang, FrozenLang, prune_vocab, save_vocab
+
+special = ['UNK', 'PAD', 'EOS', 'SOS', 'USR', 'SYS', 'SIT', 'CLS', 'SEP']
+
+
+def make_vocab(words):
+    vocab = Lang({i: w for i, w in enumerate(special)})
+    vocab.index_words(words)
+    return vocab
+
+
+def test_prune_vocab_keeps_specials_and_keep_set():
+    vocab = make_vocab(['rare', 'common', 'concept', 'mid'])
+    counts = {'rare': 1, 'common': 9, 'concept': 0, 'mid': 3}
+    pruned = prune_vocab(vocab, counts, keep={'concept', 'absent'}, min_count=3)
+
+    assert [pruned.index2word[i] for i in range(pruned.n_words)] == special + ['common', 'concept', 'mid']
+    assert pruned.word2index['SEP'] == config.SEP_idx
+    assert 'absent' not in pruned.word2index
+
+
+def test_prune_vocab_caps_size_by_frequency():
+    vocab = make_vocab(['a', 'b', 'c', 'd', 'e'])
+    counts = {'a': 5, 'b': 1, 'c': 7, 'd': 7, 'e': 2}
+    pruned = prune_vocab(vocab, counts, keep={'b'}, max_size=len(special) + 3)
+
+    assert [pruned.index2word[i] for i in range(len(special), pruned.n_words)] == ['b', 'c', 'd']
+
+
+def test_prune_vocab_without_limits_is_unchanged():
+    vocab = make_vocab(['x', 'y', 'x', 'z'])
+    pruned = prune_vocab(vocab, {'x': 2, 'y': 1, 'z': 1}, keep=set())
+
+    assert pruned.index2word == vocab.index2word
+    assert pruned.word2index == vocab.word2index
+    assert pruned.word2count == vocab.word2count
+
+
+def test_frozen_lang_lookup_and_decode(tmp_path):
+    save_vocab(make_vocab(['the', 'cat', 'sat']), str(tmp_path))
+    vocab = FrozenLang(str(tmp_path))
+    words = special + ['the', 'cat', 'sat']
+
+    assert vocab.lookup(['cat', 'dog', 'the', 'PAD']).tolist() == [words.index('cat'), config.UNK_idx,
+                                                                    words.index('the'), config.PAD_idx]
+    assert vocab.lookup(['dog', 'aardvark', 'zebra'], default=-1).tolist() == [-1, -1, -1]
+    assert vocab.lookup([]).tolist() == []
+
+    rows = [[words.index('the'), words.index('cat'), config.EOS_idx, words.index('sat')], [config.EOS_idx], []]
+    assert vocab.decode(rows) == [['the', 'cat'], [], []]
+    assert vocab.decode(rows, stop_idx=None) == [['the', 'cat', 'EOS', 'sat'], ['EOS'], []]
+    assert vocab.decode(np.array([[words.index('sat'), words.index('sat')]])) == [['sat', 'sat']]
+    assert vocab.decode([[], []]) == [[], []]
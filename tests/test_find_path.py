@@ -0,0 +1,39 @@
+import pytest
+
+pytest.importorskip('spacy')
+from dataprocess.find_path import PathCache, read_journal
+
+
+def test_path_cache_cuts_a_torn_last_line(tmp_path):
+    path = str(tmp_path / 'path_cache.json')
+    cache = PathCache(path)
+    keys = [PathCache.key(['a'], ['b', str(i)], 2, 25, 12) for i in range(3)]
+    for i, key in enumerate(keys):
+        cache.put(key, [['a', i]])
+    cache.flush()
+    cache.close()
+    with open(path, 'ab') as f:
+        f.write(b'["0123456789abcdef0123456789abcdef", [["tor')
+
+    cache = PathCache(path)
+    assert sorted(cache.offsets) == sorted(keys)
+    assert [cache.get(key) for key in keys] == [[['a', i]] for i in range(3)]
+    # >>>>>>>>>> entries put after the cut start on a line of their own >>>>>>>>>> #
+    cache.put('f' * 32, [])
+    cache.close()
+    cache = PathCache(path)
+    assert cache.get('f' * 32) == [] and cache.get(keys[2]) == [['a', 2]]
+    cache.close()
+
+
+def test_read_journal_resumes_after_a_torn_write(tmp_path):
+    journal_path = str(tmp_path / 'journal')
+    assert read_journal(journal_path) == ([], 0)
+    with open(journal_path, 'w') as f:
+        f.write('[0, true, 120]\n[1, false, 120]\n[2, true, 250]\n[3, tr')
+
+    assert read_journal(journal_path) == ([True, False, True], 250)
+    with open(journal_path) as f:
+        assert f.read() == '[0, true, 120]\n[1, false, 120]\n[2, true, 250]\n'
+    # >>>>>>>>>> a second resume of the same journal sees the same progress >>>>>>>>>> #
+    assert read_journal(journal_path) == ([True, False, True], 250)
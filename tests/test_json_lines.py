@@ -0,0 +1,13 @@
+from dataprocess.json_lines import read_json_lines
+
+
+def test_read_json_lines_cuts_a_torn_last_line(tmp_path):
+    path = str(tmp_path / 'cache.json')
+    assert read_json_lines(path) == []
+    with open(path, 'w') as f:
+        f.write('["a", ["x"]]\n["b", []]\n["c", ["y", "z"')
+
+    assert read_json_lines(path) == [['a', ['x']], ['b', []]]
+    with open(path, 'a') as f:
+        f.write('["c", ["y"]]\n')
+    assert dict(read_json_lines(path)) == {'a': ['x'], 'b': [], 'c': ['y']}
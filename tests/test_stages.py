@@ -0,0 +1,44 @@
+from dataprocess.stages import Stage, run_stages
+
+
+def write(path, text, log):
+    with open(path, 'w') as f:
+        f.write(text)
+    with open(log, 'a') as f:
+        f.write(path[-1])
+
+
+def make_stages(tmp_path, text='a'):
+    log = str(tmp_path / 'log')
+    return [Stage('a', write, (str(tmp_path / 'a'), text, log), outputs=[str(tmp_path / 'a')]),
+            Stage('b', write, (str(tmp_path / 'b'), 'b', log), deps=['a'], outputs=[str(tmp_path / 'b')])]
+
+
+def runs(tmp_path):
+    return (tmp_path / 'log').read_text() if (tmp_path / 'log').exists() else ''
+
+
+def test_outputs_made_before_the_manifest_are_adopted(tmp_path):
+    (tmp_path / 'a').write_text('old')
+    (tmp_path / 'b').write_text('old')
+    run_stages(make_stages(tmp_path), str(tmp_path / 'stages.json'))
+    assert (tmp_path / 'a').read_text() == 'old' and (tmp_path / 'b').read_text() == 'old'
+    assert runs(tmp_path) == ''
+
+
+def test_changed_args_rerun_the_stage_and_its_dependents(tmp_path):
+    manifest_path = str(tmp_path / 'stages.json')
+    run_stages(make_stages(tmp_path), manifest_path)
+    run_stages(make_stages(tmp_path), manifest_path)
+    assert runs(tmp_path) == 'ab'
+
+    run_stages(make_stages(tmp_path, 'c'), manifest_path)
+    assert runs(tmp_path) == 'abab'
+    assert (tmp_path / 'a').read_text() == 'c'
+
+
+def test_a_missing_output_without_a_record_is_rebuilt(tmp_path):
+    (tmp_path / 'b').write_text('old')
+    run_stages(make_stages(tmp_path), str(tmp_path / 'stages.json'))
+    assert runs(tmp_path) == 'ab'
+    assert (tmp_path / 'b').read_text() == 'b'
@@ -0,0 +1,36 @@
+import json
+from copy import deepcopy
+
+import numpy as np
+
+import config
+from dataprocess.triple_store import directed_triple, build_triples
+from benchmark import synthetic_graph, build_triples_scan, labelled_triples
+
+
+def test_build_triples_matches_list_scan():
+    for seed in range(5):
+        e = synthetic_graph(triple_num=300, concept_num=120, seed=seed)
+        before, after = build_triples_scan(deepcopy(e)), build_triples(deepcopy(e))
+        assert before['concepts'] == after['concepts']
+        assert labelled_triples(before) == labelled_triples(after)
+
+
+def test_directed_triple_rebuilds_over_an_existing_store(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, 'triple_shard_bytes', 300)
+    examples = [{'concepts': ['a', 'b', 'c', 'd'][:n], 'labels': [1, 0, 0, 1][:n], 'distances': [0, 1, 1, 2][:n],
+                 'triples': [['a', [i], 'b'], ['b', [2], 'c'], ['c', [3], 'd']][:n - 1]} for i, n in
+                enumerate([2, 3, 4] * 7)]
+    data_path = tmp_path / 'paths.json'
+    data_path.write_text(''.join(json.dumps(e) + '\n' for e in examples))
+    save_path = str(tmp_path / 'store') + '/'
+
+    for workers in [1, 2]:
+        store = directed_triple(str(data_path), save_path, workers=workers)
+        assert len(store) == len(examples)
+        for i, e in enumerate(examples):
+            expected = build_triples(deepcopy(e))
+            assert [store.concepts[c] for c in store[i]['concepts']] == expected['concepts']
+            assert store[i]['head_ids'].tolist() == expected['head_ids']
+            assert np.array_equal(store[i]['triple_labels'], expected['triple_labels'])
+    assert sorted(p.name for p in tmp_path.iterdir()) == ['paths.json', 'store']
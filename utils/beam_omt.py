@@ -170,21 +170,21 @@ class Translator(object):
                     prob = self.model.generator(out)
                     if other_info != ():
                         bz = out.size(0)
-                        cause_repr, concept_label, distance, head, tail, triple_repr, triple_label, vocab_map, map_mask = other_info
+                        cause_repr, concept_label, distance, head, tail, triple_repr, triple_label, vocab_map, vocab_ids = other_info
                         gate, cpt_probs_vocab = self.model.glstm.comp_pointer(out, torch.cat([concept_label for i in range(bz)], axis=0), torch.cat([distance for i in range(bz)], axis=0),
                                                                           torch.cat([head for i in range(bz)], axis=0), torch.cat([tail for i in range(bz)], axis=0),
                                                                           torch.cat([triple_repr for i in range(bz)], axis=0), torch.cat([triple_label for i in range(bz)], axis=0),
-                                                                          torch.cat([vocab_map for i in range(bz)], axis=0), torch.cat([map_mask for i in range(bz)], axis=0))
+                                                                          torch.cat([vocab_map for i in range(bz)], axis=0), torch.cat([vocab_ids for i in range(bz)], axis=0))
                         prob = prob * (1 - gate) + gate * cpt_probs_vocab
                 elif config.model == 'w.o/graph':
-                    cause_repr, concept_ids, concept_label, vocab_map, map_mask = other_info
+                    cause_repr, concept_ids, concept_label, vocab_map, vocab_ids = other_info
                     if cause_repr != None:
                         dec_input[:, 0] = dec_input[:, 0] + cause_repr
                     out, attn_dist = self.model.decoder(dec_input, enc_output, (mask_src, mask_trg))
                     prob = self.model.generator(out)
                     if concept_ids != None:
                         bz = out.size(0)
-                        gate, cpt_probs_vocab = self.model.refer(out, torch.cat([concept_ids for i in range(bz)], axis=0), torch.cat([concept_label for i in range(bz)], axis=0), torch.cat([vocab_map for i in range(bz)], axis=0), torch.cat([map_mask for i in range(bz)], axis=0))
+                        gate, cpt_probs_vocab = self.model.refer(out, torch.cat([concept_ids for i in range(bz)], axis=0), torch.cat([concept_label for i in range(bz)], axis=0), torch.cat([vocab_map for i in range(bz)], axis=0), torch.cat([vocab_ids for i in range(bz)], axis=0))
                         prob = prob * (1 - gate) + gate * cpt_probs_vocab
                 else:
                     out, attn_dist = self.model.decoder(dec_input, enc_output, (mask_src, mask_trg))
@@ -233,19 +233,19 @@ class Translator(object):
             graphs, use_graph = get_graph_from_batch(batch)
             if config.model == 'w.o/refer' or config.model == 'w.o/encoder':
                 if use_graph:
-                    concept_ids, concept_label, distance, relation, head, tail, triple_label, vocab_map, map_mask = graphs
+                    concept_ids, concept_label, distance, relation, head, tail, triple_label, vocab_map, vocab_ids = graphs
                     triple_repr, cause_repr = self.model.glstm.comp_cause(concept_ids, relation, head, tail, triple_label)
-                    other_info = (cause_repr, concept_label, distance, head, tail, triple_repr, triple_label, vocab_map, map_mask)
+                    other_info = (cause_repr, concept_label, distance, head, tail, triple_repr, triple_label, vocab_map, vocab_ids)
             elif config.model == 'w.o/graph':
                 if cause_batch.size(-1):
                     cause_repr = self.model.cause_encoder(self.model.embedding(cause_batch))
                 else:
                     cause_repr = None
                 if use_graph:
-                    concept_ids, concept_label, _, _, _, _, _, vocab_map, map_mask = graphs
+                    concept_ids, concept_label, _, _, _, _, _, vocab_map, vocab_ids = graphs
                 else:
-                    concept_ids, concept_label, vocab_map, map_mask = None, None, None, None
-                other_info = (cause_repr, concept_ids, concept_label, vocab_map, map_mask)
+                    concept_ids, concept_label, vocab_map, vocab_ids = None, None, None, None
+                other_info = (cause_repr, concept_ids, concept_label, vocab_map, vocab_ids)
             # -- Repeat data for beam search
             n_bm = self.beam_size
             n_inst, len_s, d_h = src_enc.size()
@@ -272,9 +272,8 @@ class Translator(object):
 
         batch_hyp, batch_scores = collect_hypothesis_and_scores(inst_dec_beams, 1)
 
-        ret_sentences = []
-        for d in batch_hyp:
-            ret_sentences.append(' '.join([self.model.vocab.index2word[idx] for idx in d[0]]).replace('EOS', ''))
+        ret_sentences = [' '.join(words).replace('EOS', '')
+                         for words in self.model.vocab.decode([d[0] for d in batch_hyp], stop_idx=None)]
 
         return ret_sentences  # , batch_scores
 
@@ -319,10 +318,10 @@ def get_graph_from_batch(batch):
     tail = batch["tails"]
     triple_label = batch["triple_label"]
     vocab_map = batch["vocab_map"].to(config.device)
-    map_mask = batch["map_mask"].to(config.device)
+    vocab_ids = batch["vocab_ids"].to(config.device)
 
     if relation.size(-1) == 0:
         use_graph = False
     else:
         use_graph = True
-    return (concept_ids, concept_label, distance, relation, head, tail, triple_label, vocab_map, map_mask), use_graph
+    return (concept_ids, concept_label, distance, relation, head, tail, triple_label, vocab_map, vocab_ids), use_graph
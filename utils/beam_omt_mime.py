@@ -270,9 +270,8 @@ class Translator(object):
 
         batch_hyp, batch_scores = collect_hypothesis_and_scores(inst_dec_beams, 1)
 
-        ret_sentences = []
-        for d in batch_hyp:
-            ret_sentences.append(' '.join([self.model.vocab.index2word[idx] for idx in d[0]]).replace('EOS', ''))
+        ret_sentences = [' '.join(words).replace('EOS', '')
+                         for words in self.model.vocab.decode([d[0] for d in batch_hyp], stop_idx=None)]
 
         return ret_sentences  # , batch_scores
 
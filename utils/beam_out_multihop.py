@@ -156,7 +156,7 @@ class Translator(object):
                 mask_trg = dec_seq.data.eq(config.PAD_idx).unsqueeze(1)
                 mask_src = torch.cat([mask_src[0].unsqueeze(0)] * mask_trg.size(0), 0)
                 if other_info != None:
-                    cause_repr, concept_label, distance, head, tail, triple_repr, triple_label, vocab_map, map_mask = other_info
+                    cause_repr, concept_label, distance, head, tail, triple_repr, triple_label, vocab_map, vocab_ids = other_info
                     dec_input = self.model.embedding(dec_seq)
                     dec_input[:, 0] = dec_input[:, 0] + cause_repr
                     out, attn_dist = self.model.decoder(dec_input, enc_output, (mask_src, mask_trg))
@@ -164,7 +164,7 @@ class Translator(object):
                     gate, cpt_probs_vocab = self.model.glstm.comp_pointer(out, torch.cat([concept_label for i in range(bz)], axis=0), torch.cat([distance for i in range(bz)], axis=0),
                                                                           torch.cat([head for i in range(bz)], axis=0), torch.cat([tail for i in range(bz)], axis=0),
                                                                           torch.cat([triple_repr for i in range(bz)], axis=0), torch.cat([triple_label for i in range(bz)], axis=0),
-                                                                          torch.cat([vocab_map for i in range(bz)], axis=0), torch.cat([map_mask for i in range(bz)], axis=0))
+                                                                          torch.cat([vocab_map for i in range(bz)], axis=0), torch.cat([vocab_ids for i in range(bz)], axis=0))
                     prob = self.model.generator(out) * (1 - gate) + gate * cpt_probs_vocab
                 else:
                     out, attn_dist = self.model.decoder(self.model.embedding(dec_seq), enc_output,
@@ -214,10 +214,10 @@ class Translator(object):
 
             graphs, use_graph = get_graph_from_batch(batch)
             if use_graph:
-                concept_ids, concept_label, distance, relation, head, tail, triple_label, vocab_map, map_mask = graphs
+                concept_ids, concept_label, distance, relation, head, tail, triple_label, vocab_map, vocab_ids = graphs
                 triple_repr, cause_repr = self.model.glstm.comp_cause(concept_ids, relation, head, tail,
                                                                        triple_label)
-                other_info = (cause_repr, concept_label, distance, head, tail, triple_repr, triple_label, vocab_map, map_mask)
+                other_info = (cause_repr, concept_label, distance, head, tail, triple_repr, triple_label, vocab_map, vocab_ids)
             else:
                 other_info = None
 
@@ -247,9 +247,8 @@ class Translator(object):
 
         batch_hyp, batch_scores = collect_hypothesis_and_scores(inst_dec_beams, 1)
 
-        ret_sentences = []
-        for d in batch_hyp:
-            ret_sentences.append(' '.join([self.model.vocab.index2word[idx] for idx in d[0]]).replace('EOS', ''))
+        ret_sentences = [' '.join(words).replace('EOS', '')
+                         for words in self.model.vocab.decode([d[0] for d in batch_hyp], stop_idx=None)]
 
         return ret_sentences  # , batch_scores
 
@@ -293,11 +292,11 @@ def get_graph_from_batch(batch):
     tail = batch["tails"]
     triple_label = batch["triple_label"]
     vocab_map = batch["vocab_map"].to(config.device)
-    map_mask = batch["map_mask"].to(config.device)
+    vocab_ids = batch["vocab_ids"].to(config.device)
 
     if relation.size(-1) == 0:
         use_graph = False
     else:
         use_graph = True
-    return (concept_ids, concept_label, distance, relation, head, tail, triple_label, vocab_map, map_mask), use_graph
+    return (concept_ids, concept_label, distance, relation, head, tail, triple_label, vocab_map, vocab_ids), use_graph
 